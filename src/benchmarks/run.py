@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import json
+import shutil
+import logging
+import platform
+import tempfile
+import subprocess
+
+import click
+import numpy as np
+
+from src.benchmarks.suite import BENCHMARKS, MissingAPI, run_benchmark
+
+
+RESULTS_DIR = os.path.join("reports", "benchmarks")
+# Root of this tree, and the files of the harness, relative to it, that
+# run against the code of another revision. See run_revision
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__)
+)))
+HARNESS = [
+    os.path.join("src", "benchmarks"),
+    os.path.join("src", "data", "synthetic.py")
+]
+
+
+def git(*args) -> str:
+    return subprocess.run(
+        ["git"] + list(args), check=True,
+        capture_output=True, text=True
+    ).stdout.strip()
+
+
+def results_path(revision: str, output_dir: str) -> str:
+    """Gives the results file of a revision, or the path if it is one."""
+    if os.path.isfile(revision):
+        return revision
+    return os.path.join(output_dir, git("rev-parse", revision) + ".json")
+
+
+@click.group()
+def main():
+    """ Benchmarks the stacking, search, NRI, bootstrap, streaming,
+        single-row latency and train_model hot paths on synthetic trauma
+        data, and compares the results of two revisions.
+    """
+
+
+@main.command()
+@click.argument("name", type=click.Choice(sorted(BENCHMARKS)))
+@click.argument("rows", type=int)
+@click.option("--repeat", default=3)
+@click.option("--params", default="{}")
+def case(name, rows, repeat, params):
+    """ Runs one benchmark in this process, and prints the results as JSON.
+        Prints the reason instead, as skipped, if the code under test lacks
+        an API the benchmark uses.
+    """
+    try:
+        result = run_benchmark(name, rows, repeat, json.loads(params))
+    except (ImportError, MissingAPI) as e:
+        result = {"name": name, "rows": rows, "skipped": str(e)}
+    click.echo(json.dumps(result))
+
+
+@main.command()
+@click.option("--bench", "-b", multiple=True,
+              type=click.Choice(sorted(BENCHMARKS)),
+              help="Benchmarks to run. All by default.")
+@click.option("--rows", "-n", multiple=True, type=int,
+              help="Rows to run at, instead of each benchmark's defaults.")
+@click.option("--max-rows", type=int, default=None,
+              help="Skip the default rows above this.")
+@click.option("--repeat", default=3)
+@click.option("--params", "-p", multiple=True,
+              help="Benchmark keyword argument, e.g. n_base=5 or "
+                   "compact=true. JSON values.")
+@click.option("--revision", "-r", default=None,
+              help="Benchmark this git revision instead of the work tree.")
+@click.option("--output-dir", type=click.Path(), default=RESULTS_DIR)
+def run(bench, rows, max_rows, repeat, params, revision, output_dir):
+    """ Runs the benchmarks, each size in a fresh process, and saves the
+        results to OUTPUT_DIR/<commit>.json. Exits with 1 if a benchmark
+        failed.
+    """
+    logger = logging.getLogger(__name__)
+    output_dir = os.path.abspath(output_dir)
+    if revision is not None:
+        run_revision(revision, bench, rows, max_rows, repeat, params, output_dir)
+        return
+
+    kwargs = {}
+    for p in params:
+        k, v = p.split("=", 1)
+        kwargs[k] = json.loads(v)
+
+    results = []
+    failed = []
+    for name in bench or sorted(BENCHMARKS):
+        func, default_rows = BENCHMARKS[name]
+        accepted = func.__code__.co_varnames[:func.__code__.co_argcount]
+        accepted += ("compact", )
+        case_params = {k: v for k, v in kwargs.items() if k in accepted}
+        for n in rows or default_rows:
+            if not rows and max_rows is not None and n > max_rows:
+                continue
+            logger.info("running %s at %d rows", name, n)
+            completed = subprocess.run(
+                [sys.executable, "-m", "src.benchmarks.run", "case", name,
+                 str(n), "--repeat", str(repeat),
+                 "--params", json.dumps(case_params)],
+                capture_output=True, text=True
+            )
+            if completed.returncode != 0:
+                # Run the rest, e.g. if the code of a revision has a bug
+                logger.error(
+                    "%s at %d rows failed:\n%s", name, n,
+                    completed.stderr.strip()
+                )
+                failed.append((name, n))
+                continue
+            result = json.loads(completed.stdout.strip().splitlines()[-1])
+            if "skipped" in result:
+                logger.warning(
+                    "skipped %s at %d rows: %s", name, n, result["skipped"]
+                )
+                continue
+            logger.info(
+                "%s at %d rows: %.3fs, peak %.0f MB", name, n,
+                min(result["wall"]), result["peak_rss"] / 2 ** 20
+            )
+            results.append(result)
+
+    commit = git("rev-parse", "HEAD")
+    report = {
+        "commit": commit,
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "results": results
+    }
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, commit + ".json")
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    logger.info("saved results to %s", path)
+    if failed:
+        sys.exit(1)
+
+
+def run_revision(revision, bench, rows, max_rows, repeat, params, output_dir):
+    """Runs the benchmarks of this tree against the code of a revision.
+
+    The revision is checked out in a temporary git worktree, and the
+    harness of this tree copied into it, so both revisions run the same
+    benchmarks on the same data. The benchmarks import the code under test
+    from the worktree, and are skipped if it lacks their APIs.
+    """
+    worktree = tempfile.mkdtemp(prefix="pemett-bench-")
+    git("worktree", "add", "--detach", worktree, revision)
+    try:
+        for path in HARNESS:
+            source = os.path.join(ROOT, path)
+            target = os.path.join(worktree, path)
+            if os.path.isdir(source):
+                shutil.copytree(
+                    source, target, dirs_exist_ok=True,
+                    ignore=shutil.ignore_patterns("__pycache__")
+                )
+            else:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.copy2(source, target)
+        args = [sys.executable, "-m", "src.benchmarks.run", "run",
+                "--repeat", str(repeat), "--output-dir", output_dir]
+        args += [a for b in bench for a in ("--bench", b)]
+        args += [a for n in rows for a in ("--rows", str(n))]
+        args += [a for p in params for a in ("--params", p)]
+        if max_rows is not None:
+            args += ["--max-rows", str(max_rows)]
+        env = {**os.environ, "PYTHONPATH": worktree}
+        returncode = subprocess.run(args, cwd=worktree, env=env).returncode
+    finally:
+        git("worktree", "remove", "--force", worktree)
+        shutil.rmtree(worktree, ignore_errors=True)
+    if returncode != 0:
+        sys.exit(returncode)
+
+
+@main.command()
+@click.argument("baseline")
+@click.argument("contender")
+@click.option("--output-dir", type=click.Path(), default=RESULTS_DIR)
+@click.option("--threshold", default=1.1,
+              help="Ratio of median times above which a case is slower.")
+def compare(baseline, contender, output_dir, threshold):
+    """ Compares the median wall times and peak memory of two results,
+        given as revisions or files, with the time and count of each stage.
+        Exits with 1 if a case got slower.
+    """
+    reports = []
+    for revision in (baseline, contender):
+        with open(results_path(revision, output_dir)) as f:
+            reports.append({
+                (r["name"], r["rows"], json.dumps(r["params"], sort_keys=True)): r
+                for r in json.load(f)["results"]
+            })
+
+    slower = False
+    click.echo("{:<12}{:>10}{:>12}{:>12}{:>8}{:>12}{:>12}".format(
+        "benchmark", "rows", "before (s)", "after (s)", "ratio",
+        "before (MB)", "after (MB)"
+    ))
+    for key in sorted(set(reports[0]) & set(reports[1])):
+        before, after = reports[0][key], reports[1][key]
+        t0, t1 = np.median(before["wall"]), np.median(after["wall"])
+        ratio = t1 / t0
+        flag = ""
+        if ratio > threshold:
+            flag, slower = "  slower", True
+        elif ratio < 1 / threshold:
+            flag = "  faster"
+        click.echo("{:<12}{:>10}{:>12.3f}{:>12.3f}{:>8.2f}{:>12.0f}{:>12.0f}{}".format(
+            key[0], key[1], t0, t1, ratio,
+            before["peak_rss"] / 2 ** 20, after["peak_rss"] / 2 ** 20, flag
+        ))
+        for stage in after["stages"]:
+            if stage in before["stages"] and len(after["stages"]) > 1:
+                s0 = np.median(before["stages"][stage])
+                s1 = np.median(after["stages"][stage])
+                # Number of times the stage ran, if recorded
+                n0 = before.get("counts", {}).get(stage, "")
+                n1 = after.get("counts", {}).get(stage, "")
+                click.echo("  {:<26}{:>12.3f}{:>12.3f}{:>8.2f}{:>12}{:>12}".format(
+                    stage, s0, s1, s1 / s0, n0, n1
+                ))
+
+    sys.exit(1 if slower else 0)
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
@@ -0,0 +1,410 @@
+import os
+import time
+import inspect
+import resource
+import tempfile
+import itertools as it
+
+from contextlib import contextmanager
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+from sklearn.linear_model import LogisticRegression
+from sklearn.naive_bayes import GaussianNB
+from sklearn.tree import DecisionTreeClassifier
+from sklearn.ensemble import (
+    RandomForestClassifier,
+    HistGradientBoostingClassifier
+)
+from sklearn.model_selection import StratifiedKFold
+
+from src.data.synthetic import (
+    make_trauma_data,
+    CATEGORICAL_FEATURES,
+    CONTINUOUS_FEATURES
+)
+
+# The code under test is imported in the benchmarks, so that a revision
+# that lacks an API skips the benchmarks that use it. See run_revision
+
+
+class MissingAPI(Exception):
+    """Raised when the code under test lacks an API a benchmark uses."""
+
+
+class WallTimings():
+    """Times the stages of the benchmarks, for revisions without timings.
+
+    A minimal Timings, used if src.models.timing is missing. Only the
+    stages timed by the benchmarks themselves are recorded.
+    """
+    active = None
+
+    def __init__(self):
+        self.records = []
+        self.wall = None
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        WallTimings.active = self
+        return self
+
+    def __exit__(self, *args):
+        self.wall = time.perf_counter() - self._start
+        WallTimings.active = None
+
+    def report(self) -> pd.DataFrame:
+        """Gives the total time and count of each stage."""
+        records = pd.DataFrame(self.records, columns=["stage", "seconds"])
+        return records.groupby("stage").seconds.agg(
+            total="sum", count="size"
+        )
+
+
+@contextmanager
+def wall_timed(stage: str, **labels):
+    """Times a stage into the active WallTimings. See timed."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if WallTimings.active is not None:
+            WallTimings.active.records.append(
+                {"stage": stage, "seconds": time.perf_counter() - start}
+            )
+
+
+try:
+    from src.models.timing import Timings, timed
+except ImportError:
+    Timings, timed = WallTimings, wall_timed
+
+
+# Keyword arguments that are left out for code under test that does not
+# take them, if they have these values, as it then behaves the same. Seeds
+# only make the runs repeatable
+DEFAULTS = {
+    "n_jobs": 1,
+    "search": "exhaustive",
+    "random_state": 0
+}
+
+
+def call(func: Callable, *args, **kwargs):
+    """Calls a function or class of the code under test.
+
+    Args:
+        func: Function, method or class.
+        args: Positional arguments.
+        kwargs: Keyword arguments. Those func does not take are left out if
+            they have their values in DEFAULTS.
+
+    Returns:
+        What func returns.
+
+    Raises:
+        MissingAPI: If func does not take a keyword argument.
+    """
+    parameters = inspect.signature(func).parameters
+    if not any(p.kind == p.VAR_KEYWORD for p in parameters.values()):
+        for k in [k for k in kwargs if k not in parameters]:
+            if k not in DEFAULTS or kwargs[k] != DEFAULTS[k]:
+                raise MissingAPI("{f} takes no {k}".format(
+                    f=func.__qualname__, k=k
+                ))
+            del kwargs[k]
+
+    return func(*args, **kwargs)
+
+
+def method(obj, name: str) -> Callable:
+    """Gives a method of the code under test, or raises MissingAPI."""
+    if not hasattr(obj, name):
+        raise MissingAPI("{c} has no {n}".format(
+            c=obj.__class__.__name__, n=name
+        ))
+
+    return getattr(obj, name)
+
+
+def make_base_clfs(n_base: int) -> list:
+    """Gives the first n_base of a fixed pool of base classifiers."""
+    pool = [
+        LogisticRegression(max_iter=1000),
+        RandomForestClassifier(n_estimators=50, max_depth=8),
+        HistGradientBoostingClassifier(max_iter=50),
+        GaussianNB(),
+        DecisionTreeClassifier(max_depth=6)
+    ]
+    if not 1 <= n_base <= len(pool):
+        raise ValueError(
+            "n_base should be between 1 and {n}, got {g}".format(
+                n=len(pool), g=n_base)
+        )
+
+    return pool[:n_base]
+
+
+def make_all_breaks(grid: int) -> list:
+    """Gives the first grid breaks of the grid used in the notebooks."""
+    all_breaks = [
+        (0, ) + x + (np.inf, )
+        for x in it.combinations(np.arange(0.01, 1, 0.05), r=3)
+    ]
+
+    return all_breaks[:grid]
+
+
+def make_all_hyper_parameters(grid: int) -> list:
+    """Gives grid sets of hyper parameters, two values of C by breaks."""
+    return [
+        {"logisticregression__C": C, "breaks": breaks}
+        for C in (0.1, 1.0)
+        for breaks in make_all_breaks(max(1, grid // 2))
+    ][:grid]
+
+
+def make_classifier(n_base: int, n_jobs: int):
+    from src.models.classifiers import StackedGeneralizationClassifier
+
+    return call(
+        StackedGeneralizationClassifier,
+        base_clfs=make_base_clfs(n_base),
+        meta_clf=LogisticRegression(),
+        n_jobs=n_jobs,
+        random_state=0
+    )
+
+
+def bench_stacking(data: tuple, n_base: int = 3,
+                   n_jobs: int = 1) -> None:
+    """Fits the stacked classifier and predicts with it."""
+    X, y, _ = data
+    sgclf = make_classifier(n_base, n_jobs)
+    sgclf.hyper_parameters = {"breaks": (0, 0.05, 0.1, 0.2, np.inf)}
+    with timed("fit"):
+        sgclf.fit(X, y)
+    with timed("predict_proba_meta"):
+        method(sgclf, "predict_proba_meta")(X)
+    with timed("predict"):
+        sgclf.predict(X)
+
+
+def bench_search(data: tuple, n_base: int = 2,
+                 grid: int = 8, inner_folds: int = 2, outer_folds: int = 2,
+                 search: str = "exhaustive", n_jobs: int = 1) -> None:
+    """Searches the hyper parameters with the outer cross-validation."""
+    X, y, _ = data
+    sgclf = make_classifier(n_base, 1)
+    with timed("cv_outer_loop"):
+        call(
+            sgclf.cv_outer_loop,
+            all_hyper_parameters=make_all_hyper_parameters(grid),
+            X=X, y=y, refit=True, inner_folds=inner_folds,
+            outer_folds=outer_folds, search=search, n_jobs=n_jobs
+        )
+
+
+def bench_breaks(data: tuple, grid: int = 1140) -> None:
+    """Scores a grid of breaks, and searches the optimal breaks."""
+    from src.models.metrics import (
+        compute_binned_roc_aucs,
+        find_optimal_breaks
+    )
+
+    X, y, tc = data
+    rng = np.random.default_rng(0)
+    y_prob = np.clip((tc + rng.random(len(tc))) / 4, 0, 1)
+    with timed("compute_binned_roc_aucs"):
+        compute_binned_roc_aucs(y_prob, y, make_all_breaks(grid))
+    with timed("find_optimal_breaks"):
+        find_optimal_breaks([y_prob], [y])
+
+
+def bench_nri(data: tuple) -> None:
+    """Computes the NRI of a noisy copy of the triage categories."""
+    from src.models.metrics import calculate_nri
+
+    X, y, tc = data
+    rng = np.random.default_rng(0)
+    y_new = np.clip(tc + rng.integers(-1, 2, len(tc)), 0, 3)
+    with timed("calculate_nri"):
+        calculate_nri(y_true=y, y_old=tc, y_new=y_new)
+
+
+def bench_bootstrap(data: tuple, n_base: int = 2,
+                    grid: int = 2, N: int = 10, mode: str = "predictions",
+                    n_jobs: int = 1) -> None:
+    """Bootstraps the performance of the stacked classifier."""
+    from src.models.classifiers import StackedGeneralizationClassifier
+    from src.models.metrics import bootstrap
+
+    X, y, tc = data
+    base_clfs = make_base_clfs(n_base)
+    keys = [clf.__class__.__name__ for clf in base_clfs]
+    keys.append(StackedGeneralizationClassifier.__name__)
+    with timed("bootstrap"):
+        call(
+            bootstrap,
+            X=X, y=y, tc=tc, keys=keys, base_clfs=base_clfs,
+            meta_clf=LogisticRegression(),
+            all_hyper_parameters=make_all_hyper_parameters(grid),
+            N=N, n_jobs=n_jobs, mode=mode, random_state=0
+        )
+
+
+def bench_streaming(data: tuple, n_base: int = 3, fit_rows: int = 10_000,
+                    chunk_size: int = 100_000) -> None:
+    """Fits the stacked classifier, and streams predictions to a file."""
+    X, y, _ = data
+    sgclf = make_classifier(n_base, 1)
+    sgclf.hyper_parameters = {"breaks": (0, 0.05, 0.1, 0.2, np.inf)}
+    with timed("fit"):
+        sgclf.fit(X.iloc[:fit_rows], y.iloc[:fit_rows])
+    with tempfile.TemporaryDirectory() as tmp:
+        with timed("predict_to_file"):
+            method(sgclf, "predict_to_file")(
+                X, os.path.join(tmp, "predictions.csv"), chunk_size
+            )
+
+
+def bench_latency(data: tuple, n_base: int = 3, calls: int = 100) -> None:
+    """Scores one row at a time, with predict and with the compiled scorer.
+
+    Each stage is the total of the calls, so the ratio of the stages is
+    the speed-up of the compiled scorer.
+    """
+    X, y, _ = data
+    sgclf = make_classifier(n_base, 1)
+    compile_ = method(sgclf, "compile")
+    sgclf.hyper_parameters = {"breaks": (0, 0.05, 0.1, 0.2, np.inf)}
+    sgclf.fit(X, y)
+    with timed("compile"):
+        compiled = compile_()
+    rows = [X.iloc[[i % len(X)]] for i in range(calls)]
+    with timed("predict_row"):
+        for row in rows:
+            sgclf.predict(row)
+    rows = [row.to_numpy()[0] for row in rows]
+    with timed("compiled_predict_row"):
+        for row in rows:
+            compiled.predict(row)
+
+
+def bench_train_model(data: tuple, n_base: int = 3,
+                      inner_folds: int = 3, n_jobs: int = 1) -> None:
+    """Fits the functional stacking pipeline to half the rows, and predicts
+    the other half. Each base classifier is fitted inner_folds times, and
+    once to all training rows, see the base_fit and base_refit counts.
+    """
+    from src.models import train_model
+
+    X, y, _ = data
+    n = len(X) // 2
+    base_clfs = make_base_clfs(n_base)
+    call(
+        train_model.predict,
+        base_clfs={clf.__class__.__name__.lower(): clf for clf in base_clfs},
+        meta_clf=LogisticRegression(),
+        inner_loop=StratifiedKFold(n_splits=inner_folds),
+        hyper_parameters={"breaks": (0, 0.05, 0.1, 0.2, np.inf)},
+        X_train=X.iloc[:n],
+        y_train=y.iloc[:n],
+        X_val=X.iloc[n:],
+        n_jobs=n_jobs
+    )
+
+
+# Benchmarks, with the rows they run at by default
+BENCHMARKS = {
+    "stacking": (bench_stacking, [1_000, 10_000, 100_000]),
+    "search": (bench_search, [1_000, 10_000]),
+    "breaks": (bench_breaks, [1_000, 100_000, 1_000_000]),
+    "nri": (bench_nri, [1_000, 100_000, 1_000_000]),
+    "bootstrap": (bench_bootstrap, [1_000, 10_000]),
+    "streaming": (bench_streaming, [100_000, 1_000_000]),
+    "latency": (bench_latency, [1_000, 10_000]),
+    "train_model": (bench_train_model, [1_000, 10_000, 100_000])
+}
+
+
+def run_benchmark(name: str, rows: int, repeat: int = 3,
+                  params: dict = None) -> dict:
+    """Runs one benchmark on synthetic data.
+
+    The data is simulated once, and the benchmark is run repeat times on
+    it. Meant to run in a fresh process, see src.benchmarks.run, so that
+    the peak memory is that of the benchmark alone.
+
+    Args:
+        name: Name of the benchmark, a key of BENCHMARKS.
+        rows: Number of simulated patients.
+        repeat: Number of runs.
+        params: Optional. Keyword arguments of the benchmark, e.g. n_base.
+            If compact is true, the features are converted with
+            compact_features first.
+
+    Returns:
+        Dictionary with the wall time of each run, the total time of each
+        stage in each run, including the stages timed by the models, the
+        number of times each stage ran in the last run, e.g. of base_fit,
+        and the peak memory after simulating the data and after the runs,
+        in bytes.
+
+    Raises:
+        ImportError, MissingAPI: If the code under test lacks an API the
+            benchmark uses.
+    """
+    func, _ = BENCHMARKS[name]
+    params = {} if params is None else params
+    kwargs = {k: v for k, v in params.items() if k != "compact"}
+    X, y, tc = make_trauma_data(rows, random_state=0)
+    if params.get("compact"):
+        from src.data.transform import build_schema, compact_features
+
+        schema = build_schema(None, CATEGORICAL_FEATURES, CONTINUOUS_FEATURES)
+        X = compact_features(X, schema)
+    data = (X, y, tc)
+    data_rss = peak_rss()
+
+    walls = []
+    stages = {}
+    counts = {}
+    for _ in range(repeat):
+        with Timings() as timings:
+            func(data, **kwargs)
+        walls.append(timings.wall)
+        report = timings.report()
+        for stage, seconds in report.total.items():
+            stages.setdefault(stage, []).append(seconds)
+        counts = {stage: int(n) for stage, n in report["count"].items()}
+
+    return {
+        "name": name,
+        "rows": rows,
+        "params": params,
+        "wall": walls,
+        "stages": stages,
+        "counts": counts,
+        "data_rss": data_rss,
+        "peak_rss": peak_rss(),
+        "peak_rss_children": peak_rss(children=True)
+    }
+
+
+def peak_rss(children: bool = False) -> int:
+    """Gives the peak resident memory of this process, in bytes.
+
+    Args:
+        children: If True, the peak of the largest child process that has
+            been waited for instead, e.g. of finished joblib workers.
+
+    Returns:
+        Peak resident set size. Linux reports it in kilobytes.
+    """
+    who = resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+
+    return resource.getrusage(who).ru_maxrss * 1024
@@ -0,0 +1,36 @@
+import pandas as pd
+
+from typing import Iterable, Iterator, Union
+
+
+def iter_chunks(X: Union[pd.DataFrame, str, Iterable[pd.DataFrame]],
+                chunk_size: int = 100000, **kwargs) -> Iterator[pd.DataFrame]:
+    """Reads features in chunks of rows, without loading them all.
+
+    Args:
+        X: Features, as a data frame, an iterable of data frames, or the
+            path of a CSV or Parquet file. Parquet needs pyarrow.
+        chunk_size: Rows per chunk. Iterables are passed through as they
+            are chunked.
+        kwargs: Passed on to pd.read_csv, or pyarrow's iter_batches, e.g.
+            index_col or columns.
+
+    Yields:
+        Data frames of at most chunk_size rows, unless from an iterable.
+    """
+    if isinstance(X, pd.DataFrame):
+        for start in range(0, len(X), chunk_size):
+            yield X.iloc[start:start + chunk_size]
+    elif isinstance(X, str) and X.endswith((".parquet", ".pq")):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Reading Parquet needs pyarrow, pip install pyarrow")
+        for batch in pq.ParquetFile(X).iter_batches(
+                batch_size=chunk_size, **kwargs):
+            yield batch.to_pandas()
+    elif isinstance(X, str):
+        with pd.read_csv(X, chunksize=chunk_size, **kwargs) as reader:
+            yield from reader
+    else:
+        yield from X
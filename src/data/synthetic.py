@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+
+from typing import Optional, Union
+
+
+CONTINUOUS_FEATURES = ["age", "hr", "sbp", "dbp", "spo2", "rr", "delay"]
+CATEGORICAL_FEATURES = [
+    "moi", "sex", "mot", "tran", "egcs", "mgcs", "vgcs", "avpu"
+]
+
+
+def make_trauma_data(n_samples: int, missing_rate: float = 0.0,
+                     prevalence: float = 0.15,
+                     random_state: Optional[Union[int, np.random.Generator]] = None
+                     ) -> tuple:
+    """Simulates trauma patients, for benchmarks and examples.
+
+    The features have the names, ranges and label encoding of the
+    processed TTRIS data. Mortality depends on the vital signs and GCS,
+    and the clinicians' triage category is a noisy reading of the same
+    risk, so the metrics behave roughly as on the real data.
+
+    Args:
+        n_samples: Number of patients.
+        missing_rate: Proportion of feature values set to missing.
+        prevalence: Approximate proportion of patients who die.
+        random_state: Optional. Seed or random number generator.
+
+    Returns:
+        Tuple of features, all-cause 30 day mortality (s30d) and
+        clinicians' triage categories (tc), 0 for green to 3 for red.
+    """
+    rng = np.random.default_rng(random_state)
+    n = n_samples
+
+    # Severity of injury, drives the vital signs and the outcome
+    severity = rng.gamma(shape=2.0, scale=0.5, size=n)
+    egcs = np.clip(np.round(4 - severity * rng.uniform(0.5, 1.5, n)), 1, 4)
+    vgcs = np.clip(np.round(5 - severity * rng.uniform(0.5, 2.0, n)), 1, 5)
+    mgcs = np.clip(np.round(6 - severity * rng.uniform(0.5, 2.0, n)), 1, 6)
+    gcs = egcs + vgcs + mgcs
+    X = pd.DataFrame({
+        "age": np.clip(rng.normal(35, 14, n), 18, 95).round(),
+        "hr": np.clip(rng.normal(85 + 12 * severity, 15), 30, 220).round(),
+        "sbp": np.clip(rng.normal(128 - 15 * severity, 20), 40, 250).round(),
+        "dbp": np.clip(rng.normal(80 - 8 * severity, 12), 20, 150).round(),
+        "spo2": np.clip(rng.normal(98 - 3 * severity, 2.5), 50, 100).round(),
+        "rr": np.clip(rng.normal(18 + 3 * severity, 4), 4, 60).round(),
+        "delay": rng.lognormal(mean=5, sigma=1.2, size=n).round(),
+        "moi": rng.choice(8, size=n, p=[.45, .25, .03, .12, .02, .1, .02, .01]),
+        "sex": rng.choice(2, size=n, p=[.2, .8]),
+        "mot": rng.choice(5, size=n, p=[.4, .3, .15, .1, .05]),
+        "tran": rng.choice(2, size=n, p=[.6, .4]),
+        "egcs": egcs - 1,
+        "mgcs": mgcs - 1,
+        "vgcs": vgcs - 1,
+        "avpu": np.digitize(gcs, [8, 12, 14])
+    })
+
+    # Mortality, from a logistic model of the simulated risk
+    risk = (
+        0.8 * severity + 0.03 * (X.age - 35) - 0.25 * (gcs - 15) -
+        0.02 * (X.sbp - 120) + 0.05 * (X.rr - 18)
+    )
+    risk = (risk - risk.mean()) / risk.std()
+    intercept = np.log(prevalence / (1 - prevalence)) - 0.5
+    y = pd.Series(
+        rng.random(n) < 1 / (1 + np.exp(-(intercept + 1.5 * risk))),
+        name="s30d"
+    ).astype(int)
+
+    # Clinicians see the risk, with noise
+    perceived = risk + rng.normal(0, 1, n)
+    tc = pd.Series(
+        np.digitize(perceived, np.quantile(perceived, [.4, .7, .9])),
+        name="tc"
+    )
+
+    if missing_rate > 0:
+        X = X.mask(rng.random(X.shape) < missing_rate)
+
+    return X, y, tc
@@ -1,6 +1,7 @@
 import numpy as np
 import pandas as pd
 
+from typing import Optional
 from sklearn.preprocessing import LabelEncoder
 
 def parse_value_labels(data_dictionary: pd.DataFrame) -> dict:
@@ -26,5 +27,90 @@ def parse_value_labels(data_dictionary: pd.DataFrame) -> dict:
 
 def label_categorical(X, cat_features): 
     le = LabelEncoder()
-    X.loc[:, cat_features] = X.loc[:, cat_features].apply(le.fit_transform)
-    return X
\ No newline at end of file
+    # Assign whole columns, so the codes replace the object columns, and
+    # keep them in the smallest integer type that holds them
+    X[cat_features] = X.loc[:, cat_features].apply(
+        lambda x: pd.to_numeric(le.fit_transform(x), downcast="integer")
+    )
+    return X
+
+
+def build_schema(data_dictionary: Optional[pd.DataFrame],
+                 cat_features: list, cont_features: list) -> dict:
+    """Builds compact data types for the features.
+
+    Categorical features get the smallest signed integer type that holds
+    the codes in their value labels, and one more code, e.g. for the
+    missing values that label_categorical gives a code of their own.
+    Categorical features without value labels get int16. Continuous
+    features get float32, which holds the vital signs exactly.
+
+    Args:
+        data_dictionary: Optional. Data dictionary, as in
+            data/raw/data_dictionary.csv. If None, no value labels.
+        cat_features: Names of the categorical features.
+        cont_features: Names of the continuous features.
+
+    Returns:
+        Dictionary with the data type of each feature.
+    """
+    value_labels = (
+        {} if data_dictionary is None
+        else parse_value_labels(data_dictionary)
+    )
+    schema = {}
+    for feature in cat_features:
+        codes = value_labels.get(feature)
+        if codes is None:
+            schema[feature] = np.dtype(np.int16)
+            continue
+        n_codes = max(len(codes), max(codes) + 1) + 1
+        schema[feature] = np.dtype(
+            np.int8 if n_codes <= np.iinfo(np.int8).max else np.int16
+        )
+    for feature in cont_features:
+        schema[feature] = np.dtype(np.float32)
+
+    return schema
+
+
+def compact_features(X: pd.DataFrame, schema: dict,
+                     missing_code: int = -1) -> pd.DataFrame:
+    """Converts features to the compact data types of a schema.
+
+    Apply the same schema to all partitions, so the folds and bootstrap
+    samples all get the same compact matrix. See SharedData.
+
+    Args:
+        X: Features, with categorical features as integer codes, e.g.
+            from label_categorical.
+        schema: Data type of each feature, from build_schema. Features
+            not in the schema get float32.
+        missing_code: Code of missing categorical values.
+
+    Returns:
+        Features with compact data types, in the same order.
+
+    Raises:
+        ValueError: If a categorical code does not fit its data type, or
+            is not an integer.
+    """
+    columns = {}
+    for feature in X.columns:
+        dtype = schema.get(feature, np.dtype(np.float32))
+        x = X[feature]
+        if np.issubdtype(dtype, np.integer):
+            values = x.fillna(missing_code).to_numpy()
+            info = np.iinfo(dtype)
+            if len(values) > 0 and (
+                np.any(values != np.round(values)) or
+                values.min() < info.min or values.max() > info.max
+            ):
+                raise ValueError(
+                    "Codes of {f} do not fit in {d}".format(f=feature, d=dtype)
+                )
+            columns[feature] = values.astype(dtype)
+        else:
+            columns[feature] = x.to_numpy(dtype=dtype)
+
+    return pd.DataFrame(columns, index=X.index)
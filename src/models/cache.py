@@ -0,0 +1,154 @@
+import os
+import uuid
+import pickle
+
+import joblib
+import numpy as np
+
+from typing import Any, Optional
+from joblib import hash as joblib_hash
+
+# Suffixes of the files of arrays and of objects, e.g. fitted estimators
+ARRAY_SUFFIX = ".npy"
+OBJECT_SUFFIX = ".joblib"
+
+
+class ArrayCache():
+    """Disk cache of arrays, addressed by the hash of their inputs.
+
+    Each array is stored as a .npy file named by its key, and other
+    objects, e.g. fitted estimators, as .joblib files. Reading a file
+    updates its modification time, so that the least recently used files
+    are evicted first when the cache grows beyond max_bytes. Files are
+    written to a temporary name and then renamed, so several processes
+    can share the same directory.
+
+    Args:
+        directory: Directory of the cache. Created if missing.
+        max_bytes: Optional. Greatest total size of the cached arrays.
+            If None, nothing is evicted.
+    """
+    def __init__(self, directory: str, max_bytes: Optional[int] = None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(*args) -> str:
+        """Hashes the inputs that determine an array.
+
+        Args:
+            args: Anything joblib can hash. E.g. estimators, data frames
+                and fold indices.
+
+        Returns:
+            Key of the array.
+        """
+        return joblib_hash(args)
+
+    def _path(self, key: str, suffix: str = ARRAY_SUFFIX) -> str:
+        return os.path.join(self.directory, key + suffix)
+
+    def _tmp_path(self, key: str) -> str:
+        return os.path.join(
+            self.directory, ".{k}.{u}.tmp".format(k=key, u=uuid.uuid4().hex)
+        )
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """Reads an array from the cache.
+
+        Args:
+            key: Key of the array.
+
+        Returns:
+            The array, or None if it is not in the cache.
+        """
+        path = self._path(key)
+        try:
+            array = np.load(path, allow_pickle=False)
+            os.utime(path)
+        except (FileNotFoundError, ValueError, OSError):
+            return None
+
+        return array
+
+    def set(self, key: str, array: np.ndarray) -> None:
+        """Writes an array to the cache, and evicts old arrays if needed.
+
+        Args:
+            key: Key of the array.
+            array: Array to cache.
+        """
+        tmp_path = self._tmp_path(key)
+        with open(tmp_path, "wb") as f:
+            np.save(f, np.asarray(array), allow_pickle=False)
+        os.replace(tmp_path, self._path(key))
+
+        if self.max_bytes is not None:
+            self.evict()
+
+    def get_object(self, key: str) -> Optional[Any]:
+        """Reads an object from the cache, e.g. a fitted estimator.
+
+        Args:
+            key: Key of the object.
+
+        Returns:
+            The object, or None if it is not in the cache.
+        """
+        path = self._path(key, OBJECT_SUFFIX)
+        try:
+            obj = joblib.load(path)
+            os.utime(path)
+        except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+            return None
+
+        return obj
+
+    def set_object(self, key: str, obj: Any) -> None:
+        """Writes an object to the cache, and evicts old files if needed.
+
+        Args:
+            key: Key of the object.
+            obj: Object to cache, anything joblib can pickle.
+        """
+        tmp_path = self._tmp_path(key)
+        joblib.dump(obj, tmp_path)
+        os.replace(tmp_path, self._path(key, OBJECT_SUFFIX))
+
+        if self.max_bytes is not None:
+            self.evict()
+
+    def _entries(self):
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith((ARRAY_SUFFIX, OBJECT_SUFFIX)):
+                yield entry
+
+    def evict(self) -> None:
+        """Removes the least recently used files beyond max_bytes."""
+        entries = []
+        for entry in self._entries():
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self) -> None:
+        """Removes all arrays and objects from the cache."""
+        for entry in self._entries():
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
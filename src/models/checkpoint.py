@@ -0,0 +1,122 @@
+import os
+import json
+
+import numpy as np
+
+from typing import Optional
+from joblib import hash as joblib_hash
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class Checkpoint():
+    """Append-only file of finished cells of a search, one JSON per line.
+
+    Each line holds the key of a cell, e.g. of a pair of hyper parameters
+    and outer fold, its labels and its predictions. Lines are only ever
+    appended, under an exclusive lock where the platform has one, so
+    several processes, or hosts on a file system with working locks, can
+    share one file. Lines are read incrementally, from where the last read
+    stopped. A line cut short by a crash is skipped.
+
+    Args:
+        path: Path of the file. Created, with its directory, if missing.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._records = {}
+        self._offset = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(*args) -> str:
+        """Hashes the inputs that determine a cell. See ArrayCache.key."""
+        return joblib_hash(args)
+
+    def __getstate__(self):
+        # Workers read the file themselves
+        state = self.__dict__.copy()
+        state["_records"] = {}
+        state["_offset"] = 0
+        return state
+
+    def __len__(self):
+        self.load()
+        return len(self._records)
+
+    def __contains__(self, key: str):
+        return self.get(key) is not None
+
+    def load(self) -> None:
+        """Reads the lines appended since the last read."""
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(self._offset)
+                chunk = f.read()
+        except FileNotFoundError:
+            return
+        # A line without newline may still be being written
+        end = chunk.rfind(b"\n") + 1
+        for line in chunk[:end].splitlines():
+            try:
+                record = json.loads(line)
+                self._records[record["key"]] = record
+            except (ValueError, KeyError):
+                continue
+        self._offset += end
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """Gives the predictions of a finished cell.
+
+        Args:
+            key: Key of the cell.
+
+        Returns:
+            The predictions, or None if the cell is not in the file.
+        """
+        if key not in self._records:
+            self.load()
+        record = self._records.get(key)
+        if record is None:
+            return None
+
+        return np.asarray(record["predictions"], dtype=float)
+
+    def add(self, key: str, predictions: np.ndarray, **labels) -> None:
+        """Appends a finished cell to the file, and syncs it to disk.
+
+        Args:
+            key: Key of the cell.
+            predictions: Predictions of the cell. Floats are written
+                exactly, so resumed results are identical.
+            labels: Labels saved with the cell, e.g. the fold.
+        """
+        record = {
+            "key": key,
+            **labels,
+            "predictions": np.asarray(predictions, dtype=float).tolist()
+        }
+        line = (json.dumps(record) + "\n").encode()
+        with open(self.path, "ab") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                # Start on a new line after a line cut short by a crash
+                if f.seek(0, os.SEEK_END) > 0:
+                    with open(self.path, "rb") as r:
+                        r.seek(-1, os.SEEK_END)
+                        if r.read(1) != b"\n":
+                            line = b"\n" + line
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+        self._records[key] = record
@@ -1,13 +1,239 @@
+import os
+import logging
+
 import numpy as np
 import pandas as pd
 
-from typing import Optional, Callable
+from typing import Optional, Callable, Iterable, Iterator, Union
 
 from tqdm.notebook import tqdm
+from joblib import effective_n_jobs
 from sklearn.base import clone
 
-from sklearn.metrics import roc_auc_score
-from sklearn.model_selection import cross_val_predict, StratifiedKFold
+from sklearn.model_selection import StratifiedKFold
+
+from src.data.chunks import iter_chunks
+from src.models.cache import ArrayCache
+from src.models.checkpoint import Checkpoint
+from src.models.compiled import (
+    CompiledClassifier,
+    CompiledCrossFitted,
+    compile_estimator
+)
+from src.models.executors import Executor, JoblibExecutor
+from src.models.persistence import save_model, load_model
+from src.models.resampling import OUTER_FOLDS, INNER_FOLDS
+from src.models.shared import SharedData
+from src.models.metrics import compute_binned_roc_aucs, find_optimal_breaks
+from src.models.timing import timed, timed_delayed, collect_timed
+from src.models.train_model import (
+    cut_probabilities,
+    split_hyper_parameters,
+    predict_estimator,
+    cv_inner_loop,
+    fit_base_classifiers,
+    seed_classifiers,
+    stratified_folds,
+    fit as fit_stacked
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+def predict_cross_fitted(fold_clfs: list, X: pd.DataFrame,
+                         use_probas: bool) -> np.ndarray:
+    """Predicts with the average of classifiers fitted to different folds.
+    
+    Args:
+        fold_clfs: Fitted classifiers, one per fold.
+        X: Features.
+        use_probas: If True, predicts probabilities of 1s. Else, gives the
+            class with the greatest average probability.
+    
+    Returns:
+        Predictions.
+    """
+    probas = np.mean([clf.predict_proba(X) for clf in fold_clfs], axis=0)
+    
+    if use_probas:
+        return probas[:, 1]
+    
+    return fold_clfs[0].classes_[np.argmax(probas, axis=1)]
+
+
+def check_search(breaks_search: str, search: str):
+    """Checks the search settings of cv_outer_loop.
+    
+    Raises:
+        ValueError: If breaks_search or search is unknown.
+    """
+    if breaks_search not in ("grid", "optimal"):
+        raise ValueError(
+            "breaks_search should be 'grid' or 'optimal', got " +
+            str(breaks_search)
+        )
+    if search not in ("exhaustive", "halving"):
+        raise ValueError(
+            "search should be 'exhaustive' or 'halving', got " +
+            str(search)
+        )
+
+
+def alive_groups(groups: dict, alive: list) -> dict:
+    """Keeps the hyper parameters still searched, in groups.
+    
+    Args:
+        groups: Positions of the hyper parameters, by the position of the
+            first with the same model parameters. See split_hyper_parameters.
+        alive: Positions of the hyper parameters still searched.
+    
+    Returns:
+        The groups, with only alive positions, without empty groups.
+    """
+    alive = set(alive)
+    groups = {
+        i: [row for row in rows if row in alive] for i, rows in groups.items()
+    }
+    
+    return {i: rows for i, rows in groups.items() if rows}
+
+
+def plan_tasks(groups: dict, round_folds: list,
+               shard: Optional[tuple] = None) -> list:
+    """Gives the pairs of model parameters and outer folds of a round.
+    
+    Args:
+        groups: Groups of hyper parameters. See alive_groups.
+        round_folds: Outer folds of the round.
+        shard: Optional. Tuple of k and n. The pairs are ordered so that
+            every n-th pair, starting at the k-th, comes first. See
+            StackedGeneralizationClassifier.cv_outer_loop.
+    
+    Returns:
+        List of pairs of the group and outer fold.
+    """
+    tasks = [(i, j) for i in groups for j in round_folds]
+    if shard is not None:
+        k, n = shard
+        tasks = tasks[k::n] + [t for m, t in enumerate(tasks) if m % n != k]
+    
+    return tasks
+
+
+def read_checkpoint(store: Checkpoint, task_keys: dict, tasks: list,
+                    predictions: dict) -> list:
+    """Reads the predictions of finished pairs from a checkpoint.
+    
+    Args:
+        store: Checkpoint of cv_outer_loop.
+        task_keys: Keys of the pairs in the checkpoint.
+        tasks: Pairs of group and outer fold to run.
+        predictions: Validation probabilities, by pairs. Updated in place
+            with the finished pairs.
+    
+    Returns:
+        The pairs not finished, in order.
+    """
+    for task in tasks:
+        y_prob = store.get(task_keys[task])
+        if y_prob is not None: predictions[task] = y_prob
+    
+    return [task for task in tasks if task not in predictions]
+
+
+def score_round(roc_aucs: pd.DataFrame, predictions: dict, groups: dict,
+                evaluated: list, y_vals: list, all_hyper_parameters: list,
+                breaks_search: str, max_candidates: Optional[int]) -> dict:
+    """Scores the breaks of the hyper parameters on the evaluated folds.
+    
+    Args:
+        roc_aucs: AUC of ROC of each hyper parameters and outer fold.
+            Updated in place.
+        predictions: Validation probabilities, by pairs of group and fold.
+        groups: Groups of hyper parameters to score. See alive_groups.
+        evaluated: Outer folds to score.
+        y_vals: Validation targets of the evaluated folds.
+        all_hyper_parameters: Hyper parameters, with the breaks.
+        breaks_search: "grid" or "optimal". See cv_outer_loop.
+        max_candidates: Candidate break points, if "optimal".
+    
+    Returns:
+        Dictionary from the groups to their optimal breaks, empty if
+        breaks_search is "grid".
+    """
+    optimal_breaks = {}
+    for i, rows in groups.items():
+        y_pred_cons = [predictions[i, j] for j in evaluated]
+
+        with timed("score_breaks", hyper_parameters=i):
+            if breaks_search == "optimal":
+                optimal_breaks[i] = find_optimal_breaks(
+                    y_probs=y_pred_cons,
+                    y_trues=y_vals,
+                    max_candidates=max_candidates
+                )
+                all_breaks = [optimal_breaks[i]] * len(rows)
+            else:
+                all_breaks = [
+                    all_hyper_parameters[row]["breaks"] for row in rows
+                ]
+
+            for j, y_pred_con, y_val in zip(evaluated, y_pred_cons, y_vals):
+                roc_aucs.iloc[rows, j] = compute_binned_roc_aucs(
+                    y_prob=y_pred_con,
+                    y_true=y_val,
+                    all_breaks=all_breaks
+                )
+    
+    return optimal_breaks
+
+
+def best_hyper_parameters(roc_aucs: pd.DataFrame,
+                          all_hyper_parameters: list, groups: dict,
+                          optimal_breaks: dict) -> dict:
+    """Gives the hyper parameters with the greatest mean AUC of ROC.
+    
+    Pruned hyper parameters have NaN means, so they are not chosen.
+    
+    Args:
+        roc_aucs: AUC of ROC of each hyper parameters and outer fold.
+        all_hyper_parameters: Hyper parameters searched.
+        groups: Groups of hyper parameters. See alive_groups.
+        optimal_breaks: Optimal breaks of the groups, if searched. See
+            score_round.
+    
+    Returns:
+        The best hyper parameters, with their optimal breaks, if any.
+    """
+    max_row = roc_aucs.mean(axis=1, skipna=False).idxmax()
+    if not optimal_breaks:
+        return all_hyper_parameters[max_row]
+    i = next(i for i, rows in groups.items() if max_row in rows)
+    
+    return {**all_hyper_parameters[max_row], "breaks": optimal_breaks[i]}
+
+
+def halve(roc_aucs: pd.DataFrame, alive: list, evaluated: list,
+          halving_factor: int) -> list:
+    """Keeps the best 1 / halving_factor of the hyper parameters.
+    
+    Args:
+        roc_aucs: AUC of ROC of each hyper parameters and outer fold.
+        alive: Positions of the hyper parameters still searched.
+        evaluated: Outer folds evaluated so far.
+        halving_factor: See cv_outer_loop.
+    
+    Returns:
+        Positions of the kept hyper parameters, best first. Ties keep
+        their order.
+    """
+    n_keep = int(np.ceil(len(alive) / halving_factor))
+    mean_aucs = roc_aucs.iloc[alive, evaluated].mean(axis=1)
+    
+    return list(mean_aucs.sort_values(
+        ascending=False, kind="stable"
+    ).index[:n_keep])
 
 
 class StackedGeneralizationClassifier():
@@ -19,20 +245,55 @@ class StackedGeneralizationClassifier():
         use_probas: If True, meta classifier is fitted to predicted
             probabilities.
         verbose: If True, logging is used. E.g. when fitting model.
+        n_jobs: Optional. Number of parallel jobs when fitting the base
+            classifiers, over classifiers and inner folds.
+        backend: Optional. Parallelization backend of joblib.Parallel
+            when fitting the base classifiers. E.g. "threading".
+        cross_fit: If True, the base classifiers fitted to the inner folds
+            are kept, and averaged when predicting, instead of refitting
+            each base classifier to all rows.
+        cache_dir: Optional. Directory of a disk cache of meta features. If
+            given, meta features are reused for identical base classifier
+            parameters, data and folds. Not used if cross_fit.
+        cache_size: Optional. Greatest size of the cache in bytes. The
+            least recently used meta features are evicted first.
+        random_state: Optional. Seed or numpy SeedSequence. If given, the
+            inner and outer folds are shuffled, and the classifiers are
+            seeded, with independent seeds derived from it, so that
+            serial and parallel runs give identical results. If None, the
+            folds are not shuffled and the classifiers are left as is.
     """
     def __init__(self, base_clfs, meta_clf, 
                  use_probas: bool = True,
                  verbose: bool = False,
-                 results_dir: bool = None):
+                 results_dir: bool = None,
+                 n_jobs: Optional[int] = None,
+                 backend: Optional[str] = None,
+                 cross_fit: bool = False,
+                 cache_dir: Optional[str] = None,
+                 cache_size: Optional[int] = None,
+                 random_state: Optional[Union[int, np.random.SeedSequence]] = None):
         self.base_clfs = base_clfs
         self.meta_clf = meta_clf
         self.use_probas = use_probas
         self.verbose = verbose
         self.results_dir = results_dir
+        self.n_jobs = n_jobs
+        self.backend = backend
+        self.cross_fit = cross_fit
+        self.cache_dir = cache_dir
+        self.cache_size = cache_size
+        self.random_state = random_state
         
         # Copy classifiers for fitting
         self.base_clfs_ = base_clfs
         self.meta_clf_ = meta_clf
+        
+        # Base classifiers fitted to each inner fold, if cross_fit
+        self.fold_clfs_ = None
+        
+        # Keys of the fitted base classifiers in the cache, if cache_dir
+        self.cache_keys_ = None
        
         # AUC of ROC for each outer fold. See self.cv_outer_loop
         self.roc_aucs = None
@@ -45,9 +306,179 @@ class StackedGeneralizationClassifier():
         self.__j = 0
         self.__n = 0
 
+    def _clone(self) -> object:
+        """Copies the settings of the classifier, with unfitted classifiers.
+        
+        The classifiers are cloned from base_clfs and meta_clf, which stay
+        unfitted, also in loaded classifiers, where the fitted ones may be
+        CompiledTrees.
+        
+        Returns:
+            A new StackedGeneralizationClassifier.
+        """
+        sgclf = self.__class__(
+            base_clfs=[clone(clf) for clf in self.base_clfs],
+            meta_clf=clone(self.meta_clf),
+            use_probas=self.use_probas,
+            verbose=self.verbose,
+            results_dir=self.results_dir,
+            n_jobs=self.n_jobs,
+            backend=self.backend,
+            cross_fit=self.cross_fit,
+            cache_dir=self.cache_dir,
+            cache_size=self.cache_size,
+            random_state=self.random_state
+        )
+        sgclf.__n = self.__n
+        
+        return sgclf
+
+    def _splitter(self, n_splits: int, key: int) -> StratifiedKFold:
+        """Gives the folds, shuffled if there is a random_state."""
+        return stratified_folds(n_splits, self.random_state, key)
+
+    def _checkpoint_path(self, checkpoint: Union[bool, str]) -> str:
+        """Gives the path of the checkpoint of cv_outer_loop."""
+        if isinstance(checkpoint, str):
+            return checkpoint
+        if self.results_dir is None:
+            raise ValueError(
+                "checkpoint=True needs results_dir, or give a path"
+            )
+        
+        return os.path.join(self.results_dir, "cv_outer_loop.jsonl")
+
+    def _cache(self) -> Optional[ArrayCache]:
+        """Gives the cache of meta features, if there is one."""
+        if self.cache_dir is None or self.cross_fit:
+            return None
+        
+        return ArrayCache(self.cache_dir, self.cache_size)
+
+    def _log_outer_fold(self, y_val: pd.Series):
+        """Logs the number of each class in an outer fold."""
+        n = y_val.value_counts()
+        self.__n = n
+        logger.info("Outer loop, each fold:")
+        for k in n.index:
+            p = round(n[k] / sum(n) * 100, 2)
+            logger.info("\tNumber of {c}'s: ~{v} ({p}%)".format(
+                c=round(k),v=n[k],p=p)
+            )
+
+    def _checkpoint_keys(self, checkpoint: Union[bool, str],
+                         all_hyper_parameters: list, groups: dict,
+                         X: pd.DataFrame, y: pd.Series,
+                         folds: list) -> tuple:
+        """Gives the checkpoint of cv_outer_loop and the keys in it.
+        
+        Returns:
+            Tuple of the Checkpoint, None if not checkpoint, and a
+            dictionary from the pairs of model parameters and outer folds
+            to their keys, empty if not checkpoint.
+        """
+        if not checkpoint:
+            return None, {}
+        
+        store = Checkpoint(self._checkpoint_path(checkpoint))
+        run_key = Checkpoint.key(
+            self.base_clfs_, self.meta_clf_, self.use_probas,
+            self.cross_fit, self.random_state, X, y,
+            [val_index for _, val_index in folds]
+        )
+        task_keys = {
+            (i, j): Checkpoint.key(run_key, repr(sorted(
+                (k, v) for k, v in all_hyper_parameters[i].items() 
+                if k != "breaks"
+            )), j)
+            for i in groups for j in range(len(folds))
+        }
+        
+        return store, task_keys
+
+    def _fit_predict_fold(self, hyper_parameters: dict, i: int, j: int,
+                          data: SharedData,
+                          train_index: np.ndarray,
+                          val_index: np.ndarray,
+                          checkpoint: Optional[Checkpoint] = None,
+                          key: Optional[str] = None) -> np.ndarray:
+        """Fits a copy of the classifier to one outer fold.
+        
+        Args:
+            hyper_parameters: Hyper parameters of the base classifiers.
+            i: Position of the hyper parameters. Used for logging.
+            j: Outer fold. Used for logging.
+            data: Features and targets.
+            train_index: Positions of the training rows.
+            val_index: Positions of the validation rows.
+            checkpoint: Optional. If given, the predictions are read from
+                it if another process has finished the fold, and else
+                appended to it.
+            key: Key of the fold in the checkpoint.
+        
+        Returns:
+            Predicted probabilities of 1s for the validation rows.
+        """
+        if checkpoint is not None:
+            y_prob = checkpoint.get(key)
+            if y_prob is not None:
+                return y_prob
+        
+        sgclf = self._clone()
+        sgclf.__i = i
+        sgclf.__j = j
+        sgclf.hyper_parameters = hyper_parameters
+        X_train, y_train, _ = data.take(train_index)
+        X_val, _, _ = data.take(val_index)
+        with timed("outer_fold", hyper_parameters=i, fold=j):
+            sgclf.fit(X = X_train, y = y_train)
+            y_prob = sgclf.predict_proba_meta(X = X_val)
+        
+        if checkpoint is not None:
+            checkpoint.add(key, y_prob, hyper_parameters=i, fold=j)
+        
+        return y_prob
+
+    def _meta_features(self, base_clfs: list, X: pd.DataFrame,
+                       y: pd.Series) -> np.ndarray:
+        """Gives the meta features of the base classifiers. See fit."""
+        return self.cv_inner_loop(X = X, y = y, base_clfs = base_clfs)
+
+    def _fit_base(self, base_clfs: list, X: pd.DataFrame,
+                  y: pd.Series) -> list:
+        """Fits the base classifiers to all rows, or reads them from the
+        cache. See fit.
+        
+        The classifiers are keyed on their unfitted parameters and the
+        data, and the keys kept in cache_keys_, so predict_meta_features
+        need not hash the fitted classifiers.
+        """
+        cache = self._cache()
+        if cache is None:
+            return fit_base_classifiers(
+                base_clfs, X, y, n_jobs=self.n_jobs, backend=self.backend
+            )
+        
+        data_key = cache.key(X, y)
+        keys = [cache.key("fit", clone(clf), data_key) for clf in base_clfs]
+        fitted = [cache.get_object(key) for key in keys]
+        missing = [k for k, clf in enumerate(fitted) if clf is None]
+        for k, clf in zip(missing, fit_base_classifiers(
+                [base_clfs[k] for k in missing], X, y,
+                n_jobs=self.n_jobs, backend=self.backend)):
+            cache.set_object(keys[k], clf)
+            fitted[k] = clf
+        self.cache_keys_ = keys
+        
+        return fitted
+
     def fit(self, X: pd.DataFrame, y: pd.Series) -> object:
         """Fits the classifiers and the meta classifier.
         
+        Copies of base_clfs and meta_clf are fitted, so a classifier can be
+        refitted, also when loaded. The fitted classifiers are replaced
+        only if the fit succeeds.
+        
         Args:
             X: Features.
             y: Target labels.
@@ -55,53 +486,118 @@ class StackedGeneralizationClassifier():
         Returns:
             The StackedGeneralizationClassifier itself.
         """
-        # Set the hyper hyper parameters of the base classifiers
-        for clf in self.base_clfs_:
-            nm = clf.__class__.__name__.lower()
-            ks = [s for s in self.hyper_parameters.keys() if nm in s]
-            clf_params = {k.split("__", 1)[1]: self.hyper_parameters.get(k) for k in ks}
-            clf.set_params(**clf_params)
+        # Seed the classifiers, before any seeds in the hyper parameters
+        base_clfs, meta_clf = seed_classifiers(
+            self.base_clfs, self.meta_clf, self.random_state
+        )
 
-        # Get meta features from features
-        X_meta = self.cv_inner_loop(X = X, y = y)
-        
-        # Fit each base classifier to all features
-        self.base_clfs_ = [clf.fit(X, y) for clf in self.base_clfs_]
+        # Fit with the functional pipeline, with the meta features of
+        # self.cv_inner_loop. Refitting each base classifier to all
+        # features is not needed when the inner fold classifiers are used
+        # for predictions
+        # Set by cv_inner_loop and _fit_base, and restored if the fit fails
+        fold_clfs, cache_keys = self.fold_clfs_, self.cache_keys_
+        self.cache_keys_ = None
+        try:
+            base_clfs, meta_clf, _ = fit_stacked(
+                base_clfs=base_clfs,
+                meta_clf=meta_clf,
+                inner_loop=None,
+                hyper_parameters=self.hyper_parameters,
+                X_train=X,
+                y_train=y,
+                n_jobs=self.n_jobs,
+                backend=self.backend,
+                refit=not self.cross_fit,
+                meta_features=self._meta_features,
+                fit_base=self._fit_base
+            )
+        except BaseException:
+            self.fold_clfs_, self.cache_keys_ = fold_clfs, cache_keys
+            raise
+        self.base_clfs_ = base_clfs
+        self.meta_clf_ = meta_clf
 
-        # Fit meta classifier to meta features of train
-        self.meta_clf_.fit(X_meta, y)
+        # Keep the order of the features, to select them from new data
+        self.feature_names_ = (
+            list(X.columns) if isinstance(X, pd.DataFrame) else None
+        )
     
         return self
 
 
     def predict_meta_features(self, X: pd.DataFrame, 
                               use_probas: Optional[bool] = None,
-                              save: bool = False) -> np.ndarray:
+                              save: bool = False,
+                              out: Optional[np.ndarray] = None) -> np.ndarray:
         """Uses base classifiers to get meta features.
         
         Args:
             X: Features.
             use_probas: Optional. If not None and True, predicts probabilities of 
                 1s. Else, gives predicted class.
+            out: Optional. Array with at least as many rows as X and one
+                column per base classifier, to write the meta features to,
+                e.g. reused between batches. If None, a new array.
         
         Returns:
             Meta features, i.e. the predicted probabilities by base
-            classifiers.
+            classifiers. A view of out, if given.
         """
         do_save = save and self.results_dir is not None
         
         if use_probas is None: use_probas = self.use_probas
-
-        per_model_predictions = []
-        for clf in self.base_clfs_:
-            prediction = clf.predict_proba(X)[:, 1] if use_probas else clf.predict(X)
-            per_model_predictions.append(prediction[:, np.newaxis])
         
-        predictions = np.hstack(per_model_predictions)
+        # Keyed on the keys of the fitted classifiers, cheaper to hash
+        cache = self._cache()
+        keys = getattr(self, "cache_keys_", None)
+        if keys is None: cache = None
+        if cache is not None: data_key = cache.key(X)
+
+        n = len(X)
+        if out is None:
+            out = np.empty((n, len(self.base_clfs_)))
+        predictions = out[:n]
+        for k, clf in enumerate(self.base_clfs_):
+            if cache is not None:
+                key = cache.key("predict", keys[k], data_key, use_probas)
+                prediction = cache.get(key)
+                if prediction is not None:
+                    predictions[:, k] = prediction
+                    continue
+            with timed("base_predict", clf=clf.__class__.__name__):
+                if self.cross_fit:
+                    prediction = predict_cross_fitted(
+                        self.fold_clfs_[k], X, use_probas
+                    )
+                else:
+                    prediction = predict_estimator(clf, X, use_probas)
+            if cache is not None: cache.set(key, prediction)
+            predictions[:, k] = prediction
 
         return predictions
         
 
+    def predict_proba_meta(self, X: pd.DataFrame,
+                           out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Predicts continuous probabilities of 1s using meta classifier.
+        
+        Args:
+            X: Features from which to classify rows.
+            out: Optional. Buffer for the meta features. See
+                predict_meta_features.
+        
+        Returns:
+            Predicted probability of 1s.
+        """
+        X_meta = self.predict_meta_features(
+            X, use_probas = self.use_probas, out = out
+        )
+        
+        with timed("meta_predict", clf=self.meta_clf_.__class__.__name__):
+            return self.meta_clf_.predict_proba(X_meta)[:, 1]
+
+
     def predict(self, X, use_probas: bool = True,
                 save: bool = False) -> tuple:
         """Predicts using meta classifier
@@ -117,81 +613,298 @@ class StackedGeneralizationClassifier():
         do_save = save and self.results_dir is not None
 
         # Predict using validation meta features
-        X_meta = self.predict_meta_features(X, use_probas = self.use_probas)
-        y_prob = (
-            self.meta_clf_.predict_proba(X_meta) if use_probas 
-            else self.meta_clf_.predict(X_meta)
-        )[:, 1]
+        if use_probas:
+            y_prob = self.predict_proba_meta(X)
+        else:
+            X_meta = self.predict_meta_features(X, use_probas = self.use_probas)
+            y_prob = self.meta_clf_.predict(X_meta)
         if do_save: pd.Series(y_prob).to_csv(
             self.results_dir + "y_holdout_prob_con"
         )
 
         return_object = y_prob
         if use_probas:
-            y_prob_cut = pd.cut(
-                x=y_prob,
-                bins=self.hyper_parameters["breaks"],
-                labels=[0, 1, 2, 3],
-                right=True,
-                include_lowest=False
+            y_prob_cut = cut_probabilities(
+                y_prob=y_prob,
+                breaks=self.hyper_parameters["breaks"]
             )
             
             if do_save: pd.Series(y_prob_cut).to_csv(
                 self.results_dir + "y_holdout_prob_cut"
             )
 
-            return_object = (
-                y_prob,
-                np.array(y_prob_cut).astype(float)
-            )
+            return_object = (y_prob, y_prob_cut)
 
         return return_object
 
+
+    def predict_batches(self, X: Union[pd.DataFrame, str, Iterable[pd.DataFrame]],
+                        chunk_size: int = 100000,
+                        transform: Optional[Callable] = None,
+                        **kwargs) -> Iterator[pd.DataFrame]:
+        """Predicts in chunks of rows, with memory bounded by the chunk size.
+        
+        The meta features of all chunks are written to a single buffer,
+        allocated for the first chunk, so only one chunk of features and
+        predictions is held at a time.
+        
+        Args:
+            X: Features, as a data frame, an iterable of data frames, or the
+                path of a CSV or Parquet file. See iter_chunks. Columns not
+                used in fit are dropped.
+            chunk_size: Rows per chunk.
+            transform: Optional. Applied to each chunk before predicting,
+                e.g. label_categorical and compact_features.
+            kwargs: Passed on to iter_chunks, e.g. index_col.
+        
+        Yields:
+            Data frames with the predicted probability of 1s, y_prob_con, and
+            the binned predictions, y_prob_cut, indexed as the chunk.
+        """
+        breaks = self.hyper_parameters["breaks"]
+        buffer = None
+        for chunk in iter_chunks(X, chunk_size, **kwargs):
+            if transform is not None: chunk = transform(chunk)
+            if getattr(self, "feature_names_", None) is not None:
+                chunk = chunk[self.feature_names_]
+            if buffer is None or len(buffer) < len(chunk):
+                buffer = np.empty((len(chunk), len(self.base_clfs_)))
+            with timed("predict_batch", rows=len(chunk)):
+                y_prob = self.predict_proba_meta(chunk, out=buffer)
+                y_prob_cut = cut_probabilities(y_prob, breaks)
+            yield pd.DataFrame(
+                {"y_prob_con": y_prob, "y_prob_cut": y_prob_cut},
+                index=chunk.index
+            )
+
+
+    def predict_to_file(self, X: Union[pd.DataFrame, str, Iterable[pd.DataFrame]],
+                        path: str, chunk_size: int = 100000,
+                        transform: Optional[Callable] = None,
+                        **kwargs) -> int:
+        """Predicts in chunks of rows, appending each chunk to a file.
+        
+        Args:
+            X: Features. See predict_batches.
+            path: Path of the predictions, written as Parquet if it ends
+                with .parquet, which needs pyarrow, else as CSV.
+            chunk_size: Rows per chunk.
+            transform: Optional. Applied to each chunk. See predict_batches.
+            kwargs: Passed on to iter_chunks.
+        
+        Returns:
+            Number of rows predicted.
+        """
+        parquet = path.endswith((".parquet", ".pq"))
+        if parquet:
+            try:
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+            except ImportError:
+                raise ImportError(
+                    "Writing Parquet needs pyarrow, pip install pyarrow"
+                )
+        n = 0
+        writer = None
+        try:
+            for batch in self.predict_batches(X, chunk_size, transform, **kwargs):
+                if parquet:
+                    table = pa.Table.from_pandas(batch)
+                    if writer is None:
+                        writer = pq.ParquetWriter(path, table.schema)
+                    writer.write_table(table)
+                else:
+                    batch.to_csv(path, mode="w" if n == 0 else "a", header=n == 0)
+                n += len(batch)
+        finally:
+            if writer is not None: writer.close()
+        
+        return n
+
+
+    def compile(self, fallback: bool = False) -> CompiledClassifier:
+        """Compiles the fitted classifiers, to score one row at a time.
+        
+        Args:
+            fallback: If True, classifiers that cannot be compiled, e.g.
+                Pipelines with preprocessing, call their predict_proba.
+
+        Returns:
+            CompiledClassifier with the same predictions as predict, for
+            rows given as sequences or mappings of the features.
+
+        Raises:
+            ValueError: If a classifier cannot be compiled, and not
+                fallback. See compile_estimator.
+        """
+        feature_names = getattr(self, "feature_names_", None)
+        if self.cross_fit:
+            base_clfs = [
+                CompiledCrossFitted(
+                    fold_clfs, feature_names=feature_names, fallback=fallback
+                )
+                for fold_clfs in self.fold_clfs_
+            ]
+        else:
+            base_clfs = [
+                compile_estimator(
+                    clf, feature_names=feature_names, fallback=fallback
+                )
+                for clf in self.base_clfs_
+            ]
+        
+        return CompiledClassifier(
+            base_clfs=base_clfs,
+            meta_clf=compile_estimator(self.meta_clf_, fallback=fallback),
+            breaks=self.hyper_parameters["breaks"],
+            feature_names=feature_names,
+            use_probas=self.use_probas
+        )
+
+
+    def save(self, path: str, overwrite: bool = False) -> str:
+        """Saves the fitted classifier as a versioned artifact.
+        
+        Args:
+            path: Directory of the artifact. See save_model.
+            overwrite: If True, replaces an artifact already at path.
+        
+        Returns:
+            The path.
+        """
+        return save_model(self, path, overwrite=overwrite)
+
+
+    @classmethod
+    def load(cls, path: str, mmap_mode: Optional[str] = "r") -> object:
+        """Loads a classifier saved with save, memory-mapping its arrays.
+        
+        Args:
+            path: Directory of the artifact.
+            mmap_mode: Optional. See load_model.
+        
+        Returns:
+            The fitted StackedGeneralizationClassifier.
+        
+        Raises:
+            TypeError: If the artifact holds another kind of model.
+        """
+        sgclf = load_model(path, mmap_mode=mmap_mode)
+        if not isinstance(sgclf, cls):
+            raise TypeError("{p} holds a {c}, not a {e}".format(
+                p=path, c=sgclf.__class__.__name__, e=cls.__name__
+            ))
+        
+        return sgclf
+
     
+    def _log_inner_loop(self, inner_folds: int):
+        """Logs the number of each class in an inner loop."""
+        logger.info("Inner loop, each loop:")
+        for k in self.__n.index:
+            p = round(self.__n[k] / sum(self.__n) * 100, 2)
+            logger.info("\tNumber of {c}'s: ~{v} ({p}%)".format(
+                c=round(k),
+                v=round(self.__n[k] / inner_folds),
+                p=p
+            ))
+
+    def _read_meta_features(self, cache: ArrayCache, base_clfs: list,
+                            X: pd.DataFrame, y: pd.Series, folds: list,
+                            X_meta: np.ndarray) -> dict:
+        """Reads the cached meta features of cv_inner_loop into X_meta.
+        
+        Returns:
+            Dictionary from the positions of the base classifiers not in
+            the cache to their keys.
+        """
+        data_key = cache.key(X, y, [test_index for _, test_index in folds])
+        keys = {}
+        for k, clf in enumerate(base_clfs):
+            key = cache.key("cv_inner_loop", clone(clf), data_key, 
+                            self.use_probas)
+            prediction = cache.get(key)
+            if prediction is None:
+                keys[k] = key
+            else:
+                X_meta[:, k] = prediction
+        
+        return keys
+
     def cv_inner_loop(self, X: pd.DataFrame, y: pd.Series, 
-                      inner_folds: Optional[int] = 2) -> np.ndarray:
+                      inner_folds: Optional[int] = 2,
+                      base_clfs: Optional[list] = None) -> np.ndarray:
         """Runs inner loop of k-fold cross-validation.
     
         Args: 
             X: Features.
             y: Target labels.
+            inner_folds: Number of inner folds.
+            base_clfs: Optional. Base classifiers to cross-validate
+                copies of. If None, base_clfs_.
         Returns:
           Array where each column correspond to the predictions by each
               respective classifier
         """
-        inner_loop = StratifiedKFold(n_splits = inner_folds)
-
-        if self.verbose:
-            if self.__i == 0 and self.__j == 0:
-                print("Inner loop, each loop:")
-                for k in self.__n.index:
-                    p = round(self.__n[k] / sum(self.__n) * 100, 2)
-                    print("\tNumber of {c}'s: ~{v} ({p}%)".format(
-                        c=round(k),
-                        v=round(self.__n[k] / inner_folds),
-                        p=p
-                    ))
-
-        X_meta = []
-
-        for clf in self.base_clfs_:
-            predictions = cross_val_predict(
-                estimator=clf,
-                X=X,
-                y=y,
-                cv=inner_loop,
-                method="predict_proba" if self.use_probas else "predict"
+        inner_loop = self._splitter(inner_folds, INNER_FOLDS)
+
+        if self.verbose and self.__i == 0 and self.__j == 0:
+            self._log_inner_loop(inner_folds)
+
+        if base_clfs is None: base_clfs = self.base_clfs_
+        folds = list(inner_loop.split(X, y))
+        X_meta = np.zeros((len(y), len(base_clfs)))
+        
+        # Reuse meta features of identical classifiers, data and folds
+        cache = self._cache()
+        if cache is not None:
+            keys = self._read_meta_features(
+                cache, base_clfs, X, y, folds, X_meta
             )
-            p = predictions[:, 1] if self.use_probas else predictions
-            X_meta.append(p)
+        else:
+            keys = {k: None for k in range(len(base_clfs))}
 
-        return np.column_stack(X_meta)
+        # Fit the classifiers not in the cache once per fold, with the same
+        # engine as the functional train_model.cv_inner_loop
+        ks = list(keys)
+        predictions = cv_inner_loop(
+            base_clfs=[base_clfs[k] for k in ks],
+            inner_loop=folds,
+            X=X,
+            y=y,
+            use_probas=self.use_probas,
+            n_jobs=self.n_jobs,
+            backend=self.backend,
+            return_estimators=self.cross_fit
+        )
+        
+        if self.cross_fit:
+            predictions, fold_clfs = predictions
+            self.fold_clfs_ = [[] for _ in base_clfs]
+            for k, clfs in zip(ks, fold_clfs):
+                self.fold_clfs_[k] = clfs
+        
+        X_meta[:, ks] = predictions
+        
+        if cache is not None:
+            for k, key in keys.items(): cache.set(key, X_meta[:, k])
+
+        return X_meta
 
 
     def cv_outer_loop(self, all_hyper_parameters: list,
                       X: pd.DataFrame, y: pd.Series, refit=True,
                       inner_folds: Optional[int] = 5, 
-                      outer_folds: Optional[int] = 2) -> object:
+                      outer_folds: Optional[int] = 2,
+                      breaks_search: str = "grid",
+                      max_candidates: Optional[int] = 250,
+                      n_jobs: Optional[int] = None,
+                      backend: Optional[str] = None,
+                      search: str = "exhaustive",
+                      halving_factor: int = 3,
+                      checkpoint: Union[bool, str] = False,
+                      shard: Optional[tuple] = None,
+                      executor: Optional[Executor] = None) -> object:
         """Runs outer cross-validation.
         
         Gets the break points for continous proabilities that 
@@ -204,59 +917,130 @@ class StackedGeneralizationClassifier():
             y: Targets.
             refit: If True, the base classifiers and the meta classifier
                 is as a final step refit to the training set.¨
+            breaks_search: If "grid", the breaks in all_hyper_parameters
+                are tried. If "optimal", the breaks that maximise the mean
+                AUC of ROC over the outer folds are searched for each set
+                of model parameters, and any breaks given are ignored.
+            max_candidates: Optional. Number of candidate break points
+                when breaks_search is "optimal", which bounds the
+                quadratic search. See find_optimal_breaks.
+            n_jobs: Optional. Number of parallel jobs over the pairs of
+                hyper parameters and outer folds. Each job fits copies of
+                the classifiers. See joblib.Parallel.
+            backend: Optional. Parallelization backend of joblib.Parallel.
+            search: If "exhaustive", all hyper parameters are evaluated on
+                all outer folds. If "halving", the hyper parameters are
+                evaluated one outer fold at a time, and only the best
+                1 / halving_factor of them go on to the next fold. The AUC
+                of ROC of pruned hyper parameters is NaN on the folds they
+                did not reach.
+            halving_factor: Proportion of hyper parameters kept after each
+                outer fold, when search is "halving".
+            checkpoint: If True, or a path, the predictions of each pair
+                of model parameters and outer fold are appended to a
+                checkpoint file as soon as they are done, by default
+                cv_outer_loop.jsonl in results_dir. Pairs already in the
+                file are not refitted, so running the search again
+                resumes it. The pairs are keyed by the classifiers, data,
+                folds and model parameters, so changed settings are
+                refitted. Several processes can share the file.
+            shard: Optional. Tuple of k and n, when n processes share a
+                checkpoint. This process first runs every n-th pair,
+                starting at the k-th, and then the pairs the other
+                processes have not finished, so that all processes end
+                with the full search.
+            executor: Optional. Runs the pairs of hyper parameters and
+                outer folds instead of joblib.Parallel with n_jobs and
+                backend. E.g. an SQLiteQueueExecutor, to share the search
+                between processes on several machines. See 
+                src.models.executors.
                 
         Returns:
             The StackedGeneralizationClassifier itself.
         """
-        outer_loop = StratifiedKFold(n_splits = outer_folds)
+        check_search(breaks_search, search)
+        outer_loop = self._splitter(outer_folds, OUTER_FOLDS)
         ## Setup for recording auc from each combination of hps
         roc_aucs = pd.DataFrame(
-            data = np.zeros((len(all_hyper_parameters), outer_folds)),
+            data = np.full((len(all_hyper_parameters), outer_folds), np.nan),
             columns = range(1, outer_folds + 1)
         )
         
-        for i, hyper_parameters in enumerate(tqdm(all_hyper_parameters)):
-
-            self.__i = i 
-
-            self.hyper_parameters = hyper_parameters
-
-            for j, (train_index, val_index) in enumerate(outer_loop.split(X, y)):
-
-                self.__j = j
-            
-                X_train = X.iloc[train_index]
-                y_train = y.iloc[train_index]
-                X_val = X.iloc[val_index]
-                y_val = y.iloc[val_index]
-                
-                # Number of each class w. percentage. Only first loop
-                if self.verbose:
-                    if i == 0 and j == 0:
-                        n = y_val.value_counts()
-                        self.__n = n
-                        print("Outer loop, each fold:")
-                        for k in n.index:
-                            p = round(n[k] / sum(n) * 100, 2)
-                            print("\tNumber of {c}'s: ~{v} ({p}%)".format(
-                                c=round(k),v=n[k],p=p)
-                            )
+        # Fit once per set of model parameters, and score all breaks
+        # against the cached validation probabilities
+        groups = split_hyper_parameters(all_hyper_parameters)
+        folds = list(outer_loop.split(X, y))
+        
+        # Number of each class w. percentage, in the first fold
+        if self.verbose: self._log_outer_fold(y.iloc[folds[0][1]])
+        
+        # The cores go to the outer loop when it runs in parallel
+        template = self._clone()
+        if effective_n_jobs(n_jobs) > 1: template.n_jobs = 1
+        
+        # Finished pairs of hyper parameters and folds are checkpointed
+        store, task_keys = template._checkpoint_keys(
+            checkpoint, all_hyper_parameters, groups, X, y, folds
+        )
+        
+        # Successive halving evaluates one outer fold per round
+        if search == "halving":
+            rounds = [[j] for j in range(outer_folds)]
+        else:
+            rounds = [list(range(outer_folds))]
+        
+        # Workers in other processes memory-map the data
+        if executor is None: executor = JoblibExecutor(n_jobs, backend)
+        data = SharedData(
+            X, y, memmap=executor.memmap, temp_dir=executor.temp_dir
+        )
+        
+        try:
+            alive = list(range(len(all_hyper_parameters)))
+            predictions = {}
+            optimal_breaks = {}
+            for r, round_folds in enumerate(rounds):
+                round_groups = alive_groups(groups, alive)
                 
-                self.fit(X = X_train, y = y_train)
-                y_pred_con, y_pred_cut = self.predict(X=X_val)
-    
-                auc = roc_auc_score(
-                    y_true=y_val,
-                    y_score=y_pred_cut
+                # Each pair of hyper parameters and outer fold is independent
+                tasks = plan_tasks(round_groups, round_folds, shard)
+                if store is not None:
+                    tasks = read_checkpoint(
+                        store, task_keys, tasks, predictions
+                    )
+                round_predictions = collect_timed(
+                    executor(
+                        timed_delayed(template._fit_predict_fold)(
+                            all_hyper_parameters[i], i, j, data, *folds[j],
+                            store, task_keys.get((i, j))
+                        ) for i, j in tqdm(tasks)
+                    )
                 )
-                roc_aucs.iloc[i, j] = auc
+                predictions.update(zip(tasks, round_predictions))
+            
+                # Score on all folds evaluated so far
+                evaluated = [j for rf in rounds[:r + 1] for j in rf]
+                optimal_breaks.update(score_round(
+                    roc_aucs, predictions, round_groups, evaluated,
+                    [y.iloc[folds[j][1]] for j in evaluated],
+                    all_hyper_parameters, breaks_search, max_candidates
+                ))
+            
+                # Keep the best hyper parameters for the next round
+                if r < len(rounds) - 1:
+                    alive = halve(roc_aucs, alive, evaluated, halving_factor)
+        finally:
+            data.close()
         
         self.roc_aucs = roc_aucs
     
         # Find the best performing settings for the models
-        max_row = roc_aucs.mean(axis=1).idxmax()
-        self.hyper_parameters = all_hyper_parameters[max_row]
+        self.hyper_parameters = best_hyper_parameters(
+            roc_aucs, all_hyper_parameters, groups, optimal_breaks
+        )
 
-        if refit: self.fit(X = X_train, y = y_train)
+        if refit:
+            with timed("refit"):
+                self.fit(X = X, y = y)
         
         return self
@@ -0,0 +1,662 @@
+import abc
+import math
+import logging
+
+from bisect import bisect_left
+from typing import Callable, Mapping, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+import sklearn
+
+from sklearn.base import BaseEstimator, ClassifierMixin
+from sklearn.pipeline import Pipeline
+from sklearn.linear_model import LogisticRegression
+from sklearn.naive_bayes import GaussianNB
+from sklearn.tree import DecisionTreeClassifier
+from sklearn.utils.fixes import parse_version
+from sklearn.ensemble import (
+    RandomForestClassifier,
+    HistGradientBoostingClassifier
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+def sigmoid(z: float) -> float:
+    """Gives 1 / (1 + exp(-z)), without overflow."""
+    if z >= 0:
+        return 1.0 / (1.0 + math.exp(-z))
+    e = math.exp(z)
+    return e / (1.0 + e)
+
+
+class CompiledEstimator(abc.ABC):
+    """Predicts the probability of 1s of a single row, without sklearn.
+
+    Holds the fitted parameters of an estimator as plain arrays and lists,
+    so a row is scored without input validation or data frames.
+
+    Attributes:
+        float32: If True, the row must be given as float32 values, as the
+            estimator compares them to thresholds fitted on float32 data.
+        raw: If True, the row is given as is, not converted to floats.
+    """
+    float32 = False
+    raw = False
+
+    @abc.abstractmethod
+    def proba(self, x: list) -> float:
+        """Gives the probability of 1s of a row of features, as a list."""
+
+
+class CompiledLogisticRegression(CompiledEstimator):
+    def __init__(self, clf: LogisticRegression):
+        self.coef = clf.coef_[0].tolist()
+        self.intercept = float(clf.intercept_[0])
+
+    def proba(self, x: list) -> float:
+        return sigmoid(
+            sum(c * v for c, v in zip(self.coef, x)) + self.intercept
+        )
+
+
+class CompiledGaussianNB(CompiledEstimator):
+    def __init__(self, clf: GaussianNB):
+        self.theta = clf.theta_.tolist()
+        self.inv_var = (1 / clf.var_).tolist()
+        self.log_prior = (
+            np.log(clf.class_prior_) -
+            0.5 * np.sum(np.log(2 * np.pi * clf.var_), axis=1)
+        ).tolist()
+
+    def proba(self, x: list) -> float:
+        jll = [
+            log_prior - 0.5 * sum(
+                (v - t) ** 2 * w for v, t, w in zip(x, theta, inv_var)
+            )
+            for log_prior, theta, inv_var
+            in zip(self.log_prior, self.theta, self.inv_var)
+        ]
+        return sigmoid(jll[1] - jll[0])
+
+
+# How missing values are routed at a split, as in LightGBM: NaN is
+# treated as 0, NaN goes to the missing side, or NaN and 0 go to it
+# Versions of scikit-learn, from and below, whose private trees of
+# HistGradientBoostingClassifier are compiled
+HGB_SKLEARN_VERSIONS = ("1.0", "2.0")
+# Fields of their nodes the compiler reads
+HGB_NODE_FIELDS = {
+    "left", "right", "feature_idx", "num_threshold", "missing_go_to_left",
+    "is_leaf", "is_categorical", "value"
+}
+MISSING_NONE = 0
+MISSING_NAN = 1
+MISSING_ZERO = 2
+
+# LightGBM treats values this close to 0 as 0
+ZERO_THRESHOLD = 1e-35
+
+
+class CompiledTrees(CompiledEstimator, ClassifierMixin, BaseEstimator):
+    """Tree ensemble as flat arrays of nodes, e.g. a random forest.
+
+    Also an estimator fitted already, e.g. the final step of a Pipeline,
+    that predicts many rows. See predict_proba.
+
+    The nodes of all trees are concatenated. A node goes to left[node] if
+    the value of feature[node] is at most threshold[node], else to
+    right[node], and is a leaf if left[node] is -1. Missing values go
+    left if missing_left[node], see missing_type. The probability of 1s
+    is the mean of the leaf values, for forests, or the sigmoid of scale
+    times the sum of baseline and the leaf values, for boosting.
+
+    Args:
+        arrays: Dictionary with the arrays left, right, feature, threshold,
+            missing_left, missing_type and value, with one element per
+            node, and roots, with the first node of each tree.
+        link: "mean" or "logit".
+        baseline: Raw score added to the leaf values, if link is "logit".
+        scale: Multiplier of the raw score, if link is "logit".
+        average: If True, the leaf values are averaged, not summed, before
+            the logit link, as in LightGBM random forests.
+        float32: If True, the features are compared as float32, as
+            scikit-learn trees do.
+        classes: Optional. Classes of the compiled classifier, for predict.
+    """
+    FIELDS = (
+        "left", "right", "feature", "threshold", "missing_left",
+        "missing_type", "value", "roots"
+    )
+
+    def __init__(self, arrays: dict, link: str = "mean",
+                 baseline: float = 0.0, scale: float = 1.0,
+                 average: bool = False, float32: bool = False,
+                 classes: Optional[np.ndarray] = None):
+        self.arrays = arrays
+        self.link = link
+        self.baseline = baseline
+        self.scale = scale
+        self.average = average
+        self.float32 = float32
+        self.classes = classes
+        self.classes_ = np.array([0, 1]) if classes is None else classes
+        self._lists = None
+
+    def __repr__(self) -> str:
+        return "CompiledTrees(trees={t}, nodes={n}, link={l!r})".format(
+            t=len(self.arrays["roots"]), n=len(self.arrays["value"]),
+            l=self.link
+        )
+
+    @classmethod
+    def from_nodes(cls, trees: list, **kwargs) -> "CompiledTrees":
+        """Concatenates trees given as dictionaries of node arrays.
+
+        Args:
+            trees: Per tree, a dictionary with the arrays of CompiledTrees,
+                but roots, with child positions within the tree.
+            kwargs: Passed on to CompiledTrees.
+
+        Returns:
+            The compiled trees.
+        """
+        offsets = np.cumsum([0] + [len(t["value"]) for t in trees])
+        arrays = {
+            field: np.concatenate([t[field] for t in trees])
+            for field in ("feature", "threshold", "missing_left",
+                          "missing_type", "value")
+        }
+        for field in ("left", "right"):
+            arrays[field] = np.concatenate([
+                np.where(children == -1, -1, children + offset)
+                for children, offset in zip(
+                    (np.asarray(t[field], dtype=np.int64) for t in trees),
+                    offsets
+                )
+            ])
+        arrays["roots"] = offsets[:-1]
+        dtypes = dict(
+            left=np.int32, right=np.int32, feature=np.int32,
+            threshold=np.float64, missing_left=np.bool_,
+            missing_type=np.int8, value=np.float64, roots=np.int32
+        )
+        arrays = {k: np.ascontiguousarray(v, dtype=dtypes[k])
+                  for k, v in arrays.items()}
+
+        return cls(arrays, **kwargs)
+
+    def _as_lists(self) -> tuple:
+        # Python lists index faster than arrays, one row at a time
+        if self._lists is None:
+            self._lists = tuple(
+                self.arrays[field].tolist() for field in self.FIELDS
+            )
+        return self._lists
+
+    def proba(self, x: list) -> float:
+        (left, right, feature, threshold, missing_left, missing_type,
+         value, roots) = self._as_lists()
+        total = 0.0
+        for node in roots:
+            while left[node] != -1:
+                v = x[feature[node]]
+                kind = missing_type[node]
+                if v != v and kind == MISSING_NONE:
+                    v = 0.0
+                if v != v or (kind == MISSING_ZERO
+                              and abs(v) <= ZERO_THRESHOLD):
+                    go_left = missing_left[node]
+                else:
+                    go_left = v <= threshold[node]
+                node = left[node] if go_left else right[node]
+            total += value[node]
+
+        if self.link == "mean":
+            return total / len(roots)
+        if self.average:
+            total /= len(roots)
+        return sigmoid(self.scale * (self.baseline + total))
+
+    def predict_proba(self, X) -> np.ndarray:
+        """Predicts the probabilities of the classes of many rows.
+
+        Walks all rows through a tree level by level, so the node arrays
+        may be memory-mapped. See save_model.
+
+        Args:
+            X: Features, as a data frame, array or sparse matrix.
+
+        Returns:
+            Array with the probabilities of the classes, one row per row
+            of X.
+        """
+        if hasattr(X, "toarray"): X = X.toarray()
+        X = np.asarray(X, dtype=np.float32 if self.float32 else np.float64)
+        X = X.astype(np.float64, copy=False)
+        a = self.arrays
+        left, right, value = a["left"], a["right"], a["value"]
+        # As in proba, boosting adds the leaves to the baseline in order
+        logit = self.link == "logit" and not self.average
+        total = np.full(len(X), self.baseline if logit else 0.0)
+        for root in a["roots"]:
+            node = np.full(len(X), root, dtype=np.intp)
+            active = np.flatnonzero(left[node] != -1)
+            while active.size:
+                n = node[active]
+                v = X[active, a["feature"][n]]
+                kind = a["missing_type"][n]
+                v = np.where(np.isnan(v) & (kind == MISSING_NONE), 0.0, v)
+                missing = np.isnan(v) | (
+                    (kind == MISSING_ZERO) & (np.abs(v) <= ZERO_THRESHOLD)
+                )
+                go_left = np.where(
+                    missing, a["missing_left"][n], v <= a["threshold"][n]
+                )
+                node[active] = np.where(go_left, left[n], right[n])
+                active = active[left[node[active]] != -1]
+            total += value[node]
+
+        n_trees = len(a["roots"])
+        if self.link == "mean":
+            proba = total / n_trees
+        else:
+            if self.average: total = self.baseline + total / n_trees
+            z = self.scale * total
+            proba = np.exp(-np.logaddexp(0.0, -z))
+
+        return np.column_stack([1.0 - proba, proba])
+
+    def predict(self, X) -> np.ndarray:
+        """Predicts the classes of many rows. See predict_proba."""
+        return self.classes_[(self.predict_proba(X)[:, 1] > 0.5).astype(int)]
+
+    def fit(self, X, y):
+        """Compiled trees are fitted already. Refit the original estimator."""
+        raise NotImplementedError("CompiledTrees cannot be fitted")
+
+    def __sklearn_is_fitted__(self) -> bool:
+        # E.g. for a Pipeline with compiled trees as the final estimator
+        return True
+
+
+def compile_sklearn_trees(trees: list) -> CompiledTrees:
+    """Compiles fitted scikit-learn decision trees, averaging them."""
+    nodes = []
+    for clf in trees:
+        tree = clf.tree_
+        value = tree.value[:, 0, :]
+        nodes.append(dict(
+            left=tree.children_left,
+            right=tree.children_right,
+            feature=tree.feature,
+            threshold=tree.threshold,
+            missing_left=(
+                tree.missing_go_to_left.astype(bool)
+                if hasattr(tree, "missing_go_to_left")
+                else np.ones(tree.node_count, dtype=bool)
+            ),
+            missing_type=np.full(tree.node_count, MISSING_NAN),
+            value=value[:, 1] / value.sum(axis=1)
+        ))
+
+    return CompiledTrees.from_nodes(
+        nodes, link="mean", float32=True, classes=trees[0].classes_
+    )
+
+
+def compile_decision_tree(clf: DecisionTreeClassifier) -> CompiledTrees:
+    return compile_sklearn_trees([clf])
+
+
+def compile_random_forest(clf: RandomForestClassifier) -> CompiledTrees:
+    return compile_sklearn_trees(clf.estimators_)
+
+
+def check_hist_gradient_boosting(clf: HistGradientBoostingClassifier):
+    """Checks that the private trees of a classifier can be compiled.
+
+    HistGradientBoostingClassifier has no public trees, so the compiler
+    reads _predictors and _baseline_prediction, as laid out in the
+    versions of scikit-learn in HGB_SKLEARN_VERSIONS.
+
+    Raises:
+        ValueError: If the version of scikit-learn is not known to lay out
+            the trees so, or the trees are missing.
+    """
+    version = parse_version(sklearn.__version__)
+    low, high = (parse_version(v) for v in HGB_SKLEARN_VERSIONS)
+    if not low <= version < high:
+        raise ValueError(
+            "HistGradientBoostingClassifier of scikit-learn {v} cannot be "
+            "compiled, only of {l} up to {h}".format(
+                v=sklearn.__version__, l=HGB_SKLEARN_VERSIONS[0],
+                h=HGB_SKLEARN_VERSIONS[1]
+            )
+        )
+    predictors = getattr(clf, "_predictors", None)
+    if not predictors or not hasattr(clf, "_baseline_prediction"):
+        raise ValueError(
+            "HistGradientBoostingClassifier has no trees to compile"
+        )
+    fields = set(getattr(predictors[0][0].nodes.dtype, "names", None) or ())
+    if not HGB_NODE_FIELDS <= fields:
+        raise ValueError(
+            "The trees of HistGradientBoostingClassifier lack {f}".format(
+                f=", ".join(sorted(HGB_NODE_FIELDS - fields))
+            )
+        )
+
+
+def compile_hist_gradient_boosting(
+        clf: HistGradientBoostingClassifier) -> CompiledTrees:
+    check_hist_gradient_boosting(clf)
+    nodes = []
+    for predictors in clf._predictors:
+        tree = predictors[0].nodes
+        if tree["is_categorical"].any():
+            raise ValueError(
+                "Categorical splits of HistGradientBoostingClassifier "
+                "cannot be compiled"
+            )
+        is_leaf = tree["is_leaf"].astype(bool)
+        nodes.append(dict(
+            left=np.where(is_leaf, -1, tree["left"].astype(np.int64)),
+            right=np.where(is_leaf, -1, tree["right"].astype(np.int64)),
+            feature=tree["feature_idx"],
+            threshold=tree["num_threshold"],
+            missing_left=tree["missing_go_to_left"].astype(bool),
+            missing_type=np.full(len(tree), MISSING_NAN),
+            value=tree["value"]
+        ))
+
+    return CompiledTrees.from_nodes(
+        nodes, link="logit",
+        baseline=float(np.ravel(clf._baseline_prediction)[0]),
+        classes=clf.classes_
+    )
+
+
+# Missing types of LightGBM splits
+LIGHTGBM_MISSING_TYPES = {
+    "None": MISSING_NONE, "NaN": MISSING_NAN, "Zero": MISSING_ZERO
+}
+
+
+def lightgbm_node(node: dict) -> tuple:
+    """Gives the fields of a dumped LightGBM node, children unset.
+
+    Raises:
+        ValueError: If the split is categorical.
+    """
+    if "leaf_value" in node:
+        return -1, -1, 0, 0.0, True, MISSING_NAN, node["leaf_value"]
+    if node["decision_type"] != "<=":
+        raise ValueError(
+            "Categorical splits of LGBMClassifier cannot be compiled"
+        )
+
+    return (
+        -1, -1, node["split_feature"], node["threshold"],
+        node["default_left"], LIGHTGBM_MISSING_TYPES[node["missing_type"]],
+        0.0
+    )
+
+
+def lightgbm_nodes(tree_structure: dict) -> dict:
+    """Flattens a tree of a dumped LightGBM model. See CompiledTrees.
+
+    Raises:
+        ValueError: If a split is categorical.
+    """
+    fields = (
+        "left", "right", "feature", "threshold", "missing_left",
+        "missing_type", "value"
+    )
+    tree = {field: [] for field in fields}
+    # Number the nodes depth first, parents before children
+    stack = [(tree_structure, None, None)]
+    while stack:
+        node, parent, side = stack.pop()
+        i = len(tree["value"])
+        if parent is not None:
+            tree[side][parent] = i
+        for field, v in zip(fields, lightgbm_node(node)):
+            tree[field].append(v)
+        if "leaf_value" not in node:
+            stack.append((node["right_child"], i, "right"))
+            stack.append((node["left_child"], i, "left"))
+
+    return {k: np.asarray(v) for k, v in tree.items()}
+
+
+def compile_lightgbm(clf) -> CompiledTrees:
+    """Compiles a fitted binary LGBMClassifier from its dumped trees.
+
+    Raises:
+        ValueError: If the objective is not binary, or a split is
+            categorical.
+    """
+    model = clf.booster_.dump_model()
+    objective = model["objective"].split()
+    if objective[0] != "binary":
+        raise ValueError(
+            "Only binary LGBMClassifier can be compiled, not {o}".format(
+                o=model["objective"]
+            )
+        )
+    scale = 1.0
+    for option in objective[1:]:
+        if option.startswith("sigmoid:"):
+            scale = float(option.split(":", 1)[1])
+    nodes = [
+        lightgbm_nodes(tree_info["tree_structure"])
+        for tree_info in model["tree_info"]
+    ]
+
+    return CompiledTrees.from_nodes(
+        nodes, link="logit", scale=scale,
+        average=bool(model.get("average_output", False)),
+        classes=clf.classes_
+    )
+
+
+class CompiledFallback(CompiledEstimator):
+    """Calls the predict_proba of an estimator that cannot be compiled.
+
+    E.g. a Pipeline with a ColumnTransformer. Slow, as the row goes
+    through the input validation of scikit-learn.
+
+    Args:
+        clf: Fitted classifier.
+        feature_names: Optional. Names of the features the classifier was
+            fitted to, if to a data frame.
+    """
+    # Given the row as is, e.g. with strings for a OneHotEncoder
+    raw = True
+
+    def __init__(self, clf, feature_names: Optional[list] = None):
+        self.clf = clf
+        self.feature_names = feature_names
+
+    def proba(self, x: list) -> float:
+        if self.feature_names is None:
+            X = np.asarray([x], dtype=float)
+        else:
+            X = pd.DataFrame([x], columns=self.feature_names)
+        return float(self.clf.predict_proba(X)[0, 1])
+
+
+class CompiledCrossFitted(CompiledEstimator):
+    """Averages estimators fitted to different folds. See predict_cross_fitted.
+
+    Args:
+        fold_clfs: Fitted classifiers, one per fold.
+        kwargs: Passed on to compile_estimator.
+    """
+    def __init__(self, fold_clfs: list, **kwargs):
+        self.clfs = [compile_estimator(clf, **kwargs) for clf in fold_clfs]
+        # The folds are clones of one estimator
+        self.float32 = self.clfs[0].float32
+        self.raw = self.clfs[0].raw
+
+    def proba(self, x: list) -> float:
+        return sum(clf.proba(x) for clf in self.clfs) / len(self.clfs)
+
+
+# Compilers of the supported estimators
+COMPILERS = {
+    LogisticRegression: CompiledLogisticRegression,
+    GaussianNB: CompiledGaussianNB,
+    DecisionTreeClassifier: compile_decision_tree,
+    RandomForestClassifier: compile_random_forest,
+    HistGradientBoostingClassifier: compile_hist_gradient_boosting
+}
+# Compilers of estimators of optional libraries, by class name, so the
+# libraries are not imported
+OPTIONAL_COMPILERS = {
+    "LGBMClassifier": compile_lightgbm
+}
+
+
+def find_compiler(clf) -> Optional[Callable]:
+    """Finds the compiler of a classifier, None if unsupported."""
+    compiler = COMPILERS.get(type(clf))
+    if compiler is None:
+        compiler = OPTIONAL_COMPILERS.get(type(clf).__name__)
+
+    return compiler
+
+
+def compile_estimator(clf, feature_names: Optional[list] = None,
+                      fallback: bool = False) -> CompiledEstimator:
+    """Compiles a fitted binary classifier.
+
+    A Pipeline is compiled as its final estimator if its other steps are
+    passthrough.
+
+    Args:
+        clf: Fitted classifier, of one of the types in COMPILERS or
+            OPTIONAL_COMPILERS, with classes 0 and 1. Compiled estimators
+            are returned as is.
+        feature_names: Optional. Names of the features, for the fallback.
+        fallback: If True, a classifier that cannot be compiled, e.g. a
+            Pipeline with a ColumnTransformer, is wrapped in a
+            CompiledFallback instead of raising.
+
+    Returns:
+        The compiled classifier.
+
+    Raises:
+        ValueError: If the classifier cannot be compiled, and not fallback.
+    """
+    if isinstance(clf, CompiledEstimator):
+        return clf
+    if len(clf.classes_) != 2:
+        raise ValueError(
+            "Only binary classifiers can be compiled, {c} has {n} classes"
+            .format(c=clf.__class__.__name__, n=len(clf.classes_))
+        )
+    estimator = clf
+    if isinstance(clf, Pipeline) and all(
+            step in (None, "passthrough") for _, step in clf.steps[:-1]):
+        estimator = clf.steps[-1][1]
+    compiler = find_compiler(estimator)
+    try:
+        if compiler is None:
+            raise ValueError(
+                "Cannot compile {c}, only {s}".format(
+                    c=estimator.__class__.__name__,
+                    s=", ".join(
+                        [c.__name__ for c in COMPILERS]
+                        + list(OPTIONAL_COMPILERS)
+                    )
+                )
+            )
+        return compiler(estimator)
+    except ValueError as e:
+        if not fallback:
+            raise
+        logger.warning("%s, falling back to predict_proba", e)
+        return CompiledFallback(clf, feature_names)
+
+
+class CompiledClassifier():
+    """Scores one patient at a time with a fitted stacked classifier.
+
+    Gives the same predictions as StackedGeneralizationClassifier.predict,
+    up to floating point rounding, in microseconds instead of
+    milliseconds. Create with StackedGeneralizationClassifier.compile.
+
+    Args:
+        base_clfs: Compiled base classifiers.
+        meta_clf: Compiled meta classifier.
+        breaks: Break points of the binned predictions.
+        feature_names: Optional. Names of the features, in order, to score
+            rows given as mappings.
+        use_probas: If True, the meta features are the probabilities of
+            1s. Else, the predicted classes.
+    """
+    def __init__(self, base_clfs: list, meta_clf: CompiledEstimator,
+                 breaks: tuple, feature_names: Optional[list] = None,
+                 use_probas: bool = True):
+        self.base_clfs = base_clfs
+        self.meta_clf = meta_clf
+        self.breaks = [float(b) for b in breaks]
+        self.feature_names = feature_names
+        self.use_probas = use_probas
+        self._float32 = any(clf.float32 for clf in base_clfs)
+        self._numeric = not all(clf.raw for clf in base_clfs)
+
+    def predict_proba(self, x: Union[Sequence, Mapping]) -> float:
+        """Predicts the probability of 1s of one row.
+
+        Args:
+            x: Features of the row, in the order of feature_names, or a
+                mapping from the feature names to the values.
+
+        Returns:
+            Predicted probability of 1s.
+        """
+        if isinstance(x, Mapping):
+            x = [x[f] for f in self.feature_names]
+        raw = list(x)
+        x = [float(v) for v in raw] if self._numeric else None
+        x32 = (
+            np.asarray(x, dtype=np.float32).tolist() if self._float32
+            else None
+        )
+
+        meta = []
+        for clf in self.base_clfs:
+            if clf.raw:
+                p = clf.proba(raw)
+            else:
+                p = clf.proba(x32 if clf.float32 else x)
+            meta.append(p if self.use_probas else float(p > 0.5))
+
+        return self.meta_clf.proba(meta)
+
+    def cut(self, y_prob: float) -> float:
+        """Bins a probability, as cut_probabilities, or NaN if outside."""
+        k = bisect_left(self.breaks, y_prob) - 1
+        if y_prob != y_prob or k < 0 or k >= len(self.breaks) - 1:
+            return float("nan")
+
+        return float(k)
+
+    def predict(self, x: Union[Sequence, Mapping]) -> tuple:
+        """Predicts one row.
+
+        Args:
+            x: Features of the row. See predict_proba.
+
+        Returns:
+            Tuple of the predicted probability of 1s and the binned
+            prediction.
+        """
+        y_prob = self.predict_proba(x)
+
+        return y_prob, self.cut(y_prob)
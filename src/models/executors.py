@@ -0,0 +1,374 @@
+import os
+import abc
+import sys
+import time
+import uuid
+import pickle
+import socket
+import logging
+import sqlite3
+import threading
+import traceback
+import subprocess
+
+from typing import Iterable, Iterator, Optional
+from contextlib import contextmanager
+from joblib import Parallel
+
+from src.models.shared import needs_memmap
+
+
+logger = logging.getLogger(__name__)
+
+# Seconds before a job whose worker stopped refreshing its claim is handed
+# out again. Workers refresh the claims of their jobs every third of it
+TIMEOUT = 300.0
+
+
+class Executor(abc.ABC):
+    """Runs independent jobs, e.g. the folds of a search.
+
+    Called like joblib.Parallel, with the jobs as (function, args, kwargs)
+    tuples from joblib.delayed. The results are yielded in the order of
+    the jobs. Closing the iterator cancels the jobs not yet started.
+
+    Attributes:
+        memmap: If True, the jobs run in other processes, and data shared
+            by the jobs should be memory-mapped. See SharedData.
+        temp_dir: Optional. Where to put the memory-mapped files, e.g. a
+            file system the workers share. If None, the system default.
+    """
+    memmap = False
+    temp_dir = None
+
+    @abc.abstractmethod
+    def __call__(self, jobs: Iterable[tuple]) -> Iterator:
+        """Runs the jobs, yielding their results in order."""
+
+
+class JoblibExecutor(Executor):
+    """Runs the jobs with joblib.Parallel on this machine.
+
+    Args:
+        n_jobs: Optional. Number of parallel jobs.
+        backend: Optional. Parallelization backend of joblib.Parallel.
+    """
+    def __init__(self, n_jobs: Optional[int] = None,
+                 backend: Optional[str] = None):
+        self.n_jobs = n_jobs
+        self.backend = backend
+        self.memmap = needs_memmap(n_jobs, backend)
+
+    def __call__(self, jobs: Iterable[tuple]) -> Iterator:
+        return Parallel(
+            n_jobs=self.n_jobs, backend=self.backend, return_as="generator"
+        )(jobs)
+
+
+class FuturesExecutor(Executor):
+    """Runs the jobs on anything with a concurrent.futures style submit.
+
+    E.g. a dask.distributed Client, a Ray or concurrent.futures pool. The
+    data is sent with the jobs, as the workers may be on other machines.
+
+    Args:
+        pool: Object whose submit(function, *args, **kwargs) gives a
+            future with a result() method.
+    """
+    def __init__(self, pool):
+        self.pool = pool
+
+    def __call__(self, jobs: Iterable[tuple]) -> Iterator:
+        futures = [
+            self.pool.submit(func, *args, **kwargs)
+            for func, args, kwargs in jobs
+        ]
+        try:
+            for future in futures:
+                yield future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+class DaskExecutor(FuturesExecutor):
+    """Runs the jobs on a Dask cluster.
+
+    Args:
+        address: Optional. Address of the scheduler. If None, a local
+            cluster is started.
+        kwargs: Passed on to dask.distributed.Client.
+    """
+    def __init__(self, address: Optional[str] = None, **kwargs):
+        try:
+            from dask.distributed import Client
+        except ImportError:
+            raise ImportError(
+                "DaskExecutor needs dask.distributed, pip install "
+                "'dask[distributed]'"
+            )
+        super().__init__(Client(address, **kwargs))
+
+
+class SQLiteQueueExecutor(Executor):
+    """Runs the jobs through a work queue in an SQLite file.
+
+    The jobs are pickled into the queue, and pulled by workers started
+    with `python -m src.models.worker PATH`, on this or other
+    machines. The functions must be importable by the workers. Workers on
+    other machines need the file, and temp_dir, on a shared file system
+    whose locks work, as SQLite relies on them. The caller also pulls jobs
+    while it waits, so the queue works without any workers.
+
+    While a worker runs a job, it refreshes its claim every timeout / 3
+    seconds. A job whose claim has not been refreshed within timeout is
+    given to another worker, e.g. when a machine is preempted.
+
+    Args:
+        path: Path of the SQLite file. Created if missing.
+        n_workers: Number of local worker processes to start for the
+            duration of each call.
+        timeout: Seconds without a refreshed claim before a job is handed
+            out again.
+        poll: Seconds between checks for finished jobs.
+        work: If True, the caller runs jobs too while it waits.
+        temp_dir: Optional. Where to put the memory-mapped data. If None,
+            next to the SQLite file.
+    """
+    memmap = True
+
+    def __init__(self, path: str, n_workers: int = 0,
+                 timeout: float = TIMEOUT, poll: float = 0.5,
+                 work: bool = True, temp_dir: Optional[str] = None):
+        self.path = path
+        self.n_workers = n_workers
+        self.timeout = timeout
+        self.poll = poll
+        self.work = work
+        self.temp_dir = (
+            os.path.dirname(os.path.abspath(path)) if temp_dir is None
+            else temp_dir
+        )
+        with connect(path) as db:
+            create_queue(db)
+
+    def __call__(self, jobs: Iterable[tuple]) -> Iterator:
+        run = uuid.uuid4().hex
+        with connect(self.path) as db:
+            db.execute("BEGIN IMMEDIATE")
+            db.executemany(
+                "INSERT INTO jobs (run, seq, payload) VALUES (?, ?, ?)",
+                (
+                    (run, seq, pickle.dumps(job))
+                    for seq, job in enumerate(jobs)
+                )
+            )
+            n = db.execute(
+                "SELECT COUNT(*) FROM jobs WHERE run = ?", (run, )
+            ).fetchone()[0]
+            db.execute("COMMIT")
+
+        workers = [
+            subprocess.Popen([
+                sys.executable, "-m", "src.models.worker", self.path,
+                "--poll", str(self.poll), "--timeout", str(self.timeout)
+            ]) for _ in range(self.n_workers)
+        ]
+        try:
+            with connect(self.path) as db:
+                for seq in range(n):
+                    yield self._wait(db, run, seq)
+        finally:
+            for worker in workers:
+                worker.terminate()
+            for worker in workers:
+                worker.wait()
+            with connect(self.path) as db:
+                db.execute("DELETE FROM jobs WHERE run = ?", (run, ))
+
+    def _wait(self, db: sqlite3.Connection, run: str, seq: int):
+        """Waits for a job to finish, running other jobs meanwhile."""
+        while True:
+            status, result, error = db.execute(
+                "SELECT status, result, error FROM jobs "
+                "WHERE run = ? AND seq = ?", (run, seq)
+            ).fetchone()
+            if status == "done":
+                return pickle.loads(result)
+            if status == "failed":
+                raise RuntimeError(
+                    "Job {s} failed in a worker:\n{e}".format(s=seq, e=error)
+                )
+            if not (self.work and run_one(db, self.timeout, run)):
+                time.sleep(self.poll)
+
+
+@contextmanager
+def connect(path: str):
+    """Opens the queue, with transactions managed by the caller."""
+    db = sqlite3.connect(path, timeout=60, isolation_level=None)
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def create_queue(db: sqlite3.Connection) -> None:
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS jobs ("
+        "id INTEGER PRIMARY KEY, run TEXT, seq INTEGER, payload BLOB, "
+        "status TEXT DEFAULT 'pending', worker TEXT, claimed_at REAL, "
+        "result BLOB, error TEXT)"
+    )
+    db.execute(
+        "CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)"
+    )
+    db.execute("CREATE INDEX IF NOT EXISTS jobs_run ON jobs (run, seq)")
+
+
+def claim(db: sqlite3.Connection, timeout: float,
+          run: Optional[str] = None) -> Optional[tuple]:
+    """Claims the oldest pending job, or one claimed too long ago.
+
+    Args:
+        db: Connection to the queue.
+        timeout: Seconds without a refreshed claim before a job can be
+            claimed again.
+        run: Optional. If given, only jobs of this call.
+
+    Returns:
+        Tuple of the id and payload of the job, or None if there is none.
+    """
+    now = time.time()
+    query = (
+        "SELECT id, payload FROM jobs WHERE "
+        "(status = 'pending' OR (status = 'running' AND claimed_at < ?))"
+    )
+    params = [now - timeout]
+    if run is not None:
+        query += " AND run = ?"
+        params.append(run)
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        job = db.execute(query + " ORDER BY id LIMIT 1", params).fetchone()
+        if job is not None:
+            db.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, "
+                "claimed_at = ? WHERE id = ?",
+                (worker_name(), now, job[0])
+            )
+        db.execute("COMMIT")
+    except BaseException:
+        db.execute("ROLLBACK")
+        raise
+
+    return job
+
+
+def worker_name() -> str:
+    """Names the process that claims jobs, as host:pid."""
+    return "{h}:{p}".format(h=socket.gethostname(), p=os.getpid())
+
+
+@contextmanager
+def heartbeat(db: sqlite3.Connection, job_id: int, interval: float):
+    """Refreshes the claim of a job while it runs.
+
+    A thread with a connection of its own sets claimed_at of the job to the
+    current time every interval seconds, while the job is still claimed by
+    this process.
+
+    Args:
+        db: Connection to the queue.
+        job_id: Id of the claimed job.
+        interval: Seconds between the refreshes.
+    """
+    path = db.execute("PRAGMA database_list").fetchone()[2]
+    worker = worker_name()
+    stop = threading.Event()
+
+    def beat():
+        with connect(path) as beat_db:
+            while not stop.wait(interval):
+                try:
+                    beat_db.execute(
+                        "UPDATE jobs SET claimed_at = ? WHERE id = ? "
+                        "AND status = 'running' AND worker = ?",
+                        (time.time(), job_id, worker)
+                    )
+                except sqlite3.Error:
+                    logger.warning(
+                        "could not refresh the claim of job %d", job_id,
+                        exc_info=True
+                    )
+
+    thread = threading.Thread(target=beat, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def run_one(db: sqlite3.Connection, timeout: float,
+            run: Optional[str] = None) -> bool:
+    """Claims a job, runs it and saves the result.
+
+    The claim is refreshed every timeout / 3 seconds while the job runs.
+
+    Args:
+        db: Connection to the queue.
+        timeout: Seconds without a refreshed claim before a job can be
+            claimed again.
+        run: Optional. If given, only jobs of this call.
+
+    Returns:
+        True if a job was run.
+    """
+    job = claim(db, timeout, run)
+    if job is None:
+        return False
+
+    job_id, payload = job
+    try:
+        func, args, kwargs = pickle.loads(payload)
+        with heartbeat(db, job_id, timeout / 3):
+            result = pickle.dumps(func(*args, **kwargs))
+    except Exception:
+        logger.exception("job %d failed", job_id)
+        db.execute(
+            "UPDATE jobs SET status = 'failed', error = ? WHERE id = ?",
+            (traceback.format_exc(), job_id)
+        )
+    else:
+        db.execute(
+            "UPDATE jobs SET status = 'done', result = ?, payload = NULL "
+            "WHERE id = ? AND status = 'running'",
+            (result, job_id)
+        )
+
+    return True
+
+
+def work(path: str, poll: float = 0.5, timeout: float = TIMEOUT,
+         idle: Optional[float] = None) -> None:
+    """Pulls jobs from a queue and runs them, as a worker.
+
+    Args:
+        path: Path of the SQLite file of the queue.
+        poll: Seconds between checks for jobs.
+        timeout: Seconds without a refreshed claim before a job can be
+            claimed again.
+        idle: Optional. If given, returns after this many seconds
+            without jobs. Else, runs until stopped.
+    """
+    logger.info("working on %s", path)
+    with connect(path) as db:
+        create_queue(db)
+        last_job = time.time()
+        while idle is None or time.time() - last_job < idle:
+            if run_one(db, timeout):
+                last_job = time.time()
+            else:
+                time.sleep(poll)
@@ -1,12 +1,12 @@
 import numpy as np
 import pandas as pd
 
-import rpy2.robjects.packages as rpackages
-import rpy2.robjects as robjects
-
+from typing import Optional, Union
 from tqdm import tqdm
-from sklearn.utils import resample
-from joblib import Parallel, delayed
+from scipy.stats import rankdata
+from sklearn.base import clone
+from sklearn.model_selection import StratifiedKFold
+from joblib import cpu_count, effective_n_jobs
 
 from sklearn.metrics import (
     roc_auc_score,
@@ -14,42 +14,122 @@ from sklearn.metrics import (
     recall_score
 )
 
-from src.models.classifiers import StackedGeneralizationClassifier
+from src.models.resampling import (
+    bootstrap_indices,
+    derive_seed,
+    derive_seed_sequence,
+    BOOTSTRAP_SAMPLES,
+    BOOTSTRAP_REPLICATES,
+    HELD_OUT_FOLDS,
+    OUTER_FOLDS
+)
+from src.models.shared import SharedData
+from src.models.executors import Executor, JoblibExecutor
+from src.models.timing import timed, timed_delayed, collect_timed
+
+
+NRI_LABELS = [
+    "nri", "nri_plus", 
+    "nri_minus", "pr_up_dead", 
+    "pr_down_dead", "pr_down_surv", 
+    "pr_up_surv"
+]
 
 
-def calculate_nri(y_true: np.array, y_old: np.array, y_new: np.array) -> pd.Series:
+def calculate_nri(y_true: np.array, y_old: np.array, y_new: np.array,
+                  cut: tuple = (2, 3, 4), method: str = "numpy") -> pd.Series:
     """Calculates Net Reclassification Improvement (NRI)
     
-    Uses the R package nricens to do so.
+    Categorical NRI, as in nribin of the R package nricens with 
+    updown = "category". Predictions are put in categories by the cut 
+    points, with the categories closed to the left.
     
     Args:
         y_true: Actual target values.
         y_old: Model predictions by old classifier.
         y_new: Model predictions by new classifier.
+        cut: Cut points between the categories.
+        method: If "numpy", computed natively. If "r", uses nricens
+            through rpy2, e.g. to cross-check.
         
     Returns:
         Series with nri components and information on movement
         in categories.
     """
+    if method == "r":
+        return calculate_nri_r(y_true, y_old, y_new, cut)
+    
+    nri = compute_nri_batch(
+        y_true=np.asarray(y_true)[np.newaxis, :],
+        y_old=np.asarray(y_old)[np.newaxis, :],
+        y_new=np.asarray(y_new)[np.newaxis, :],
+        cut=cut
+    )
+
+    return pd.Series(nri[:, 0], index = NRI_LABELS)
+
+
+def compute_nri_batch(y_true: np.ndarray, y_old: np.ndarray,
+                      y_new: np.ndarray, cut: tuple = (2, 3, 4)) -> np.ndarray:
+    """Calculates Net Reclassification Improvement (NRI) for many samples.
+    
+    See calculate_nri. Each row is one sample, e.g. a bootstrap sample.
+    
+    Args:
+        y_true: Actual target values, samples x observations.
+        y_old: Model predictions by old classifier, same shape.
+        y_new: Model predictions by new classifier, same shape.
+        cut: Cut points between the categories.
+        
+    Returns:
+        Array with the components in NRI_LABELS as rows, and the samples
+        as columns.
+    """
+    dead = np.asarray(y_true) == 1
+    cut = np.sort(np.asarray(cut, dtype=float))
+    category_old = np.searchsorted(cut, np.asarray(y_old, dtype=float), side="right")
+    category_new = np.searchsorted(cut, np.asarray(y_new, dtype=float), side="right")
+    up = category_new > category_old
+    down = category_new < category_old
+    
+    n_dead = dead.sum(axis=1)
+    n_surv = (~dead).sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pr_up_dead = (up & dead).sum(axis=1) / n_dead
+        pr_down_dead = (down & dead).sum(axis=1) / n_dead
+        pr_down_surv = (down & ~dead).sum(axis=1) / n_surv
+        pr_up_surv = (up & ~dead).sum(axis=1) / n_surv
+    nri_plus = pr_up_dead - pr_down_dead
+    nri_minus = pr_down_surv - pr_up_surv
+
+    return np.vstack([
+        nri_plus + nri_minus, nri_plus, nri_minus, pr_up_dead,
+        pr_down_dead, pr_down_surv, pr_up_surv
+    ])
+
+
+def calculate_nri_r(y_true: np.array, y_old: np.array, y_new: np.array,
+                    cut: tuple = (2, 3, 4)) -> pd.Series:
+    """Calculates Net Reclassification Improvement (NRI) in R.
+    
+    Uses the R package nricens to do so. See calculate_nri.
+    """
+    # Imported here, so that R is only needed for the cross-check
+    import rpy2.robjects.packages as rpackages
+    import rpy2.robjects as robjects
+
     nricens = rpackages.importr("nricens")
-    utils = rpackages.importr("utils")
 
     rnri = nricens.nribin(
-        event = robjects.vectors.IntVector(y_true.tolist()), 
-        p_std = robjects.vectors.IntVector(y_old.tolist()), 
-        p_new = robjects.vectors.IntVector(y_new.tolist()),
-        cut = [2, 3, 4],
+        event = robjects.vectors.IntVector(np.asarray(y_true).tolist()), 
+        p_std = robjects.vectors.IntVector(np.asarray(y_old).astype(int).tolist()), 
+        p_new = robjects.vectors.IntVector(np.asarray(y_new).astype(int).tolist()),
+        cut = robjects.vectors.FloatVector(list(cut)),
         niter = 0,
         msg = False
     ).rx2("nri")
 
-    labels = [
-        "nri", "nri_plus", 
-        "nri_minus", "pr_up_dead", 
-        "pr_down_dead", "pr_down_surv", 
-        "pr_up_surv"
-    ]
-    nri = pd.Series(np.asarray(rnri).flatten(), index = labels)
+    nri = pd.Series(np.asarray(rnri).flatten(), index = NRI_LABELS)
 
     return nri
 
@@ -116,12 +196,307 @@ def compute_performance(y_prob: np.array, y_pred: np.array,
     return r
 
 
+def compute_roc_auc_batch(y_true: np.ndarray, y_score: np.ndarray) -> np.ndarray:
+    """Computes AUC of ROC for many samples at once.
+    
+    Uses the Mann-Whitney statistic, with ties counted as one half, which
+    equals roc_auc_score.
+    
+    Args:
+        y_true: True labels, samples x observations.
+        y_score: Scores, same shape.
+        
+    Returns:
+        AUC of ROC for each sample. NaN if a class is missing.
+    """
+    y_true = np.asarray(y_true) == 1
+    ranks = rankdata(y_score, axis=1)
+    n_pos = y_true.sum(axis=1)
+    n_neg = y_true.shape[1] - n_pos
+    rank_sum = np.where(y_true, ranks, 0).sum(axis=1)
+    
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (rank_sum - n_pos * (n_pos + 1) / 2) / (n_pos * n_neg)
+
+
+def compute_performance_batch(y_probs: dict, y_preds: dict,
+                              y_true: np.ndarray,
+                              y_pred_cuts: Optional[dict] = None,
+                              tc: Optional[np.ndarray] = None) -> pd.DataFrame:
+    """Computes performance metrics for many samples at once.
+    
+    Same metrics as compute_performance, for binary labels, but for all
+    classifiers and samples in one vectorized pass. Each row of the 
+    arrays is one sample, e.g. a bootstrap sample. AUCs of ROC are NaN
+    in samples with one class, where compute_performance raises.
+    
+    Args:
+        y_probs: Predicted probabilities of 1s, samples x observations,
+            for each classifier key.
+        y_preds: Predicted class, same shape, for each classifier key.
+        y_true: True labels, samples x observations. A single row is used
+            for all samples.
+        y_pred_cuts: Optional. Cut predicted probabilities, same shape, for
+            the classifier keys that have them.
+        tc: Optional. Clincians predicted triage category. Required with
+            y_pred_cuts. A single row is used for all samples.
+        
+    Returns:
+        Tidy data frame with one row per sample, classifier and metric, and
+        the columns sample, the position of the sample, clf, the
+        classifier key, metric and value. See performance_to_dicts.
+    """
+    if y_pred_cuts is None: y_pred_cuts = {}
+    shape = np.shape(next(iter(y_probs.values())))
+    y_true = np.broadcast_to(np.asarray(y_true), shape)
+    positive = y_true == 1
+    if tc is not None:
+        tc = np.broadcast_to(np.asarray(tc, dtype=float), shape)
+        roc_auc_tc = compute_roc_auc_batch(y_true, tc)
+    
+    performance = {}
+    for key in y_probs:
+        predicted = np.asarray(y_preds[key]) == 1
+        tp = (predicted & positive).sum(axis=1)
+        fp = (predicted & ~positive).sum(axis=1)
+        fn = (~predicted & positive).sum(axis=1)
+        tn = (~predicted & ~positive).sum(axis=1)
+        # Macro average over the two classes, 0 when undefined
+        with np.errstate(divide="ignore", invalid="ignore"):
+            prec = (
+                np.nan_to_num(tp / (tp + fp)) + np.nan_to_num(tn / (tn + fn))
+            ) / 2
+            rec = (
+                np.nan_to_num(tp / (tp + fn)) + np.nan_to_num(tn / (tn + fp))
+            ) / 2
+        roc_auc = compute_roc_auc_batch(y_true, y_probs[key])
+        performance[key, "roc_auc_con"] = roc_auc
+        performance[key, "prec"] = prec
+        performance[key, "rec"] = rec
+
+        if key in y_pred_cuts:
+            roc_auc_cut = compute_roc_auc_batch(y_true, y_pred_cuts[key])
+            nri = compute_nri_batch(
+                y_true=y_true, 
+                y_old=tc,
+                y_new=y_pred_cuts[key]
+            )
+            performance[key, "roc_auc_cut"] = roc_auc_cut
+            performance[key, "roc_auc_model_model"] = roc_auc - roc_auc_cut
+            performance[key, "roc_auc_model_tc"] = roc_auc - roc_auc_tc
+            for m, values in zip(NRI_LABELS[:3], nri[:3]):
+                performance[key, m] = values
+
+    clfs, metrics = zip(*performance)
+    values = np.array(list(performance.values()))
+    n_samples = values.shape[1]
+    
+    return pd.DataFrame({
+        "sample": np.repeat(np.arange(n_samples), len(metrics)),
+        "clf": list(clfs) * n_samples,
+        "metric": list(metrics) * n_samples,
+        "value": values.T.ravel()
+    })
+
+
+def performance_to_dicts(performance: pd.DataFrame) -> list:
+    """Gives the metrics of each sample as compute_performance does.
+    
+    Args:
+        performance: Metrics from compute_performance_batch.
+        
+    Returns:
+        List with, for each sample in order, a dictionary from the
+        classifier keys to dictionaries of metrics.
+    """
+    return [
+        {
+            key: dict(zip(metrics.metric, metrics.value.tolist()))
+            for key, metrics in sample.groupby("clf", sort=False)
+        }
+        for _, sample in performance.groupby("sample", sort=True)
+    ]
+
+
+def compute_binned_roc_aucs(y_prob: np.array, y_true: np.array,
+                            all_breaks: list) -> np.ndarray:
+    """Computes AUC of ROC of binned probabilities, for many breaks at once.
+    
+    Equivalent to binning y_prob with each breaks as in
+    cut_probabilities, and computing roc_auc_score of the bin labels.
+    The binned score only takes as many values as there are bins, so
+    the AUC follows from the number of 1s and 0s in each bin. Those are
+    found with cumulative class counts on the sorted probabilities.
+    Probabilities outside the outermost breaks are ignored.
+    
+    Args:
+        y_prob: Predicted probabilities of 1s.
+        y_true: True labels.
+        all_breaks: Break points to evaluate. All with the same length.
+        
+    Returns:
+        AUC of ROC for each breaks. NaN if a class is missing.
+    """
+    y_prob = np.asarray(y_prob, dtype=float)
+    y_true = np.asarray(y_true) == 1
+    breaks = np.asarray(all_breaks, dtype=float)
+    
+    # Number of 1s and 0s below or at each break, bins are (b_k, b_k+1]
+    n_pos_le = np.searchsorted(np.sort(y_prob[y_true]), breaks, side="right")
+    n_neg_le = np.searchsorted(np.sort(y_prob[~y_true]), breaks, side="right")
+    n_pos = np.diff(n_pos_le, axis=1)
+    n_neg = np.diff(n_neg_le, axis=1)
+    
+    # Pairs where the 1 is in a higher bin, and half of the ties
+    n_neg_below = np.cumsum(n_neg, axis=1) - n_neg
+    concordant = np.sum(n_pos * (n_neg_below + 0.5 * n_neg), axis=1)
+    n_pairs = n_pos.sum(axis=1) * n_neg.sum(axis=1)
+    
+    with np.errstate(divide="ignore", invalid="ignore"):
+        roc_aucs = np.where(n_pairs > 0, concordant / n_pairs, np.nan)
+    
+    return roc_aucs
+
+
+# Greatest number of candidate break points searched exactly, when
+# find_optimal_breaks has no max_candidates. The search holds two
+# (n + 1) x (n + 1) matrices, about 64 MB for 2000 candidates
+MAX_EXACT_CANDIDATES = 2000
+
+
+def find_optimal_breaks(y_probs: list, y_trues: list, n_bins: int = 4,
+                        max_candidates: Optional[int] = 250) -> tuple:
+    """Finds the breaks that maximise the AUC of ROC of binned probabilities.
+    
+    The AUC of a binned score is a sum over the bins, where the term
+    for a bin depends only on where the bin starts and ends. The best
+    partition into n_bins contiguous bins is therefore found exactly by
+    dynamic programming over the candidate break points. With several
+    folds, the mean AUC over the folds is maximised.
+    
+    The search takes time and memory quadratic in the number of
+    candidates n, O(n_bins * n^2), so max_candidates bounds the work
+    regardless of the number of rows: 250 candidates take milliseconds.
+    No subquadratic search applies, as the gains of the bins do not
+    satisfy the quadrangle inequality. Compressing costs little AUC:
+    moving a break to the edge of its candidate group only moves rows
+    of that group to the next bin, which changes the AUC by at most
+    (p / P + q / Q) / 2 per break, where p and q are the 1s and 0s of the
+    group, and P and Q of all rows. With quantile candidates each group holds
+    about 1 / max_candidates of the rows, plus ties.
+    
+    Args:
+        y_probs: Predicted probabilities of 1s, one array per fold.
+        y_trues: True labels, one array per fold.
+        n_bins: Number of bins.
+        max_candidates: Optional. If not None, the candidate break
+            points are compressed to at most this many quantiles of the
+            probabilities. Else, all unique probabilities are candidates,
+            at most MAX_EXACT_CANDIDATES of them.
+            
+    Returns:
+        Breaks, starting at 0 and ending at inf, as used by
+        cut_probabilities.
+    
+    Raises:
+        ValueError: If there are fewer distinct probabilities than bins,
+            or more than MAX_EXACT_CANDIDATES and no max_candidates.
+    """
+    y_probs = [np.asarray(p, dtype=float) for p in y_probs]
+    y_trues = [np.asarray(t) == 1 for t in y_trues]
+    pooled = np.concatenate(y_probs)
+    
+    # Upper edges of the candidate groups, each a predicted value
+    candidates = np.unique(pooled)
+    if max_candidates is not None and len(candidates) > max_candidates:
+        q = np.linspace(0, 1, max_candidates + 1)[1:]
+        candidates = np.unique(
+            np.quantile(pooled, q, method="inverted_cdf")
+        )
+    n = len(candidates)
+    if n > MAX_EXACT_CANDIDATES:
+        raise ValueError(
+            "{n} distinct probabilities are too many to search exactly, "
+            "give max_candidates.".format(n=n)
+        )
+    if n < n_bins:
+        raise ValueError(
+            "Need at least {k} distinct probabilities, got {n}.".format(
+                k=n_bins, n=n)
+        )
+    
+    # gain[a, b] is the contribution to the mean AUC of a bin holding
+    # groups a to b - 1
+    gain = np.zeros((n + 1, n + 1))
+    for y_prob, y_true in zip(y_probs, y_trues):
+        group = np.searchsorted(candidates, y_prob, side="left")
+        n_pos = np.concatenate(
+            ([0], np.cumsum(np.bincount(group[y_true], minlength=n))))
+        n_neg = np.concatenate(
+            ([0], np.cumsum(np.bincount(group[~y_true], minlength=n))))
+        n_pairs = n_pos[-1] * n_neg[-1]
+        if n_pairs == 0:
+            continue
+        gain += (
+            (n_pos[np.newaxis, :] - n_pos[:, np.newaxis]) *
+            (n_neg[np.newaxis, :] + n_neg[:, np.newaxis]) / 2
+        ) / (n_pairs * len(y_probs))
+    gain[np.tril_indices(n + 1)] = -np.inf
+    
+    # best[b] is the greatest gain of splitting groups 0 to b - 1 into
+    # the bins seen so far
+    best = gain[0].copy()
+    starts = []
+    for _ in range(n_bins - 1):
+        total = best[:, np.newaxis] + gain
+        starts.append(np.argmax(total, axis=0))
+        best = np.max(total, axis=0)
+    
+    # Trace back the start of each bin
+    edges = [n]
+    for start in reversed(starts):
+        edges.append(start[edges[-1]])
+    cuts = [candidates[e - 1] for e in reversed(edges[1:])]
+    
+    return (0, ) + tuple(float(c) for c in cuts) + (np.inf, )
+
+
+def predict_all(sgclf, X: pd.DataFrame) -> tuple:
+    """Predicts with each base classifier and the meta classifier.
+    
+    Args:
+        sgclf: Fitted StackedGeneralizationClassifier.
+        X: Features.
+        
+    Returns:
+        Tuple of predicted probabilities of 1s and predicted classes, with
+        one column per base classifier and the meta classifier last, and
+        the cut predictions of the meta classifier.
+    """
+    # Predictions by the meta classifier
+    y_prob_con, y_prob_cut = sgclf.predict(X)
+    y_pred_meta_clf = sgclf.predict(X, use_probas = False)
+    
+    # Predictions for each base classifier
+    y_prob_clfs = sgclf.predict_meta_features(X, use_probas = True)
+    y_pred_clfs = sgclf.predict_meta_features(X, use_probas = False) 
+
+    # Merge the two
+    y_preds = np.column_stack((y_pred_clfs, y_pred_meta_clf))
+    y_probs = np.column_stack((y_prob_clfs, y_prob_con))
+    
+    return y_probs, y_preds, y_prob_cut
+
+
 def compute_metrics(X_train: pd.DataFrame, y_train: pd.Series, 
                     X_test: pd.DataFrame, y_test: pd.Series,
                     tc: pd.Series, keys: list,
                     base_clfs: list, 
                     meta_clf: callable,
-                    all_hyper_parameters: list):
+                    all_hyper_parameters: list,
+                    n_jobs: Optional[int] = None,
+                    hyper_parameters: Optional[dict] = None,
+                    random_state: Optional[np.random.SeedSequence] = None):
     """Computes relevant performance metrics.
     
     ROC, Precision, Recall, and NRI for the meta classifier.
@@ -136,85 +511,313 @@ def compute_metrics(X_train: pd.DataFrame, y_train: pd.Series,
         base_clfs: Base (level 0) classifiers.
         meta_clf: Meta (level 1) classifiers.
         all_hyper_parameters: Hyper parameters to search.
+        n_jobs: Optional. Number of parallel jobs in the search.
+        hyper_parameters: Optional. If given, the classifier is fitted 
+            with these hyper parameters, and all_hyper_parameters is not
+            searched.
+        random_state: Optional. Seed of the classifier.
         
     Returns:
         Dictionary with performance metrics, for each classifier.
     """
+    # Imported here, as the classifier uses the metrics in this module
+    from src.models.classifiers import StackedGeneralizationClassifier
+
     # Fit classifier
     sgclf = StackedGeneralizationClassifier(
         base_clfs=base_clfs, 
         meta_clf=meta_clf,
         use_probas=True, 
-        verbose=False
+        verbose=False,
+        n_jobs=n_jobs,
+        random_state=random_state
     )
-    sgclf.cv_outer_loop(
-        all_hyper_parameters=all_hyper_parameters,
-        X=X_train, 
-        y=y_train,
-        refit=True
-    )
-    # Predictions by the meta classifier
-    y_test_prob_con, y_test_prob_cut = sgclf.predict(X_test)
-    y_test_pred_meta_clf = sgclf.predict(X_test, use_probas = False)
+    if hyper_parameters is None:
+        sgclf.cv_outer_loop(
+            all_hyper_parameters=all_hyper_parameters,
+            X=X_train, 
+            y=y_train,
+            refit=True,
+            n_jobs=n_jobs
+        )
+    else:
+        sgclf.hyper_parameters = hyper_parameters
+        sgclf.fit(X=X_train, y=y_train)
+    y_probs, y_preds, y_test_prob_cut = predict_all(sgclf, X_test)
     
-    # Predictions for each base classifier
-    y_test_prob_clfs = sgclf.predict_meta_features(X_test, use_probas = True)
-    y_test_pred_clfs = sgclf.predict_meta_features(X_test, use_probas = False) 
+    # The same metrics as the prediction bootstrap, as one sample
+    with timed("compute_performance"):
+        performance = compute_performance_batch(
+            y_probs={key: y_probs[None, :, k] for k, key in enumerate(keys)},
+            y_preds={key: y_preds[None, :, k] for k, key in enumerate(keys)},
+            y_true=np.asarray(y_test),
+            y_pred_cuts={keys[-1]: y_test_prob_cut[None]},
+            tc=np.asarray(tc)
+        )
+    
+    return performance_to_dicts(performance)[0]
 
-    # Merge the two
-    y_preds = np.column_stack((y_test_pred_clfs, y_test_pred_meta_clf))
-    y_probs = np.column_stack((y_test_prob_clfs, y_test_prob_con))
-    
-    # Helper for calculating performance
-    y_test_prob_cuts = [None] * (len(keys) - 1) + [y_test_prob_cut]
-    ds = {key: compute_performance(
-            y_prob=prob, 
-            y_pred=pred, 
-            y_true=y_test,
-            y_pred_cut=cut,
-            tc=tc
-        ) for prob, pred, key, cut in zip(
-            y_probs.T, 
-            y_preds.T, 
-            keys,
-            y_test_prob_cuts
-    )}
-    
-    return ds
-
-
-def boot_compute_metrics(X: pd.DataFrame, y: pd.Series, 
-                         tc: pd.Series, training_size: int,
+
+def boot_compute_metrics(data: SharedData, train_index: np.ndarray,
+                         test_index: np.ndarray,
                          keys: list, base_clfs: list,
                          meta_clf: callable, 
-                         all_hyper_parameters: list):
-    """Helper to refactor compute_metrics."""
+                         all_hyper_parameters: list,
+                         n_jobs: Optional[int] = None,
+                         hyper_parameters: Optional[dict] = None,
+                         random_state: Optional[np.random.SeedSequence] = None):
+    """Helper to refactor compute_metrics.
+    
+    Args:
+        data: Features, targets and clinician priorities.
+        train_index: Positions of the rows in the bootstrap sample.
+        test_index: Positions of the rows not in the bootstrap sample.
+    """
     # Prepare training and test sets
-    X_train = resample(X, n_samples=training_size, stratify=y)
-    y_train = y.loc[X_train.index]
-    tc_train = tc.loc[X_train.index]
-    X_test = X.loc[~X.index.isin(X_train.index), :]
-    y_test = y.loc[X_test.index]
-    tc_test = tc.loc[X_test.index]
-
-    return compute_metrics(
-        X_train=X_train,
-        y_train=y_train, 
-        X_test=X_test, 
-        y_test=y_test, 
-        tc=tc_test,
-        keys=keys,
-        base_clfs=base_clfs,
-        meta_clf=meta_clf,
-        all_hyper_parameters=all_hyper_parameters
+    X_train, y_train, _ = data.take(train_index)
+    X_test, y_test, tc_test = data.take(test_index)
+
+    with timed("bootstrap_sample"):
+        return compute_metrics(
+            X_train=X_train,
+            y_train=y_train, 
+            X_test=X_test, 
+            y_test=y_test, 
+            tc=tc_test,
+            keys=keys,
+            base_clfs=base_clfs,
+            meta_clf=meta_clf,
+            all_hyper_parameters=all_hyper_parameters,
+            n_jobs=n_jobs,
+            hyper_parameters=hyper_parameters,
+            random_state=random_state
+        )
+
+
+def search_hyper_parameters(X: pd.DataFrame, y: pd.Series,
+                            base_clfs: list, meta_clf: callable,
+                            all_hyper_parameters: list,
+                            n_jobs: Optional[int] = None,
+                            random_state: Optional[np.random.SeedSequence] = None,
+                            executor: Optional[Executor] = None
+                            ) -> dict:
+    """Searches the best hyper parameters once, on all rows.
+    
+    Returns:
+        The hyper parameters, including breaks, picked by cv_outer_loop.
+    """
+    from src.models.classifiers import StackedGeneralizationClassifier
+
+    sgclf = StackedGeneralizationClassifier(
+        base_clfs=[clone(clf) for clf in base_clfs], 
+        meta_clf=clone(meta_clf),
+        use_probas=True, 
+        verbose=False,
+        random_state=random_state
+    )
+    with timed("search_hyper_parameters"):
+        sgclf.cv_outer_loop(
+            all_hyper_parameters=all_hyper_parameters,
+            X=X, 
+            y=y,
+            refit=False,
+            n_jobs=n_jobs,
+            executor=executor
+        )
+    
+    return sgclf.hyper_parameters
+
+
+def compute_held_out_predictions(X: pd.DataFrame, y: pd.Series,
+                                 base_clfs: list, meta_clf: callable,
+                                 hyper_parameters: dict,
+                                 folds: int = 5,
+                                 n_jobs: Optional[int] = None,
+                                 random_state: Optional[np.random.SeedSequence] = None
+                                 ) -> tuple:
+    """Predicts each row with classifiers not fitted to it.
+    
+    Uses k-fold cross-validation with fixed hyper parameters.
+    
+    Args:
+        X: Features.
+        y: Targets.
+        base_clfs: Base (level 0) classifiers.
+        meta_clf: Meta (level 1) classifiers.
+        hyper_parameters: Hyper parameters, including breaks.
+        folds: Number of folds.
+        n_jobs: Optional. Number of parallel jobs when fitting.
+        random_state: Optional. If given, the folds are shuffled and the
+            classifiers seeded.
+        
+    Returns:
+        Tuple as from predict_all, for all rows.
+    """
+    from src.models.classifiers import StackedGeneralizationClassifier
+    
+    n_clfs = len(base_clfs) + 1
+    y_probs = np.zeros((len(y), n_clfs))
+    y_preds = np.zeros((len(y), n_clfs))
+    y_prob_cut = np.zeros(len(y))
+    if random_state is None:
+        outer_loop = StratifiedKFold(n_splits=folds)
+    else:
+        outer_loop = StratifiedKFold(
+            n_splits=folds, shuffle=True,
+            random_state=derive_seed(random_state, OUTER_FOLDS)
+        )
+    for j, (train_index, test_index) in enumerate(outer_loop.split(X, y)):
+        sgclf = StackedGeneralizationClassifier(
+            base_clfs=[clone(clf) for clf in base_clfs], 
+            meta_clf=clone(meta_clf),
+            use_probas=True, 
+            verbose=False,
+            n_jobs=n_jobs,
+            random_state=derive_seed_sequence(random_state, HELD_OUT_FOLDS, j)
+        )
+        sgclf.hyper_parameters = hyper_parameters
+        with timed("held_out_fold", fold=j):
+            sgclf.fit(X=X.iloc[train_index], y=y.iloc[train_index])
+            (
+                y_probs[test_index], 
+                y_preds[test_index], 
+                y_prob_cut[test_index]
+            ) = predict_all(sgclf, X.iloc[test_index])
+    
+    return y_probs, y_preds, y_prob_cut
+
+
+BOOTSTRAP_MODES = ("search", "refit", "predictions")
+
+
+class BootstrapSamples(list):
+    """Estimates from each bootstrap sample, labelled with the mode.
+    
+    A list, as returned by bootstrap before the modes were added.
+    
+    Args:
+        stats: Estimates from each bootstrap sample.
+        mode: Bootstrap mode. See bootstrap.
+    """
+    def __init__(self, stats, mode: str):
+        super().__init__(stats)
+        self.mode = mode
+    
+    def __repr__(self):
+        return "BootstrapSamples(mode={m!r}, {s})".format(
+            m=self.mode, s=super().__repr__()
+        )
+
+
+def iter_bootstrap(X: pd.DataFrame, y: pd.Series, tc: pd.Series,
+                   keys: list, base_clfs: list, meta_clf: callable,
+                   all_hyper_parameters: list,
+                   N: int = 5, train_size: float = 0.8, 
+                   n_jobs: int = 2, inner_n_jobs: Optional[int] = None,
+                   mode: str = "search", random_state: Optional[Union[int, np.random.SeedSequence]] = None,
+                   executor: Optional[Executor] = None):
+    """Bootstraps statistics, yielding the estimates of each bootstrap sample.
+    
+    Same as bootstrap, but the estimates are yielded in the order of the
+    bootstrap samples, each once it and the samples before it are done,
+    so that the results do not depend on the timing of the parallel jobs.
+    Closing the generator cancels the remaining jobs.
+    
+    Yields:
+        Estimates from each bootstrap sample.
+    """
+    if mode not in BOOTSTRAP_MODES:
+        raise ValueError(
+            "mode should be one of {m}, got {g}".format(m=BOOTSTRAP_MODES, g=mode)
+        )
+    # Avoid oversubscribing the cores with nested parallelism
+    if inner_n_jobs is None:
+        inner_n_jobs = max(1, cpu_count() // effective_n_jobs(n_jobs))
+    
+    hyper_parameters = None
+    if mode != "search":
+        hyper_parameters = search_hyper_parameters(
+            X=X, y=y, base_clfs=base_clfs, meta_clf=meta_clf,
+            all_hyper_parameters=all_hyper_parameters, n_jobs=n_jobs,
+            random_state=random_state, executor=executor
+        )
+    if mode == "predictions":
+        yield from iter_prediction_bootstrap(
+            X=X, y=y, tc=tc, keys=keys, base_clfs=base_clfs,
+            meta_clf=meta_clf, hyper_parameters=hyper_parameters,
+            N=N, n_jobs=n_jobs, random_state=random_state
+        )
+        return
+    
+    # Numbef of samples in training samples
+    training_size = int(len(X.index) * train_size)
+    indices = bootstrap_indices(
+        y=y, n_samples=training_size, N=N, 
+        random_state=derive_seed_sequence(random_state, BOOTSTRAP_SAMPLES)
+    )
+    
+    # The workers memory-map the data, and only get the row positions
+    if executor is None: executor = JoblibExecutor(n_jobs)
+    data = SharedData(
+        X, y, tc, memmap=executor.memmap, temp_dir=executor.temp_dir
+    )
+    stats = executor(
+        timed_delayed(boot_compute_metrics)(
+            data, train_index, test_index, keys, base_clfs, meta_clf,
+            all_hyper_parameters, inner_n_jobs, hyper_parameters,
+            derive_seed_sequence(random_state, BOOTSTRAP_REPLICATES, r)
+        ) for r, (train_index, test_index) in enumerate(indices)
+    )
+    try:
+        yield from tqdm(collect_timed(stats), total=N)
+    finally:
+        stats.close()
+        data.close()
+
+
+def iter_prediction_bootstrap(X: pd.DataFrame, y: pd.Series, tc: pd.Series,
+                              keys: list, base_clfs: list, 
+                              meta_clf: callable, hyper_parameters: dict,
+                              N: int = 5, n_jobs: Optional[int] = None,
+                              random_state: Optional[Union[int, np.random.SeedSequence]] = None):
+    """Bootstraps statistics by resampling held-out predictions.
+    
+    The classifiers are fitted once per fold of compute_held_out_predictions,
+    and not per bootstrap sample. Each bootstrap sample resamples all rows
+    with replacement. The metrics of all samples are computed at once by
+    compute_performance_batch.
+    
+    Yields:
+        Estimates from each bootstrap sample.
+    """
+    y_probs, y_preds, y_prob_cut = compute_held_out_predictions(
+        X=X, y=y, base_clfs=base_clfs, meta_clf=meta_clf,
+        hyper_parameters=hyper_parameters, n_jobs=n_jobs,
+        random_state=derive_seed_sequence(random_state, BOOTSTRAP_REPLICATES)
+    )
+    indices = bootstrap_indices(
+        y=y, n_samples=len(y), N=N, 
+        random_state=derive_seed_sequence(random_state, BOOTSTRAP_SAMPLES)
     )
+    index = np.array([train_index for train_index, _ in indices])
+    with timed("compute_performance_batch"):
+        performance = compute_performance_batch(
+            y_probs={key: y_probs[index, k] for k, key in enumerate(keys)},
+            y_preds={key: y_preds[index, k] for k, key in enumerate(keys)},
+            y_true=np.asarray(y)[index],
+            y_pred_cuts={keys[-1]: y_prob_cut[index]},
+            tc=np.asarray(tc)[index]
+        )
+    yield from performance_to_dicts(performance)
 
 
 def bootstrap(X: pd.DataFrame, y: pd.Series, tc: pd.Series,
               keys: list, base_clfs: list, meta_clf: callable,
               all_hyper_parameters: list,
               N: int = 5, train_size: float = 0.8, 
-              n_jobs: int = 2):
+              n_jobs: int = 2, inner_n_jobs: Optional[int] = None,
+              mode: str = "search", random_state: Optional[Union[int, np.random.SeedSequence]] = None,
+              executor: Optional[Executor] = None):
     """Bootstraps statistics
     
     Parallelized computation of bootstrap performance estimates.
@@ -225,15 +828,185 @@ def bootstrap(X: pd.DataFrame, y: pd.Series, tc: pd.Series,
         N: Number of bootstrap samples.
         train_size: Proportion of samples in the training sample.
         n_jobs: Number of parallel processes.
+        inner_n_jobs: Optional. Number of parallel jobs in the search of
+            each bootstrap sample. If None, the cores left over by n_jobs
+            are shared between the bootstrap samples.
         keys: Classifier keys.
+        mode: Trades rigour for speed. 
+            - "search": The hyper parameters are searched in each bootstrap
+              sample. N full searches.
+            - "refit": The hyper parameters are searched once on all rows,
+              and the classifiers are refit to each bootstrap sample. 
+              Optimistic, as the search has seen the test rows.
+            - "predictions": The hyper parameters are searched once, the
+              classifiers are fitted in 5-fold cross-validation, and the 
+              held-out predictions are resampled. No refits per bootstrap
+              sample, and train_size is not used.
+        random_state: Optional. Seed or numpy SeedSequence. Independent
+            seeds for the bootstrap samples, and for the folds and
+            classifiers of each sample, are derived from it, so parallel
+            and serial runs give identical results.
+        executor: Optional. Runs the bootstrap samples, and the search in
+            the refit and predictions modes, instead of joblib.Parallel
+            with n_jobs. E.g. an SQLiteQueueExecutor, to share the samples
+            between processes on several machines. See 
+            src.models.executors.
         
     Returns:
-        List of estimates from each bootstrap sample.
+        List of estimates from each bootstrap sample, with the mode as
+        attribute.
     """
-    # Numbef of samples in training samples
-    training_size = int(len(X.index) * train_size)
-    # [boot_compute_metrics(X, y, tc, training_size, keys, base_clfs, meta_clf, all_hyper_parameters) for i in tqdm(range(N))]
-    return Parallel(n_jobs=n_jobs)(delayed(boot_compute_metrics)(X, y, tc, training_size, keys, base_clfs, meta_clf, all_hyper_parameters) for i in tqdm(range(N)))
+    return BootstrapSamples(iter_bootstrap(
+        X=X, y=y, tc=tc, keys=keys, base_clfs=base_clfs,
+        meta_clf=meta_clf, all_hyper_parameters=all_hyper_parameters,
+        N=N, train_size=train_size, n_jobs=n_jobs, 
+        inner_n_jobs=inner_n_jobs, mode=mode, random_state=random_state,
+        executor=executor
+    ), mode=mode)
+
+
+class RunningQuantile():
+    """Running estimate of a quantile, in constant memory.
+    
+    Uses the P-square algorithm, which tracks five markers whose heights
+    are adjusted with piecewise-parabolic interpolation as observations 
+    arrive. Exact for the first five observations.
+    Source:
+        Jain, R. and Chlamtac, I. (1985). The P2 algorithm for dynamic
+        calculation of quantiles and histograms without storing
+        observations. Communications of the ACM, 28(10), 1076-1085.
+    
+    NaNs, e.g. the AUC of ROC of a bootstrap sample with one class, are
+    skipped, and counted in n_nan.
+    
+    Args:
+        q: Quantile to estimate, between 0 and 1.
+    """
+    def __init__(self, q: float):
+        self.q = q
+        self.n = 0
+        self.n_nan = 0
+        self.heights = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2 * q, 1 + 4 * q, 3 + 2 * q, 5]
+        self.increments = [0, q / 2, q, (1 + q) / 2, 1]
+
+    def update(self, x: float) -> None:
+        """Adds an observation."""
+        if np.isnan(x):
+            self.n_nan += 1
+            return
+        self.n += 1
+        h = self.heights
+        if len(h) < 5:
+            h.append(x)
+            h.sort()
+            return
+        
+        # Find the cell of x, and extend the extremes if needed
+        if x < h[0]:
+            h[0] = x
+            k = 0
+        elif x >= h[4]:
+            h[4] = x
+            k = 3
+        else:
+            k = next(i for i in range(4) if h[i] <= x < h[i + 1])
+        for i in range(k + 1, 5):
+            self.positions[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+        
+        # Move the middle markers towards their desired positions
+        n = self.positions
+        for i in range(1, 4):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                hp = h[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (h[i + 1] - h[i]) / (n[i + 1] - n[i]) +
+                    (n[i + 1] - n[i] - d) * (h[i] - h[i - 1]) / (n[i] - n[i - 1])
+                )
+                if not h[i - 1] < hp < h[i + 1]:
+                    hp = h[i] + d * (h[i + d] - h[i]) / (n[i + d] - n[i])
+                h[i] = hp
+                n[i] += d
+
+    def value(self) -> float:
+        """Gives the current estimate of the quantile."""
+        if self.n == 0:
+            return np.nan
+        if self.n <= 5:
+            return np.quantile(self.heights, self.q)
+        
+        return self.heights[2]
+
+
+def streaming_bootstrap_ci(stats, point_estimates: dict,
+                           tol: Optional[float] = 0.005,
+                           patience: int = 20,
+                           min_replicates: int = 30) -> tuple:
+    """Computes confidence intervals while bootstrap samples arrive.
+    
+    Same intervals as compute_bootstrap_ci, but from running quantile
+    estimates, so the bootstrap samples are not kept. Stops early once
+    no interval width has changed by more than tol for patience samples
+    in a row. NaN estimates are skipped, see RunningQuantile, and an
+    interval without a finite width yet is never stable.
+    
+    Args:
+        stats: Iterable of estimates from each bootstrap sample, as from
+            iter_bootstrap. Closed if stopped early.
+        point_estimates: Point estimates from our sample, as dictionary
+            with metrics for each classifier.
+        tol: Optional. Greatest change in interval width that counts as
+            stable. If None, all bootstrap samples are used.
+        patience: Number of samples in a row the widths must be stable.
+        min_replicates: Least number of samples before stopping.
+        
+    Returns:
+        Tuple of data frame with lower and upper bound for each classifier
+        and metric, and the number of bootstrap samples used.
+    """
+    quantiles = {}
+    widths = {}
+    n_stable = 0
+    n = 0
+    for d in stats:
+        n += 1
+        changed = False
+        for key, metrics in d.items():
+            for metric, value in metrics.items():
+                if (key, metric) not in quantiles:
+                    quantiles[key, metric] = (
+                        RunningQuantile(0.1), RunningQuantile(0.9)
+                    )
+                lower, upper = quantiles[key, metric]
+                lower.update(value)
+                upper.update(value)
+                width = upper.value() - lower.value()
+                previous = widths.get((key, metric), np.inf)
+                changed = (
+                    changed or tol is None or not np.isfinite(width) or
+                    abs(width - previous) > tol
+                )
+                widths[key, metric] = width
+        n_stable = 0 if changed else n_stable + 1
+        if tol is not None and n >= min_replicates and n_stable >= patience:
+            if hasattr(stats, "close"): stats.close()
+            break
+
+    cis = {}
+    for (key, metric), (lower, upper) in quantiles.items():
+        point_estimate = point_estimates[key][metric]
+        # See compute_bootstrap_ci
+        lb = point_estimate - (upper.value() - point_estimate)
+        ub = point_estimate - (lower.value() - point_estimate)
+        cis[key, metric] = (lb, ub)
+    cis = pd.DataFrame.from_dict(cis, orient="index", columns=["lb", "ub"])
+    cis.index = pd.MultiIndex.from_tuples(cis.index)
+    
+    return cis, n
 
 
 def compute_bootstrap_ci(point_estimate, stats):
@@ -0,0 +1,341 @@
+import os
+import copy
+import json
+import shutil
+import logging
+import platform
+
+import joblib
+import numpy as np
+import pandas as pd
+import sklearn
+
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+from sklearn.base import clone
+from sklearn.exceptions import NotFittedError
+from sklearn.utils.validation import check_is_fitted
+from sklearn.pipeline import Pipeline
+from sklearn.tree import DecisionTreeClassifier
+from sklearn.ensemble import (
+    RandomForestClassifier,
+    HistGradientBoostingClassifier
+)
+
+from src.models.compiled import CompiledTrees, compile_estimator
+
+
+logger = logging.getLogger(__name__)
+
+# Version of the layout of saved models, increased when it changes
+FORMAT_VERSION = 2
+# Versions this version can load
+FORMAT_VERSIONS = (2, )
+MODEL_FILE = "model.joblib"
+METADATA_FILE = "metadata.json"
+# Directories of the node arrays of trees, and of LightGBM boosters
+ARRAYS_DIR = "arrays"
+BOOSTERS_DIR = "boosters"
+# Trees saved as flat node arrays, see CompiledTrees
+TREE_CLASSIFIERS = (
+    DecisionTreeClassifier,
+    RandomForestClassifier,
+    HistGradientBoostingClassifier
+)
+
+
+def library_versions() -> dict:
+    """Gives the versions of the libraries the classifiers are pickled with."""
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "sklearn": sklearn.__version__,
+        "joblib": joblib.__version__
+    }
+
+
+def map_estimators(sgclf, func: Callable) -> object:
+    """Replaces the fitted classifiers of a StackedGeneralizationClassifier.
+
+    Args:
+        sgclf: Fitted StackedGeneralizationClassifier.
+        func: Called with each fitted classifier, or final estimator of a
+            Pipeline, and a key unique within sgclf, e.g. "base_clfs_.0"
+            or "fold_clfs_.0.2". Gives the classifier to replace it with.
+
+    Returns:
+        Shallow copy of sgclf, with the classifiers replaced. Pipelines
+        with a replaced final estimator are shallow copies too.
+    """
+    def replace(clf, key):
+        if isinstance(clf, Pipeline):
+            name, estimator = clf.steps[-1]
+            replaced = func(estimator, key)
+            if replaced is estimator: return clf
+            clf = copy.copy(clf)
+            clf.steps = clf.steps[:-1] + [(name, replaced)]
+            return clf
+        return func(clf, key)
+
+    sgclf = copy.copy(sgclf)
+    sgclf.base_clfs_ = [
+        replace(clf, "base_clfs_.{k}".format(k=k))
+        for k, clf in enumerate(sgclf.base_clfs_)
+    ]
+    sgclf.meta_clf_ = replace(sgclf.meta_clf_, "meta_clf_")
+    if sgclf.fold_clfs_ is not None:
+        sgclf.fold_clfs_ = [
+            [
+                replace(clf, "fold_clfs_.{k}.{i}".format(k=k, i=i))
+                for i, clf in enumerate(fold_clfs)
+            ]
+            for k, fold_clfs in enumerate(sgclf.fold_clfs_)
+        ]
+
+    return sgclf
+
+
+def export_booster(clf, key: str, path: str, boosters: dict) -> object:
+    """Saves the booster of a LGBMClassifier as a LightGBM model file.
+
+    Args:
+        clf: Fitted LGBMClassifier.
+        key: Key of the classifier. See map_estimators.
+        path: Directory of the artifact.
+        boosters: Paths of the model files, by key. Updated in place.
+
+    Returns:
+        Shallow copy of clf without the booster.
+    """
+    boosters[key] = os.path.join(BOOSTERS_DIR, key + ".txt")
+    clf.booster_.save_model(os.path.join(path, boosters[key]))
+    clf = copy.copy(clf)
+    clf._Booster = None
+
+    return clf
+
+
+def export_trees(clf, key: str, path: str) -> object:
+    """Saves the node arrays of trees as .npy files.
+
+    Args:
+        clf: Fitted tree classifier. See TREE_CLASSIFIERS.
+        key: Key of the classifier. See map_estimators.
+        path: Directory of the artifact.
+
+    Returns:
+        CompiledTrees with the paths of the arrays instead of the arrays,
+        loaded from the files by load_model, or clf if it cannot be
+        compiled.
+    """
+    try:
+        trees = compile_estimator(clf)
+    except ValueError as e:
+        logger.warning("Pickling %s as is: %s", key, e)
+        return clf
+    arrays = {}
+    for field, array in trees.arrays.items():
+        arrays[field] = os.path.join(
+            ARRAYS_DIR, "{k}.{f}.npy".format(k=key, f=field)
+        )
+        np.save(os.path.join(path, arrays[field]), array)
+    trees.arrays = arrays
+
+    return trees
+
+
+def export_estimator(clf, key: str, path: str, boosters: dict) -> object:
+    """Saves the parts of a classifier not pickled with the model.
+
+    Args:
+        clf: Classifier.
+        key: Key of the classifier. See map_estimators.
+        path: Directory of the artifact.
+        boosters: Paths of the LightGBM model files. Updated in place.
+
+    Returns:
+        The classifier to pickle. See export_booster and export_trees.
+    """
+    try:
+        check_is_fitted(clf)
+    except (NotFittedError, TypeError):
+        # E.g. the base classifiers, if cross fitted
+        return clf
+    if type(clf).__name__ == "LGBMClassifier":
+        return export_booster(clf, key, path, boosters)
+    if isinstance(clf, TREE_CLASSIFIERS):
+        return export_trees(clf, key, path)
+
+    return clf
+
+
+def model_metadata(sgclf, boosters: dict) -> dict:
+    """Gives the metadata of a saved model. See save_model."""
+    roc_aucs = sgclf.roc_aucs
+    metadata = {
+        "format_version": FORMAT_VERSION,
+        "created": datetime.now(timezone.utc).isoformat(),
+        "versions": library_versions(),
+        "class": sgclf.__class__.__name__,
+        "base_clfs": [clf.__class__.__name__ for clf in sgclf.base_clfs_],
+        "meta_clf": sgclf.meta_clf_.__class__.__name__,
+        "use_probas": sgclf.use_probas,
+        "cross_fit": sgclf.cross_fit,
+        "feature_names": getattr(sgclf, "feature_names_", None),
+        "boosters": boosters,
+        "hyper_parameters": {
+            k: list(v) if isinstance(v, tuple) else v
+            for k, v in (sgclf.hyper_parameters or {}).items()
+        },
+        "roc_auc": (
+            None if roc_aucs is None
+            else float(roc_aucs.mean(axis=1).max())
+        )
+    }
+
+    return metadata
+
+
+def save_model(sgclf, path: str, overwrite: bool = False) -> str:
+    """Saves a fitted StackedGeneralizationClassifier as a versioned artifact.
+
+    The artifact is a directory with the classifier, pickled with joblib
+    without compression, so its arrays can be memory-mapped on load, and
+    a metadata.json with the format version, library versions, classifiers,
+    hyper parameters and mean AUC of ROC. The metadata is written last, so
+    a directory with metadata holds a complete model.
+
+    Scikit-learn copies the nodes of pickled trees on load, so decision
+    trees, random forests and histogram gradient boosting are saved as
+    CompiledTrees, with their node arrays in .npy files of their own.
+    LightGBM boosters are saved as LightGBM model files.
+
+    Args:
+        sgclf: Fitted StackedGeneralizationClassifier.
+        path: Directory of the artifact, e.g. models/sgclf. Created if
+            missing.
+        overwrite: If True, replaces an artifact already at path.
+
+    Returns:
+        The path.
+
+    Raises:
+        FileExistsError: If there is an artifact at path, and not
+            overwrite.
+    """
+    metadata_path = os.path.join(path, METADATA_FILE)
+    if os.path.exists(metadata_path) and not overwrite:
+        raise FileExistsError(
+            "There is already a model at {p}".format(p=path)
+        )
+    os.makedirs(path, exist_ok=True)
+    # Mark an artifact being replaced as incomplete
+    if os.path.exists(metadata_path): os.remove(metadata_path)
+    for directory in (ARRAYS_DIR, BOOSTERS_DIR):
+        shutil.rmtree(os.path.join(path, directory), ignore_errors=True)
+        os.makedirs(os.path.join(path, directory))
+
+    boosters = {}
+    stripped = map_estimators(
+        sgclf, lambda clf, key: export_estimator(clf, key, path, boosters)
+    )
+    # Unfitted, as the fitted classifiers are saved apart
+    stripped.base_clfs = [clone(clf) for clf in sgclf.base_clfs]
+    stripped.meta_clf = clone(sgclf.meta_clf)
+
+    # Write to temporary files, and move them in place when complete
+    tmp = os.path.join(path, MODEL_FILE + ".tmp")
+    try:
+        joblib.dump(stripped, tmp)
+        os.replace(tmp, os.path.join(path, MODEL_FILE))
+    finally:
+        if os.path.exists(tmp): os.remove(tmp)
+
+    tmp = metadata_path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(model_metadata(sgclf, boosters), f, indent=2, default=str)
+    os.replace(tmp, metadata_path)
+
+    return path
+
+
+def read_metadata(path: str) -> dict:
+    """Reads the metadata of a saved model.
+
+    Args:
+        path: Directory of the artifact.
+
+    Returns:
+        The metadata. See save_model.
+
+    Raises:
+        FileNotFoundError: If there is no complete artifact at path.
+        ValueError: If the artifact has a format this version cannot load.
+    """
+    with open(os.path.join(path, METADATA_FILE)) as f:
+        metadata = json.load(f)
+    if metadata.get("format_version") not in FORMAT_VERSIONS:
+        raise ValueError(
+            "Cannot load format version {v} of {p}, only {s}".format(
+                v=metadata.get("format_version"), p=path,
+                s=", ".join(str(v) for v in FORMAT_VERSIONS)
+            )
+        )
+
+    return metadata
+
+
+def load_model(path: str, mmap_mode: Optional[str] = "r"):
+    """Loads a StackedGeneralizationClassifier saved with save_model.
+
+    With mmap_mode, the arrays of the classifiers, e.g. coefficients and
+    the nodes of trees, are memory-mapped from the files instead of read,
+    so loading is fast and processes loading the same model share the
+    pages. Trees are loaded as CompiledTrees, which predict from the
+    memory-mapped nodes. LightGBM boosters are read from their model files.
+
+    Args:
+        path: Directory of the artifact.
+        mmap_mode: Optional. Mode of the memory-mapped arrays, "r" for
+            read-only. If None, the arrays are read into memory.
+
+    Returns:
+        The fitted StackedGeneralizationClassifier.
+
+    Raises:
+        FileNotFoundError: If there is no complete artifact at path.
+        ValueError: If the artifact has a format this version cannot load.
+    """
+    metadata = read_metadata(path)
+    versions = library_versions()
+    for library in ("sklearn", "numpy"):
+        saved = metadata["versions"].get(library)
+        if saved != versions[library]:
+            logger.warning(
+                "%s was saved with %s %s, loading with %s",
+                path, library, saved, versions[library]
+            )
+
+    sgclf = joblib.load(os.path.join(path, MODEL_FILE), mmap_mode=mmap_mode)
+    boosters = metadata.get("boosters", {})
+    if boosters:
+        import lightgbm
+
+    def attach(clf, key):
+        if key in boosters:
+            clf._Booster = lightgbm.Booster(
+                model_file=os.path.join(path, boosters[key])
+            )
+        elif isinstance(clf, CompiledTrees):
+            clf.arrays = {
+                field: np.load(os.path.join(path, file), mmap_mode=mmap_mode)
+                for field, file in clf.arrays.items()
+            }
+        return clf
+
+    # The classifiers are updated in place, so the copy is not needed
+    map_estimators(sgclf, attach)
+
+    return sgclf
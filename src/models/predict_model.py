@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import asyncio
+import logging
+
+import click
+import joblib
+import pandas as pd
+
+from src.data.synthetic import make_trauma_data
+from src.models.persistence import load_model
+from src.models.serving import PredictionService, load_test
+
+
+@click.group()
+def main():
+    """ Serves a fitted StackedGeneralizationClassifier on localhost, and
+        load tests the service.
+    """
+
+
+@main.command()
+@click.argument("model_path", type=click.Path(exists=True))
+@click.option("--host", default="127.0.0.1")
+@click.option("--port", default=8000)
+@click.option("--window", default=0.005,
+              help="Seconds to gather concurrent requests into one batch.")
+@click.option("--max-batch", default=256,
+              help="Rows at which a batch is predicted without waiting.")
+def serve(model_path, host, port, window, max_batch):
+    """ Serves the classifier saved at MODEL_PATH, with save or joblib.
+        POST rows as JSON to /predict, and GET /metrics for throughput and
+        latency.
+    """
+    logger = logging.getLogger(__name__)
+    logger.info("loading %s", model_path)
+    if os.path.isdir(model_path):
+        sgclf = load_model(model_path)
+    else:
+        sgclf = joblib.load(model_path)
+    service = PredictionService(sgclf, window=window, max_batch=max_batch)
+    try:
+        asyncio.run(service.serve(host, port))
+    except KeyboardInterrupt:
+        pass
+
+
+@main.command("load-test")
+@click.option("--host", default="127.0.0.1")
+@click.option("--port", default=8000)
+@click.option("--requests", "-n", default=1000)
+@click.option("--concurrency", "-c", default=32)
+@click.option("--batch", default=1, help="Rows per request.")
+@click.option("--data", type=click.Path(exists=True), default=None,
+              help="CSV of rows to send. Synthetic trauma data by default.")
+def load_test_command(host, port, requests, concurrency, batch, data):
+    """ Sends concurrent requests to a running service, and prints the
+        throughput and latencies as JSON.
+    """
+    if data is None:
+        X, _, _ = make_trauma_data(1000, random_state=0)
+    else:
+        X = pd.read_csv(data, nrows=10000)
+    rows = json.loads(X.to_json(orient="records"))
+    result = asyncio.run(load_test(
+        rows, host=host, port=port, requests=requests,
+        concurrency=concurrency, batch=batch
+    ))
+    click.echo(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
@@ -0,0 +1,153 @@
+import numpy as np
+
+from typing import Optional, Union
+
+
+def stratified_resample_index(y: np.ndarray, n_samples: int,
+                              rng: np.random.Generator) -> np.ndarray:
+    """Draws row positions with replacement, stratified by class.
+
+    Each class gets its share of n_samples, as in sklearn's resample with
+    stratify. Rounding remainders go to the classes with the greatest
+    fractional shares.
+
+    Args:
+        y: Targets.
+        n_samples: Number of rows to draw.
+        rng: Random number generator.
+
+    Returns:
+        Positions of the drawn rows, in random order.
+    """
+    classes, y_encoded = np.unique(np.asarray(y), return_inverse=True)
+    class_positions = [np.flatnonzero(y_encoded == c) for c in range(len(classes))]
+    shares = np.array([len(p) for p in class_positions]) / len(y_encoded) * n_samples
+    counts = np.floor(shares).astype(int)
+    remainder = n_samples - counts.sum()
+    counts[np.argsort(counts - shares, kind="stable")[:remainder]] += 1
+
+    index = np.concatenate([
+        rng.choice(positions, size=count, replace=True)
+        for positions, count in zip(class_positions, counts)
+    ])
+
+    return rng.permutation(index)
+
+
+def out_of_bag_index(train_index: np.ndarray, n: int) -> np.ndarray:
+    """Gives the positions of the rows that were not drawn.
+
+    Args:
+        train_index: Positions of the drawn rows. May repeat.
+        n: Number of rows.
+
+    Returns:
+        Positions of the rows not in train_index, in order.
+    """
+    out_of_bag = np.ones(n, dtype=bool)
+    out_of_bag[train_index] = False
+
+    return np.flatnonzero(out_of_bag)
+
+
+def bootstrap_indices(y: np.ndarray, n_samples: int, N: int,
+                      random_state: Optional[Union[int, np.random.Generator]] = None
+                      ) -> list:
+    """Draws the row positions of all bootstrap samples up front.
+
+    Args:
+        y: Targets.
+        n_samples: Number of rows in each bootstrap sample.
+        N: Number of bootstrap samples.
+        random_state: Optional. Seed or random number generator.
+
+    Returns:
+        List of tuples with the positions of the bootstrap rows and the
+        out-of-bag rows, one per bootstrap sample.
+    """
+    rng = np.random.default_rng(random_state)
+    n = len(y)
+    indices = []
+    for _ in range(N):
+        train_index = stratified_resample_index(y, n_samples, rng)
+        indices.append((train_index, out_of_bag_index(train_index, n)))
+
+    return indices
+
+
+# Keys of the independent random streams derived from one seed
+OUTER_FOLDS = 0
+INNER_FOLDS = 1
+BASE_CLASSIFIERS = 2
+META_CLASSIFIER = 3
+BOOTSTRAP_SAMPLES = 4
+BOOTSTRAP_REPLICATES = 5
+HELD_OUT_FOLDS = 6
+
+
+def derive_seed(random_state: Union[int, np.random.SeedSequence],
+                *key: int) -> int:
+    """Derives an independent seed for one part of the pipeline.
+
+    The seed depends only on random_state and key, and not on how many
+    seeds were derived before, so the same part gets the same seed in
+    serial and parallel runs.
+
+    Args:
+        random_state: Seed or SeedSequence of the whole run.
+        key: Integers naming the part. E.g. (BASE_CLASSIFIERS, 0).
+
+    Returns:
+        Seed, as an integer accepted by numpy and scikit-learn.
+    """
+    seed_sequence = derive_seed_sequence(random_state, *key)
+
+    return int(seed_sequence.generate_state(1)[0])
+
+
+def set_random_states(estimator, random_state: Union[int, np.random.SeedSequence],
+                      *key: int) -> object:
+    """Seeds every random_state parameter of an estimator.
+
+    Includes nested estimators, e.g. the steps of a Pipeline. Each
+    parameter gets its own seed.
+
+    Args:
+        estimator: Scikit-learn compatible estimator.
+        random_state: Seed or SeedSequence of the whole run.
+        key: Integers naming the estimator.
+
+    Returns:
+        The estimator.
+    """
+    params = sorted(
+        p for p in estimator.get_params(deep=True)
+        if p == "random_state" or p.endswith("__random_state")
+    )
+    estimator.set_params(**{
+        p: derive_seed(random_state, *key, i) for i, p in enumerate(params)
+    })
+
+    return estimator
+
+
+def derive_seed_sequence(random_state: Optional[Union[int, np.random.SeedSequence]],
+                         *key: int) -> Optional[np.random.SeedSequence]:
+    """Derives an independent SeedSequence, e.g. for one bootstrap sample.
+
+    Args:
+        random_state: Optional. Seed or SeedSequence of the whole run.
+        key: Integers naming the part.
+
+    Returns:
+        The SeedSequence, or None if random_state is None.
+    """
+    if random_state is None:
+        return None
+    if isinstance(random_state, np.random.SeedSequence):
+        return np.random.SeedSequence(
+            random_state.entropy,
+            spawn_key=tuple(random_state.spawn_key) + key
+        )
+
+    return np.random.SeedSequence(random_state, spawn_key=key)
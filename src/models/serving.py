@@ -0,0 +1,491 @@
+import json
+import time
+import asyncio
+import logging
+
+import numpy as np
+import pandas as pd
+
+from typing import Callable, Optional
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+logger = logging.getLogger(__name__)
+
+# Reason phrases of the status codes the service gives
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error"
+}
+
+
+class ServiceMetrics():
+    """Counts the requests, rows and batches of the service.
+
+    Args:
+        window: Number of most recent requests and batches the latency
+            and batch size statistics are computed from.
+    """
+    def __init__(self, window: int = 10000):
+        self.start = time.time()
+        self.requests = 0
+        self.rows = 0
+        self.errors = 0
+        self.batches = 0
+        self.latencies = deque(maxlen=window)
+        self.batch_sizes = deque(maxlen=window)
+        self.batch_seconds = deque(maxlen=window)
+
+    def add_request(self, rows: int, seconds: float, error: bool = False):
+        self.requests += 1
+        self.rows += rows
+        self.errors += error
+        self.latencies.append(seconds)
+
+    def add_batch(self, rows: int, seconds: float):
+        self.batches += 1
+        self.batch_sizes.append(rows)
+        self.batch_seconds.append(seconds)
+
+    def to_dict(self) -> dict:
+        """Gives the counts, throughput, and latencies in milliseconds."""
+        uptime = time.time() - self.start
+        metrics = {
+            "uptime": uptime,
+            "requests": self.requests,
+            "rows": self.rows,
+            "errors": self.errors,
+            "batches": self.batches,
+            "requests_per_second": self.requests / uptime,
+            "rows_per_second": self.rows / uptime,
+            "mean_batch_rows": (
+                float(np.mean(self.batch_sizes)) if self.batch_sizes else None
+            ),
+            "mean_batch_ms": (
+                1000 * float(np.mean(self.batch_seconds))
+                if self.batch_seconds else None
+            )
+        }
+        latencies = 1000 * np.asarray(self.latencies)
+        for q in (50, 95, 99):
+            metrics["latency_p{q}_ms".format(q=q)] = (
+                float(np.percentile(latencies, q)) if len(latencies) else None
+            )
+
+        return metrics
+
+
+class MicroBatcher():
+    """Gathers the rows of concurrent requests into one prediction.
+
+    Rows are predicted when window seconds have passed since the first
+    pending row, or when max_batch rows are pending. Predictions run one
+    batch at a time in a thread, so the event loop keeps accepting rows
+    meanwhile, which then form the next batch.
+
+    Args:
+        predict: Function from a list of rows, each a list of features, to
+            a tuple of the predicted probabilities and binned predictions.
+        window: Seconds to wait for more rows.
+        max_batch: Rows at which a batch is predicted without waiting.
+        metrics: Optional. Where to count the batches.
+    """
+    def __init__(self, predict: Callable, window: float = 0.005,
+                 max_batch: int = 256,
+                 metrics: Optional[ServiceMetrics] = None):
+        self.predict = predict
+        self.window = window
+        self.max_batch = max_batch
+        self.metrics = metrics
+
+        self._pending = []
+        self._n = 0
+        self._timer = None
+        self._tasks = set()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    async def submit(self, rows: list) -> list:
+        """Predicts rows with the next batch.
+
+        Args:
+            rows: Rows, each a list of features.
+
+        Returns:
+            List of the predicted probability of 1s and the binned
+            prediction of each row.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((rows, future))
+        self._n += len(rows)
+        if self._n >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending, self._n = self._pending, [], 0
+        if batch:
+            # The loop keeps only weak references to its tasks
+            task = asyncio.get_running_loop().create_task(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: list):
+        rows = [row for rows, _ in batch for row in rows]
+        start = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            y_prob, y_prob_cut = await loop.run_in_executor(
+                self._executor, self.predict, rows
+            )
+        except Exception as e:
+            if len(batch) == 1:
+                logger.warning("batch of %d rows failed: %s", len(rows), e)
+                _, future = batch[0]
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                # Predict the requests one by one, so a bad request only
+                # fails itself
+                for request in batch:
+                    await self._run([request])
+            return
+        if self.metrics is not None:
+            self.metrics.add_batch(len(rows), time.perf_counter() - start)
+
+        i = 0
+        for rows, future in batch:
+            if not future.done():
+                future.set_result(list(zip(
+                    y_prob[i:i + len(rows)], y_prob_cut[i:i + len(rows)]
+                )))
+            i += len(rows)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+def make_predict(sgclf, feature_names: list) -> Callable:
+    """Gives a function that predicts rows with a fitted classifier.
+
+    Args:
+        sgclf: Fitted StackedGeneralizationClassifier.
+        feature_names: Names of the features, in the order of the rows.
+
+    Returns:
+        Function from a list of rows, each a list of features, to a tuple
+        of the predicted probabilities and binned predictions.
+    """
+    def predict(rows: list) -> tuple:
+        X = pd.DataFrame(rows, columns=feature_names, dtype=float)
+        return sgclf.predict(X)
+
+    return predict
+
+
+def parse_rows(body: bytes, feature_names: list) -> tuple:
+    """Parses the rows of a request.
+
+    Args:
+        body: JSON object mapping feature names to values, or a list of
+            such objects. Missing features and nulls are missing values.
+        feature_names: Names of the features, in the order of the rows.
+
+    Returns:
+        Tuple of the rows, each a list of features, and whether the body
+        was a single object.
+
+    Raises:
+        ValueError: If the body is not such JSON, or a value not a number
+            or null.
+    """
+    data = json.loads(body)
+    single = isinstance(data, dict)
+    records = [data] if single else data
+    if not isinstance(records, list) or not all(
+            isinstance(r, dict) for r in records):
+        raise ValueError("Expected an object or a list of objects")
+    rows = []
+    for record in records:
+        row = []
+        for f in feature_names:
+            row.append(parse_value(record.get(f), f))
+        rows.append(row)
+
+    return rows, single
+
+
+def parse_value(value, name: str) -> float:
+    """Parses the value of a feature, a number or null.
+
+    Raises:
+        ValueError: If the value is not a finite number or null.
+    """
+    if value is None:
+        return np.nan
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(
+            "Expected a number or null for {f}, got {v}".format(
+                f=name, v=json.dumps(value)
+            )
+        )
+    try:
+        value = float(value)
+    except OverflowError:
+        value = np.inf
+    if not np.isfinite(value):
+        raise ValueError("Expected a finite number for {f}".format(f=name))
+
+    return value
+
+
+class PredictionService():
+    """Serves predictions of a fitted classifier over HTTP on asyncio.
+
+    Endpoints:
+        POST /predict: Rows as JSON, see parse_rows. Responds with the
+            predicted probability of 1s, y_prob_con, and the triage
+            category, y_prob_cut, of each row. The probability is null if
+            not a number, and the category if outside the breaks.
+        GET /metrics: ServiceMetrics, as JSON.
+        GET /health: {"status": "ok"}.
+
+    Args:
+        sgclf: Fitted StackedGeneralizationClassifier.
+        feature_names: Optional. Names of the features. If None, the
+            features the classifier was fitted to.
+        window: Seconds to wait for more rows. See MicroBatcher.
+        max_batch: Rows at which a batch is predicted without waiting.
+        max_body: Greatest request body, in bytes.
+
+    Raises:
+        ValueError: If there are no feature names.
+    """
+    def __init__(self, sgclf, feature_names: Optional[list] = None,
+                 window: float = 0.005, max_batch: int = 256,
+                 max_body: int = 2 ** 20):
+        if feature_names is None:
+            feature_names = getattr(sgclf, "feature_names_", None)
+        if feature_names is None:
+            raise ValueError(
+                "No feature names, the classifier was not fitted to a data "
+                "frame"
+            )
+        self.feature_names = list(feature_names)
+        self.max_body = max_body
+        self.metrics = ServiceMetrics()
+        self.batcher = MicroBatcher(
+            make_predict(sgclf, self.feature_names), window=window,
+            max_batch=max_batch, metrics=self.metrics
+        )
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8000):
+        """Serves until cancelled."""
+        server = await asyncio.start_server(self.handle, host, port)
+        logger.info("serving on http://%s:%d", host, port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.batcher.close()
+
+    async def handle(self, reader: asyncio.StreamReader,
+                     writer: asyncio.StreamWriter):
+        """Handles the requests of a connection, kept alive until closed."""
+        try:
+            while True:
+                request = await read_request(reader, self.max_body)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                start = time.perf_counter()
+                status, response = await self.respond(method, path, body)
+                write_response(writer, status, response)
+                await writer.drain()
+                if path == "/predict":
+                    self.metrics.add_request(
+                        len(response) if isinstance(response, list) else 1,
+                        time.perf_counter() - start, error=status != 200
+                    )
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except ValueError as e:
+            write_response(writer, 413 if "large" in str(e) else 400,
+                           {"error": str(e)})
+        finally:
+            writer.close()
+
+    async def respond(self, method: str, path: str, body: bytes) -> tuple:
+        """Gives the status and JSON response to a request."""
+        if path == "/health":
+            return 200, {"status": "ok"}
+        if path == "/metrics":
+            return 200, self.metrics.to_dict()
+        if path != "/predict":
+            return 404, {"error": "Not found"}
+        if method != "POST":
+            return 405, {"error": "Use POST"}
+        try:
+            rows, single = parse_rows(body, self.feature_names)
+        except ValueError as e:
+            return 400, {"error": str(e)}
+        try:
+            predictions = await self.batcher.submit(rows)
+        except Exception as e:
+            return 500, {"error": str(e)}
+        # NaNs are not JSON, so they become nulls
+        response = [
+            {
+                "y_prob_con": None if np.isnan(y_prob) else float(y_prob),
+                "y_prob_cut": None if np.isnan(y_prob_cut) else int(y_prob_cut)
+            }
+            for y_prob, y_prob_cut in predictions
+        ]
+
+        return 200, response[0] if single else response
+
+
+async def read_request(reader: asyncio.StreamReader,
+                       max_body: int) -> Optional[tuple]:
+    """Reads an HTTP/1.1 request.
+
+    Returns:
+        Tuple of the method, path, lowercase headers and body, or None if
+        the connection was closed.
+
+    Raises:
+        ValueError: If the request is malformed or its body too large.
+    """
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, path, _ = line.decode("latin-1").split(" ", 2)
+    except ValueError:
+        raise ValueError("Malformed request line")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0))
+    if length > max_body:
+        raise ValueError("Request body too large")
+    body = await reader.readexactly(length) if length else b""
+
+    return method, path.split("?", 1)[0], headers, body
+
+
+def write_response(writer: asyncio.StreamWriter, status: int,
+                   response) -> None:
+    body = json.dumps(response, allow_nan=False).encode()
+    writer.write(
+        "HTTP/1.1 {s} {r}\r\nContent-Type: application/json\r\n"
+        "Content-Length: {n}\r\n\r\n".format(
+            s=status, r=REASONS[status], n=len(body)
+        ).encode() + body
+    )
+
+
+async def load_test(rows: list, host: str = "127.0.0.1", port: int = 8000,
+                    requests: int = 1000, concurrency: int = 32,
+                    batch: int = 1) -> dict:
+    """Sends requests to a PredictionService, over kept-alive connections.
+
+    Args:
+        rows: Rows to send, as objects mapping feature names to values.
+            Cycled through.
+        host: Host of the service.
+        port: Port of the service.
+        requests: Number of requests.
+        concurrency: Number of connections sending requests at once.
+        batch: Rows per request.
+
+    Returns:
+        Dictionary with the throughput, latency percentiles in
+        milliseconds, errors, and the metrics of the service.
+    """
+    latencies = []
+    errors = 0
+    counter = iter(range(requests))
+
+    async def client():
+        nonlocal errors
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            for i in counter:
+                records = [
+                    rows[(i * batch + k) % len(rows)] for k in range(batch)
+                ]
+                body = json.dumps(
+                    records[0] if batch == 1 else records
+                ).encode()
+                start = time.perf_counter()
+                writer.write(
+                    "POST /predict HTTP/1.1\r\nHost: {h}\r\n"
+                    "Content-Type: application/json\r\n"
+                    "Content-Length: {n}\r\n\r\n".format(
+                        h=host, n=len(body)
+                    ).encode() + body
+                )
+                await writer.drain()
+                status, _ = await read_response(reader)
+                latencies.append(time.perf_counter() - start)
+                errors += status != 200
+        finally:
+            writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    seconds = time.perf_counter() - start
+
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(b"GET /metrics HTTP/1.1\r\nConnection: close\r\n\r\n")
+    await writer.drain()
+    _, metrics = await read_response(reader)
+    writer.close()
+
+    latencies = 1000 * np.asarray(latencies)
+    return {
+        "requests": requests,
+        "rows": requests * batch,
+        "errors": errors,
+        "seconds": seconds,
+        "requests_per_second": requests / seconds,
+        "rows_per_second": requests * batch / seconds,
+        **{
+            "latency_p{q}_ms".format(q=q): float(np.percentile(latencies, q))
+            for q in (50, 95, 99)
+        },
+        "service": metrics
+    }
+
+
+async def read_response(reader: asyncio.StreamReader) -> tuple:
+    """Reads an HTTP response of a PredictionService."""
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value)
+
+    return status, json.loads(await reader.readexactly(length))
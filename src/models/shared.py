@@ -0,0 +1,182 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from typing import Optional
+from joblib import effective_n_jobs
+
+
+def needs_memmap(n_jobs: Optional[int], backend: Optional[str]) -> bool:
+    """Tells whether parallel jobs run in other processes.
+
+    Args:
+        n_jobs: Number of parallel jobs, as for joblib.Parallel.
+        backend: Parallelization backend, as for joblib.Parallel.
+
+    Returns:
+        True, if the data should be memory-mapped for the jobs.
+    """
+    return (
+        effective_n_jobs(n_jobs) > 1 and
+        backend not in ("threading", "sequential")
+    )
+
+
+def matrix_dtype(X: pd.DataFrame) -> np.dtype:
+    """Gives the smallest float type that holds all features exactly.
+
+    Args:
+        X: Features.
+
+    Returns:
+        float32 if all features are float32 or integers of at most 16
+        bits, else float64.
+    """
+    try:
+        dtype = np.result_type(*X.dtypes, np.float32)
+    except TypeError:
+        return np.dtype(float)
+
+    return dtype if dtype == np.float32 else np.dtype(float)
+
+
+def is_numeric(X: pd.DataFrame) -> bool:
+    """Tells whether all features are numbers, e.g. not strings."""
+    return all(
+        pd.api.types.is_numeric_dtype(dtype) for dtype in X.dtypes
+    )
+
+
+class SharedData():
+    """Features and targets that are cheap to send to parallel workers.
+
+    If memmap, and all features are numbers, the features are converted
+    once to a contiguous float array and saved to a file, which the
+    workers memory-map instead of receiving a copy.
+    Pickling a SharedData only sends the file paths and column names, so
+    a job only needs the positions of its rows. The pages of the file are
+    shared by all workers on a machine.
+
+    The array is float32 if the features fit, e.g. compact features from
+    compact_features in src.data.transform, which halves the memory of
+    each worker and saves tree models a conversion per fit. Otherwise it
+    is float64.
+
+    Otherwise, e.g. when running serially, or with strings for a
+    OneHotEncoder, the features are kept as is, and the rows taken have
+    the dtypes of X. The float array holds the features exactly, so serial
+    and parallel fits give identical results.
+
+    Args:
+        X: Features.
+        y: Optional. Targets.
+        tc: Optional. Clinician priorities.
+        memmap: If True, the data is memory-mapped, if all features are
+            numbers. Else, the data is sent to the workers.
+        directory: Optional. Directory of the files. If None, a temporary
+            directory is created, and removed by close.
+        temp_dir: Optional. Where to create the temporary directory, e.g.
+            on a file system shared with workers on other machines. If
+            None, the system default.
+    """
+    def __init__(self, X: pd.DataFrame, y: Optional[pd.Series] = None,
+                 tc: Optional[pd.Series] = None, memmap: bool = True,
+                 directory: Optional[str] = None,
+                 temp_dir: Optional[str] = None):
+        self.memmap = memmap and is_numeric(X)
+        self.columns = list(X.columns)
+        self.names = {
+            "y": None if y is None else y.name,
+            "tc": None if tc is None else tc.name
+        }
+        values = {
+            "y": None if y is None else np.asarray(y),
+            "tc": None if tc is None else np.asarray(tc)
+        }
+        values = {k: v for k, v in values.items() if v is not None}
+
+        self.paths = {}
+        self.directory = None
+        if not self.memmap:
+            self._frame = X.reset_index(drop=True)
+            self._arrays = values
+            return
+
+        self._frame = None
+        values["X"] = np.ascontiguousarray(X.to_numpy(dtype=matrix_dtype(X)))
+
+        self._arrays = {}
+        self._remove = directory is None
+        self.directory = (
+            tempfile.mkdtemp(prefix="pemett-", dir=temp_dir) if directory is None
+            else directory
+        )
+        for name, array in values.items():
+            path = os.path.join(self.directory, name + ".npy")
+            np.save(path, array, allow_pickle=False)
+            self.paths[name] = path
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self.memmap:
+            state["_arrays"] = {}
+        return state
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        if self._frame is not None:
+            return len(self._frame)
+        return self._array("X").shape[0]
+
+    def _array(self, name: str) -> Optional[np.ndarray]:
+        """Memory-maps an array, once per process."""
+        if name not in self._arrays and name in self.paths:
+            self._arrays[name] = np.load(self.paths[name], mmap_mode="r")
+        return self._arrays.get(name)
+
+    def take(self, rows: Optional[np.ndarray] = None) -> tuple:
+        """Gives the rows at some positions.
+
+        Args:
+            rows: Optional. Positions of the rows. May repeat. If None, all
+                rows.
+
+        Returns:
+            Tuple of features, targets and clinician priorities, with a
+            positional index. The targets and priorities are None if not
+            given.
+        """
+        if rows is None:
+            rows = slice(None)
+        if self._frame is not None:
+            X = self._frame.iloc[rows].reset_index(drop=True)
+        else:
+            X = pd.DataFrame(
+                self._array("X")[rows], columns=self.columns, copy=False
+            )
+        taken = [X]
+        for name in ("y", "tc"):
+            array = self._array(name)
+            if array is None:
+                taken.append(None)
+            else:
+                taken.append(pd.Series(
+                    array[rows], name=self.names[name], copy=False
+                ))
+
+        return tuple(taken)
+
+    def close(self) -> None:
+        """Removes the files, if they are in a temporary directory."""
+        if self.memmap:
+            self._arrays = {}
+            if self._remove:
+                shutil.rmtree(self.directory, ignore_errors=True)
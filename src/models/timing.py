@@ -0,0 +1,193 @@
+import time
+import logging
+import cProfile
+import contextvars
+
+import pandas as pd
+
+from typing import Callable, Iterable, Optional
+from contextlib import contextmanager
+from joblib import delayed
+
+
+logger = logging.getLogger(__name__)
+
+# Timings of the current run, if any. See Timings
+_active = contextvars.ContextVar("timings", default=None)
+
+
+class Timings():
+    """Records how long each stage of a run takes.
+
+    Stages are timed only while a Timings is active, as a context manager.
+    Each stage is logged at debug level to the src.models.timing logger,
+    and passed to the callback, as a dictionary with the stage, the
+    seconds it took and its labels, e.g. the base classifier and fold.
+    Stages run by parallel workers, see timed_delayed, are recorded when
+    their results reach the caller.
+
+    E.g.:
+        with Timings() as timings:
+            sgclf.cv_outer_loop(...)
+        timings.report()
+
+    Args:
+        callback: Optional. Called with each record as it is recorded.
+        profile: Optional. If given, the run is also profiled with
+            cProfile, and the statistics saved to this path. Only the
+            calling process is profiled.
+    """
+    def __init__(self, callback: Optional[Callable[[dict], None]] = None,
+                 profile: Optional[str] = None):
+        self.callback = callback
+        self.profile = profile
+        self.records = []
+        self.wall = None
+
+        self._tokens = []
+        self._profiler = None
+        self._start = None
+
+    def __enter__(self):
+        self._tokens.append(_active.set(self))
+        if self.profile is not None:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.wall = time.perf_counter() - self._start
+        if self._profiler is not None:
+            self._profiler.disable()
+            self._profiler.dump_stats(self.profile)
+            self._profiler = None
+        _active.reset(self._tokens.pop())
+
+    def add(self, stage: str, seconds: float, **labels) -> None:
+        """Records the time of a stage.
+
+        Args:
+            stage: Name of the stage.
+            seconds: Wall time of the stage.
+            labels: Labels of the stage, e.g. clf="LogisticRegression".
+        """
+        self.extend([{"stage": stage, "seconds": seconds, **labels}])
+
+    def extend(self, records: Iterable[dict]) -> None:
+        """Records stages timed elsewhere, e.g. by a parallel worker."""
+        for record in records:
+            self.records.append(record)
+            logger.debug("%s took %.3fs %s", record["stage"], record["seconds"], {
+                k: v for k, v in record.items() if k not in ("stage", "seconds")
+            })
+            if self.callback is not None:
+                self.callback(record)
+
+    def to_frame(self) -> pd.DataFrame:
+        """Gives the records, one row per timed stage."""
+        return pd.DataFrame(self.records)
+
+    def report(self) -> pd.DataFrame:
+        """Aggregates the records by stage.
+
+        Stages run in parallel, or nested in other stages, overlap, so the
+        totals can add up to more than the wall time of the run.
+
+        Returns:
+            Data frame with the number of times each stage ran, and the
+            total, mean and greatest seconds, sorted by total. The share
+            is the total as a proportion of the wall time of the run.
+        """
+        columns = ["count", "total", "mean", "max", "share"]
+        if not self.records:
+            return pd.DataFrame(columns=columns)
+        report = self.to_frame().groupby("stage").seconds.agg(
+            count="count", total="sum", mean="mean", max="max"
+        )
+        wall = self.wall
+        if wall is None and self._start is not None:
+            wall = time.perf_counter() - self._start
+        report["share"] = report.total / wall if wall else float("nan")
+
+        return report.sort_values("total", ascending=False)[columns]
+
+
+def active_timings() -> Optional[Timings]:
+    """Gives the active Timings, or None if the run is not timed."""
+    return _active.get()
+
+
+@contextmanager
+def timed(stage: str, **labels):
+    """Times a stage, if a Timings is active.
+
+    Args:
+        stage: Name of the stage.
+        labels: Labels of the stage.
+    """
+    timings = _active.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(stage, time.perf_counter() - start, **labels)
+
+
+class TimedResult():
+    """Result of a parallel job, with the stages timed by the job."""
+    def __init__(self, value, records: list):
+        self.value = value
+        self.records = records
+
+
+def call_timed(func: Callable, *args, **kwargs) -> TimedResult:
+    """Calls a function with its stages recorded, e.g. in a worker."""
+    with Timings() as timings:
+        value = func(*args, **kwargs)
+
+    return TimedResult(value, timings.records)
+
+
+def timed_delayed(func: Callable):
+    """Same as joblib.delayed, but times the stages of the job.
+
+    Only if a Timings is active. The results must then be passed through
+    collect_timed to record the stages and get the values.
+
+    Args:
+        func: Function to run in parallel.
+
+    Returns:
+        Delayed function.
+    """
+    if _active.get() is None:
+        return delayed(func)
+
+    def delayed_func(*args, **kwargs):
+        return delayed(call_timed)(func, *args, **kwargs)
+
+    return delayed_func
+
+
+def collect_timed(results: Iterable) -> Iterable:
+    """Records the stages timed by parallel jobs, and yields their values.
+
+    Args:
+        results: Results of jobs run with timed_delayed, e.g. the output
+            of joblib.Parallel.
+
+    Yields:
+        The value of each job.
+    """
+    for result in results:
+        if isinstance(result, TimedResult):
+            timings = _active.get()
+            if timings is not None:
+                timings.extend(result.records)
+            yield result.value
+        else:
+            yield result
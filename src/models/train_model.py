@@ -1,13 +1,33 @@
+import logging
 import itertools
 
 import pandas as pd
 import numpy as np
-from typing import Callable
+from typing import Callable, Optional, Union
+
+from joblib import Parallel
+from sklearn.base import clone
+from sklearn.model_selection import StratifiedKFold
+
+from src.models.metrics import compute_binned_roc_aucs
+from src.models.resampling import (
+    derive_seed,
+    set_random_states,
+    OUTER_FOLDS,
+    INNER_FOLDS,
+    BASE_CLASSIFIERS,
+    META_CLASSIFIER
+)
+from src.models.shared import SharedData, needs_memmap
+from src.models.timing import timed, timed_delayed, collect_timed
+
+
+logger = logging.getLogger(__name__)
 
 
 def generate_all_combinations(d):
     """All permutations of dict elements.
-    
+
     Source:
         https://stackoverflow.com/questions/38721847/how-to-generate-all-combination-from-values-in-dict-of-lists-in-python
     """
@@ -15,220 +35,519 @@ def generate_all_combinations(d):
     return [dict(zip(keys, v)) for v in itertools.product(*values)]
 
 
-def fit(base_clfs: list, meta_clf: Callable,
-        inner_loop: Callable, hyper_parameters: list, 
-        X_train: pd.DataFrame, y_train: pd.Series, 
-        verbose: bool):
-    """Fits the classifiers and the meta classifier.
-    
-    Fits all the base classifiers, get predictions on all inner
-    loop validaion folds, and fit the meta classifiers to the predicted
-    probabilities.
-    
+def cut_probabilities(y_prob: np.ndarray, breaks: tuple) -> np.ndarray:
+    """Bins continuous probabilities into ordinal categories.
+
     Args:
-        base_clfs: Base classifiers
-        meta_clf: Meta classifier
-        hyper_parameters: Hyper parameters for base classifiers and
-            breaks for binning continous predictions.
-        X_train: Training features.
-        y_train: Training targets.
-        verbose: If True, logging is printed in inner cross-validation.
-    
+        y_prob: Predicted probabilities of 1s.
+        breaks: Break points. Bins are closed to the right.
+
     Returns:
-        Tuple of predicted proability of 1s and binned predictions.
+        Binned predictions, 0 for the lowest bin, as floats.
+    """
+    # Same bins as pd.cut, closed to the right, without the categorical
+    breaks = np.asarray(breaks, dtype=float)
+    y_prob_cut = np.searchsorted(breaks, y_prob, side="left") - 1.0
+    y_prob_cut[(y_prob_cut < 0) | (y_prob_cut >= len(breaks) - 1)] = np.nan
+
+    return y_prob_cut
+
+
+def split_hyper_parameters(all_hyper_parameters: list) -> dict:
+    """Groups hyper parameter sets that only differ in breaks.
+
+    The breaks only affect the binning of the continuous probabilities,
+    so all sets in a group can be evaluated with a single fit.
+
+    Args:
+        all_hyper_parameters: Hyper parameters to try.
+
+    Returns:
+        Dictionary with the position of the first set in each group as
+        key, and the positions of all sets in the group as value.
     """
-    base_clfs_ = []
-    # Set the hyper hyper parameters of the base classifiers
-    for clfk in base_clfs.keys():
-        ks = [s for s in hyper_parameters.keys() if clfk in s]
-        clf_params = {k.split("__")[1]: hyper_parameters.get(k) for k in ks}
-        clf = base_clfs[clfk]
+    groups = {}
+    first = {}
+    for i, hyper_parameters in enumerate(all_hyper_parameters):
+        model_parameters = {
+            k: v for k, v in hyper_parameters.items() if k != "breaks"
+        }
+        key = repr(sorted(model_parameters.items()))
+        groups.setdefault(first.setdefault(key, i), []).append(i)
+
+    return groups
+
+
+def set_hyper_parameters(base_clfs: Union[dict, list],
+                         hyper_parameters: dict) -> list:
+    """Sets the hyper parameters of the base classifiers.
+
+    Hyper parameters are named as <classifier>__<parameter>, e.g.
+    logisticregression__C, and set on each classifier whose name is in
+    <classifier>. Other keys, e.g. breaks, are ignored.
+
+    Args:
+        base_clfs: Base classifiers, as a dictionary from their names, or
+            a list, named by their lowercase class names.
+        hyper_parameters: Hyper parameters.
+
+    Returns:
+        The base classifiers, as a list.
+    """
+    if isinstance(base_clfs, dict):
+        named = list(base_clfs.items())
+    else:
+        named = [(clf.__class__.__name__.lower(), clf) for clf in base_clfs]
+    for name, clf in named:
+        ks = [s for s in hyper_parameters.keys() if name in s]
+        clf_params = {k.split("__", 1)[1]: hyper_parameters.get(k) for k in ks}
         clf.set_params(**clf_params)
-        base_clfs_.append(clf)
-    
-    # Get meta features of training set
-    meta_features_train = cv_inner_loop(
-        base_clfs=base_clfs_,
-        inner_loop=inner_loop,
-        X=X_train,
-        y=y_train,
-        verbose=verbose
+
+    return [clf for _, clf in named]
+
+
+def stratified_folds(n_splits: int,
+                     random_state: Optional[
+                         Union[int, np.random.SeedSequence]] = None,
+                     *key: int) -> StratifiedKFold:
+    """Gives stratified folds, shuffled if there is a random_state.
+
+    Args:
+        n_splits: Number of folds.
+        random_state: Optional. Seed or numpy SeedSequence. If None, the
+            folds are not shuffled.
+        key: Part of the pipeline the seed of the shuffle is derived for,
+            e.g. OUTER_FOLDS. See derive_seed.
+
+    Returns:
+        The cross-validator.
+    """
+    if random_state is None:
+        return StratifiedKFold(n_splits=n_splits)
+
+    return StratifiedKFold(
+        n_splits=n_splits, shuffle=True,
+        random_state=derive_seed(random_state, *key)
     )
 
-    # Fit meta classifier to meta features of train
-    meta_clf.fit(meta_features_train, y_train)
-    
-    return base_clfs_, meta_clf, meta_features_train
+
+def seed_classifiers(base_clfs: Union[dict, list], meta_clf: Callable,
+                     random_state: Optional[
+                         Union[int, np.random.SeedSequence]] = None
+                     ) -> tuple:
+    """Copies the classifiers, seeded with seeds derived from random_state.
+
+    Args:
+        base_clfs: Base classifiers, as a dictionary or a list.
+        meta_clf: Meta classifier.
+        random_state: Optional. Seed or numpy SeedSequence. If None, the
+            copies are left as is.
+
+    Returns:
+        Tuple of the copies of the base classifiers and meta classifier.
+    """
+    if isinstance(base_clfs, dict):
+        base_clfs = {name: clone(clf) for name, clf in base_clfs.items()}
+        clfs = list(base_clfs.values())
+    else:
+        base_clfs = clfs = [clone(clf) for clf in base_clfs]
+    meta_clf = clone(meta_clf)
+    if random_state is not None:
+        for k, clf in enumerate(clfs):
+            set_random_states(clf, random_state, BASE_CLASSIFIERS, k)
+        set_random_states(meta_clf, random_state, META_CLASSIFIER)
+
+    return base_clfs, meta_clf
+
+
+def predict_estimator(clf, X: pd.DataFrame, use_probas: bool) -> np.ndarray:
+    """Predicts probabilities of 1s, or classes, with a fitted classifier."""
+    return clf.predict_proba(X)[:, 1] if use_probas else clf.predict(X)
+
+
+def fit_estimator(clf, X: pd.DataFrame, y: pd.Series) -> object:
+    """Fits a classifier. Helper for fitting in parallel."""
+    with timed("base_refit", clf=clf.__class__.__name__):
+        return clf.fit(X, y)
+
+
+def fit_predict_estimator(clf, data: SharedData,
+                          train_index: np.ndarray, test_index: np.ndarray,
+                          use_probas: bool,
+                          return_estimator: bool = False,
+                          fold: Optional[int] = None) -> np.ndarray:
+    """Fits a classifier to the training rows and predicts the test rows.
+
+    Args:
+        clf: Classifier.
+        data: Features and targets.
+        train_index: Positions of the training rows.
+        test_index: Positions of the test rows.
+        use_probas: If True, predicts probabilities of 1s. Else, gives
+            predicted class.
+        return_estimator: If True, the fitted classifier is returned too.
+        fold: Optional. Inner fold. Used to label the timings.
+
+    Returns:
+        Predictions for the test rows, or tuple of the fitted classifier
+        and the predictions if return_estimator.
+    """
+    X_train, y_train, _ = data.take(train_index)
+    X_test, _, _ = data.take(test_index)
+    labels = dict(clf=clf.__class__.__name__, fold=fold)
+    with timed("base_fit", **labels):
+        clf.fit(X_train, y_train)
+    with timed("base_predict", **labels):
+        prediction = predict_estimator(clf, X_test, use_probas)
+
+    return (clf, prediction) if return_estimator else prediction
+
+
+def fit_base_classifiers(base_clfs: list, X: pd.DataFrame, y: pd.Series,
+                         n_jobs: Optional[int] = None,
+                         backend: Optional[str] = None) -> list:
+    """Fits each base classifier once to all rows, in parallel.
+
+    Args:
+        base_clfs: Base classifiers.
+        X: Features.
+        y: Targets.
+        n_jobs: Optional. Number of parallel jobs.
+        backend: Optional. Parallelization backend of joblib.Parallel.
+
+    Returns:
+        The fitted base classifiers.
+    """
+    return list(collect_timed(
+        Parallel(n_jobs=n_jobs, backend=backend)(
+            timed_delayed(fit_estimator)(clf, X, y) for clf in base_clfs
+        )
+    ))
 
 
 def cv_inner_loop(base_clfs: list,
-                  inner_loop: Callable, 
-                  X: pd.DataFrame, 
+                  inner_loop: Union[Callable, list],
+                  X: pd.DataFrame,
                   y: pd.Series,
-                  verbose: bool) -> np.ndarray:
+                  verbose: bool = False,
+                  use_probas: bool = True,
+                  n_jobs: Optional[int] = None,
+                  backend: Optional[str] = None,
+                  return_estimators: bool = False) -> np.ndarray:
     """Run inner loop of k-fold cross-validation.
-    
-    Uses sklearn's cross_val_predict.
-    
+
     That is,
     1. Fit classifier to the training folds.
     2. Make prediction on the validation fold.
     3. Use all folds as validation fold, one time each.
 
+    Each base classifier is fitted once per fold, to a clone, and its
+    predictions written into a preallocated matrix. The pairs of base
+    classifier and fold run in parallel.
+
     Args:
       base_clfs: List of classifiers. E.g. [LGBMClassifier, LogisticRegression]
-      inner_loop: scikit-learn callable to split into folds
+      inner_loop: scikit-learn cross-validator to split into folds, or a
+        list of (train_index, test_index) folds
       X: Features
       y: Targets
+      verbose: If True, logs the classifiers
+      use_probas: If True, predicts probabilities of 1s. Else, classes
+      n_jobs: Optional. Number of parallel jobs
+      backend: Optional. Parallelization backend of joblib.Parallel
+      return_estimators: If True, the classifiers fitted to each fold
+        are returned too
 
     Returns:
-      Each column represent predictions by each respective classifier
+      Each column represent predictions by each respective classifier.
+      If return_estimators, tuple of those and a list with the fitted
+      classifiers of each fold, per base classifier
     """
-    predictions = np.zeros((len(X_train.index), ))
-    for clf in base_clfs:
-        if verbose: print("Running predictions for " + str(clf))
-        preds = cross_val_predict(
-            estimator=clf,
-            X=X,
-            y=y,
-            cv=inner_loop
-        )
-        if predictions.any():
-            predictions = np.hstack([predictions, preds[:, np.newaxis]])
+    folds = (
+        list(inner_loop.split(X, y)) if hasattr(inner_loop, "split")
+        else list(inner_loop)
+    )
+    X_meta = np.zeros((len(y), len(base_clfs)))
+    if verbose:
+        for clf in base_clfs:
+            logger.info("Running predictions for " + str(clf))
+
+    # Each pair of base classifier and fold is independent
+    tasks = [
+        (k, f, train_index, test_index)
+        for k in range(len(base_clfs))
+        for f, (train_index, test_index) in enumerate(folds)
+    ]
+    memmap = len(tasks) > 1 and needs_memmap(n_jobs, backend)
+    with SharedData(X, y, memmap=memmap) as data:
+        predictions = list(collect_timed(
+            Parallel(n_jobs=n_jobs, backend=backend)(
+                timed_delayed(fit_predict_estimator)(
+                    clone(base_clfs[k]), data, train_index, test_index,
+                    use_probas, return_estimators, f
+                ) for k, f, train_index, test_index in tasks
+            )
+        ))
+
+    fold_clfs = [[] for _ in base_clfs]
+    if return_estimators:
+        for (k, _, _, _), (clf, _) in zip(tasks, predictions):
+            fold_clfs[k].append(clf)
+        predictions = [p for _, p in predictions]
+
+    for (k, _, _, test_index), p in zip(tasks, predictions):
+        X_meta[test_index, k] = p
+
+    return (X_meta, fold_clfs) if return_estimators else X_meta
+
+
+def fit(base_clfs: Union[dict, list], meta_clf: Callable,
+        inner_loop: Optional[Callable], hyper_parameters: dict,
+        X_train: pd.DataFrame, y_train: pd.Series,
+        verbose: bool = False, n_jobs: Optional[int] = None,
+        backend: Optional[str] = None, refit: bool = True,
+        meta_features: Optional[Callable] = None,
+        fit_base: Optional[Callable] = None):
+    """Fits the classifiers and the meta classifier.
+
+    Gets predictions of the base classifiers on all inner loop validation
+    folds, fits each base classifier to all training rows, and fits the
+    meta classifier to the predicted probabilities.
+    StackedGeneralizationClassifier.fit fits with this function too.
+
+    Args:
+        base_clfs: Base classifiers, as a dictionary from their names, or
+            a list. See set_hyper_parameters.
+        meta_clf: Meta classifier
+        inner_loop: Scikit-learn cross-validator. E.g. StratifiedKFold.
+        hyper_parameters: Hyper parameters for base classifiers and
+            breaks for binning continous predictions.
+        X_train: Training features.
+        y_train: Training targets.
+        verbose: If True, logging is printed in inner cross-validation.
+        n_jobs: Optional. Number of parallel jobs.
+        backend: Optional. Parallelization backend of joblib.Parallel.
+        refit: If True, each base classifier is fitted to all training
+            rows. Else, the base classifiers are returned unfitted, e.g.
+            when the classifiers of the inner folds are used to predict.
+        meta_features: Optional. Gives the meta features of the training
+            set, called with the base classifiers, X_train and y_train,
+            instead of cv_inner_loop with inner_loop. E.g. to cache them.
+        fit_base: Optional. Fits the base classifiers to the training set,
+            called with the base classifiers, X_train and y_train, instead
+            of fit_base_classifiers. E.g. to cache them.
+
+    Returns:
+        Tuple of the base classifiers, fitted if refit, the fitted meta
+        classifier, and the meta features of the training set. These are
+        clones, and base_clfs and meta_clf are left as is.
+    """
+    # Set the hyper parameters of copies, not of the caller's classifiers
+    if isinstance(base_clfs, dict):
+        base_clfs = {name: clone(clf) for name, clf in base_clfs.items()}
+    else:
+        base_clfs = [clone(clf) for clf in base_clfs]
+    meta_clf = clone(meta_clf)
+    base_clfs_ = set_hyper_parameters(base_clfs, hyper_parameters)
+
+    # Get meta features of training set
+    with timed("cv_inner_loop"):
+        if meta_features is None:
+            meta_features_train = cv_inner_loop(
+                base_clfs=base_clfs_,
+                inner_loop=inner_loop,
+                X=X_train,
+                y=y_train,
+                verbose=verbose,
+                n_jobs=n_jobs,
+                backend=backend
+            )
         else:
-            predictions = preds[:, np.newaxis]
+            meta_features_train = meta_features(base_clfs_, X_train, y_train)
+
+    if refit and fit_base is not None:
+        base_clfs_ = fit_base(base_clfs_, X_train, y_train)
+    elif refit:
+        base_clfs_ = fit_base_classifiers(
+            base_clfs_, X_train, y_train, n_jobs=n_jobs, backend=backend
+        )
+
+    # Fit meta classifier to meta features of train
+    with timed("meta_fit", clf=meta_clf.__class__.__name__):
+        meta_clf.fit(meta_features_train, y_train)
+
+    return base_clfs_, meta_clf, meta_features_train
+
+
+def predict_meta_features(base_clfs: list, X: pd.DataFrame,
+                          use_probas: bool = True,
+                          out: Optional[np.ndarray] = None) -> np.ndarray:
+    """Predicts with fitted base classifiers, one column per classifier.
+
+    Args:
+        base_clfs: Fitted base classifiers.
+        X: Features.
+        use_probas: If True, predicts probabilities of 1s. Else, classes.
+        out: Optional. Array with at least as many rows as X, to write the
+            meta features to. If None, a new array.
+
+    Returns:
+        Meta features.
+    """
+    if out is None:
+        out = np.empty((len(X), len(base_clfs)))
+    predictions = out[:len(X)]
+    for k, clf in enumerate(base_clfs):
+        with timed("base_predict", clf=clf.__class__.__name__):
+            predictions[:, k] = predict_estimator(clf, X, use_probas)
 
     return predictions
 
 
-def cv_outer_loop(base_clfs: list, meta_clf: Callable,
+def predict(base_clfs: Union[dict, list], meta_clf: Callable,
+            inner_loop: Callable, hyper_parameters: dict,
+            X_train: pd.DataFrame, y_train: pd.Series,
+            X_val: pd.DataFrame, verbose: bool = False,
+            n_jobs: Optional[int] = None,
+            backend: Optional[str] = None) -> tuple:
+    """Predicts using meta classifier.
+
+    Fits the base and meta classifiers to the training set, with fit,
+    predicts the validation set with the base classifiers, and predicts
+    with the meta classifier from those predictions.
+
+    Args:
+        base_clfs: Base classifiers.
+        meta_clf: Meta classifier.
+        hyper_parameters: Hyper parameters for base classifiers and
+            breaks for binning continous predictions.
+        inner_loop: Scikit-learn cross-validator. E.g. StratifiedKFold.
+        X_train: Training features,
+        y_train: Training targets.
+        X_val: Validation features.
+        verbose: If True, logging is printed in inner cross-validation.
+        n_jobs: Optional. Number of parallel jobs.
+        backend: Optional. Parallelization backend of joblib.Parallel.
+
+    Returns:
+        Tuple of predicted proability of 1s and binned predictions.
+    """
+    base_clfs_, meta_clf_, _ = fit(
+        base_clfs=base_clfs,
+        meta_clf=meta_clf,
+        inner_loop=inner_loop,
+        hyper_parameters=hyper_parameters,
+        X_train=X_train,
+        y_train=y_train,
+        verbose=verbose,
+        n_jobs=n_jobs,
+        backend=backend
+    )
+
+    # Get meta features of validation set
+    meta_features_val = predict_meta_features(base_clfs_, X_val)
+
+    # Predict using validation meta features
+    with timed("meta_predict", clf=meta_clf_.__class__.__name__):
+        y_pred_con = meta_clf_.predict_proba(meta_features_val)[:, 1]
+    y_pred_cut = cut_probabilities(y_pred_con, hyper_parameters["breaks"])
+
+    return y_pred_con, y_pred_cut
+
+
+def cv_outer_loop(base_clfs: Union[dict, list], meta_clf: Callable,
                   all_hyper_parameters: list,
                   X: pd.DataFrame, y: pd.Series,
-                  use_meta_features: bool = False, 
-                  verbose: bool = False):
+                  verbose: bool = False,
+                  n_jobs: Optional[int] = None,
+                  backend: Optional[str] = None,
+                  inner_folds: int = 3,
+                  outer_folds: int = 2,
+                  random_state: Optional[
+                      Union[int, np.random.SeedSequence]] = None):
     """Runs outer cross-validation.
-    
+
     That is, find the best combination cut-points for the classifier.
-    "Best" is defined by the highest AUC of ROC.
-    
+    "Best" is defined by the highest AUC of ROC of the binned predictions.
+    Hyper parameters that only differ in breaks share one fit per outer
+    fold.
+
     Inspired by:
         https://github.com/rasbt/mlxtend/blob/master/mlxtend/classifier/stacking_cv_classification.py.
-        
+
     Args:
         base_clfs: Base classifiers.
         meta_clf: Meta classifier.
         all_hyper_parameters: Model hyper parameters and breaks for continous probabilities.
         X: Features.
         y: Targets.
-        use_meta_features: If True, the feature set for meta classifier is predicted probabilities
-            of positive labels from base classifiers + features used to train
-            base classifiers.
         verbose: If True, logging is used in the inner cross-validation.
+        n_jobs: Optional. Number of parallel jobs.
+        backend: Optional. Parallelization backend of joblib.Parallel.
+        inner_folds: Number of inner folds.
+        outer_folds: Number of outer folds.
+        random_state: Optional. Seed or numpy SeedSequence. If given, the
+            folds are shuffled and the classifiers seeded with the seeds
+            StackedGeneralizationClassifier derives from it, so that runs
+            are reproducible. If None, the folds are not shuffled and the
+            classifiers are left as is.
 
     Returns:
         Three variables
         - Refitted base classifiers,
-        - Refitted meta classifier, and 
+        - Refitted meta classifier, and
         - The hyper parameters yielding the best results.
-    """                
+    """
     ## Setup splitting
-    inner_folds = 3
-    outer_folds = 2
-    inner_loop = StratifiedKFold(n_splits = inner_folds)
-    outer_loop = StratifiedKFold(n_splits = outer_folds)
-    
+    inner_loop = stratified_folds(inner_folds, random_state, INNER_FOLDS)
+    outer_loop = stratified_folds(outer_folds, random_state, OUTER_FOLDS)
+    base_clfs, meta_clf = seed_classifiers(base_clfs, meta_clf, random_state)
+
     ## Setup for recording auc from each combination of hps
     roc_aucs = pd.DataFrame(
         data = np.zeros((len(all_hyper_parameters), outer_folds)),
         columns = range(1, outer_folds + 1)
     )
-    
-    for i, hyper_parameters in enumerate(all_hyper_parameters):
 
+    for first, rows in split_hyper_parameters(all_hyper_parameters).items():
+        hyper_parameters = all_hyper_parameters[first]
         for j, (train_index, val_index) in enumerate(outer_loop.split(X, y)):
-        
-            X_train = X.iloc[train_index]
-            y_train = y.iloc[train_index]
-            X_val = X.iloc[val_index]
-            y_val = y.iloc[val_index]
-            
-            y_pred_con, y_pred_cut = predict(
+            base_clfs_, meta_clf_, _ = fit(
                 base_clfs=base_clfs,
                 meta_clf=meta_clf,
                 hyper_parameters=hyper_parameters,
                 inner_loop=inner_loop,
-                X_train=X_train,
-                y_train=y_train,
-                X_val=X_val,
-                verbose=verbose
+                X_train=X.iloc[train_index],
+                y_train=y.iloc[train_index],
+                verbose=verbose,
+                n_jobs=n_jobs,
+                backend=backend
             )
-            auc = roc_auc_score(
-                y_true=y_val,
-                y_score=y_pred_cut
+            X_val = X.iloc[val_index]
+            y_pred_con = meta_clf_.predict_proba(
+                predict_meta_features(base_clfs_, X_val)
+            )[:, 1]
+            roc_aucs.iloc[rows, j] = compute_binned_roc_aucs(
+                y_prob=y_pred_con,
+                y_true=y.iloc[val_index],
+                all_breaks=[all_hyper_parameters[i]["breaks"] for i in rows]
             )
-            roc_aucs.iloc[i, j] = 1 - auc
 
     # Find the best performing settings for the models
     max_row = roc_aucs.mean(axis=1).idxmax()
     best_hyper_parameters = all_hyper_parameters[max_row]
-    
-    base_clfs_, meta_clf_ = base_clfs, meta_clf
-    
-    return base_clfs_, meta_clf_, best_hyper_parameters
-
 
-def predict(base_clfs: list, meta_clf: Callable,
-            inner_loop: Callable, hyper_parameters: list,
-            X_train: pd.DataFrame, y_train: pd.Series,
-            X_val: pd.DataFrame, verbose: bool = False) -> tuple:
-    """Predicts using meta classifier.
-    
-    Use the fitted base classifiers to predict on the validation set,
-    fit the meta classifier to those predictions, and predict with 
-    the meta classifier.
-    
-    Args:
-        base_clfs: Base classifiers.
-        meta_clf: Meta classifier.
-        hyper_parameters: Hyper parameters for base classifiers and
-            breaks for binning continous predictions.
-        inner_loop: Scikit-learn cross-validator. E.g. StratifiedKFold.
-        X_train: Training features,
-        y_train: Training targets.
-        X_val: Validation features.
-    
-    Returns:
-        Tuple of predicted proability of 1s and binned predictions.
-    """
-    base_clfs_, meta_clf_, meta_features_train = fit(
+    # Refit to all rows with the best settings
+    base_clfs_, meta_clf_, _ = fit(
         base_clfs=base_clfs,
         meta_clf=meta_clf,
+        hyper_parameters=best_hyper_parameters,
         inner_loop=inner_loop,
-        hyper_parameters=hyper_parameters,
-        X_train=X_train,
-        y_train=y_train,
-        verbose=verbose
+        X_train=X,
+        y_train=y,
+        verbose=verbose,
+        n_jobs=n_jobs,
+        backend=backend
     )
 
-    # Get meta features of validation set
-    per_model_preds = []
-    for clf in base_clfs_:
-        clf.fit(X_train, y_train)
-        prediction = clf.predict_proba(X_val)[:, :-1]
-        per_model_preds.append(prediction)
-    meta_features_val = np.hstack(per_model_preds)
-    
-    # Fit meta classifier to meta features of train
-    meta_clf_.fit(meta_features_train, y_train)
-    # Predict using validation meta features
-    y_pred_con = meta_clf.predict_proba(meta_features_val)
-    # Calculate AUC of ROC for cut predictions
-    y_pred_cut = pd.cut(
-        x=y_pred_con[:, 1],
-        bins=hyper_parameters["breaks"],
-        labels=[0, 1, 2, 3],
-        right=True,
-        include_lowest=False
-    )
-    return y_pred_con[:, 1], y_pred_cut
-
+    return base_clfs_, meta_clf_, best_hyper_parameters
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+import click
+import logging
+
+from src.models.executors import TIMEOUT, work
+
+
+@click.command()
+@click.argument("path", type=click.Path())
+@click.option("--poll", default=0.5, help="Seconds between checks for jobs.")
+@click.option("--timeout", default=TIMEOUT,
+              help="Seconds without a refreshed claim before a job is "
+                   "handed out again.")
+@click.option("--idle", default=None, type=float,
+              help="Exit after this many seconds without jobs.")
+def main(path, poll, timeout, idle):
+    """ Pulls jobs from the SQLite work queue at PATH and runs them, for
+        cv_outer_loop or bootstrap with an SQLiteQueueExecutor.
+    """
+    work(path, poll=poll, timeout=timeout, idle=idle)
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
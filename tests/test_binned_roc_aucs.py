@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from sklearn.metrics import roc_auc_score
+
+from src.models.metrics import compute_binned_roc_aucs
+
+
+def binned_roc_auc(y_prob, y_true, breaks):
+    """AUC of ROC of the bins of pd.cut, closed to the right."""
+    y_cut = pd.cut(y_prob, breaks, labels=False)
+    inside = ~np.isnan(y_cut)
+
+    return roc_auc_score(y_true[inside], y_cut[inside])
+
+
+@pytest.fixture
+def data():
+    rng = np.random.default_rng(0)
+    y_true = rng.integers(0, 2, 500)
+    y_prob = np.clip(0.3 * y_true + rng.random(500) * 0.7, 0, 1)
+    # Ties, and probabilities exactly on the breaks and outside them
+    y_prob[:50] = np.round(y_prob[:50], 1)
+    y_prob[50:60] = [0, 0.05, 0.1, 0.2, 0.3, 0.5, 0.7, 0.9, 1, 0.05]
+
+    return y_prob, y_true
+
+
+ALL_BREAKS = [
+    (0, 0.05, 0.1, 0.2, np.inf),
+    (0, 0.1, 0.3, 0.5, np.inf),
+    (0, 0.2, 0.5, 0.9, 1),
+    (0.05, 0.3, 0.7, 0.9, np.inf),
+    (0, 0.5, 0.7, 0.9, 0.95)
+]
+
+
+def test_compute_binned_roc_aucs_matches_pd_cut(data):
+    y_prob, y_true = data
+
+    roc_aucs = compute_binned_roc_aucs(y_prob, y_true, ALL_BREAKS)
+
+    expected = [binned_roc_auc(y_prob, y_true, b) for b in ALL_BREAKS]
+    np.testing.assert_allclose(roc_aucs, expected, rtol=0, atol=1e-12)
+
+
+def test_compute_binned_roc_aucs_grid(data):
+    y_prob, y_true = data
+    all_breaks = [
+        (0, ) + tuple(b) + (np.inf, )
+        for b in np.sort(np.random.default_rng(1).random((50, 3)), axis=1)
+    ]
+
+    roc_aucs = compute_binned_roc_aucs(y_prob, y_true, all_breaks)
+
+    expected = [binned_roc_auc(y_prob, y_true, b) for b in all_breaks]
+    np.testing.assert_allclose(roc_aucs, expected, rtol=0, atol=1e-12)
+
+
+def test_compute_binned_roc_aucs_one_class_is_nan():
+    y_prob = np.array([0.1, 0.2, 0.6])
+
+    roc_aucs = compute_binned_roc_aucs(
+        y_prob, np.array([1, 1, 1]), [(0, 0.15, 0.5, np.inf)]
+    )
+
+    assert np.isnan(roc_aucs).all()
@@ -0,0 +1,144 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from sklearn.linear_model import LogisticRegression
+from sklearn.naive_bayes import GaussianNB
+
+from src.models.cache import ArrayCache
+from src.models.classifiers import StackedGeneralizationClassifier
+
+
+class CountingLogisticRegression(LogisticRegression):
+    """Counts the fits of all instances."""
+    fits = 0
+
+    def fit(self, X, y, sample_weight=None):
+        CountingLogisticRegression.fits += 1
+        return super().fit(X, y, sample_weight=sample_weight)
+
+
+def touch(path, mtime):
+    os.utime(path, (mtime, mtime))
+
+
+def test_get_misses_and_hits(tmp_path):
+    cache = ArrayCache(str(tmp_path))
+    key = cache.key("a", np.arange(3))
+
+    assert cache.get(key) is None
+    cache.set(key, np.arange(3) * 2.0)
+    np.testing.assert_array_equal(cache.get(key), [0, 2, 4])
+
+
+def test_keys_depend_on_the_inputs(tmp_path):
+    cache = ArrayCache(str(tmp_path))
+    X = pd.DataFrame({"a": [1.0, 2.0]})
+
+    assert cache.key(X, 1) == cache.key(X.copy(), 1)
+    assert cache.key(X, 1) != cache.key(X, 2)
+    assert cache.key(X, 1) != cache.key(X + 1, 1)
+    assert (
+        cache.key(LogisticRegression(C=1)) !=
+        cache.key(LogisticRegression(C=2))
+    )
+
+
+def test_evicts_least_recently_used(tmp_path):
+    array = np.zeros(100)
+    cache = ArrayCache(str(tmp_path))
+    for mtime, key in enumerate(["a", "b", "c"]):
+        cache.set(key, array)
+        touch(cache._path(key), 1000 + mtime)
+    size = os.path.getsize(cache._path("a"))
+    # Reading a makes b the least recently used
+    cache.get("a")
+
+    cache.max_bytes = 3 * size
+    cache.set("d", array)
+
+    assert cache.get("b") is None
+    for key in ("a", "c", "d"):
+        assert cache.get(key) is not None
+
+
+def test_evicts_nothing_within_max_bytes(tmp_path):
+    cache = ArrayCache(str(tmp_path), max_bytes=10 ** 6)
+    for key in "abc":
+        cache.set(key, np.zeros(100))
+
+    assert all(cache.get(key) is not None for key in "abc")
+
+
+def test_objects(tmp_path):
+    cache = ArrayCache(str(tmp_path))
+    clf = LogisticRegression().fit([[0], [1]], [0, 1])
+
+    assert cache.get_object("clf") is None
+    cache.set_object("clf", clf)
+    np.testing.assert_array_equal(cache.get_object("clf").coef_, clf.coef_)
+
+    cache.clear()
+    assert cache.get_object("clf") is None
+
+
+@pytest.fixture
+def data():
+    rng = np.random.default_rng(0)
+    X = pd.DataFrame(rng.normal(size=(200, 2)), columns=["a", "b"])
+    y = pd.Series((X.a + rng.normal(size=200) > 0).astype(int))
+
+    return X, y
+
+
+def make_classifier(cache_dir):
+    sgclf = StackedGeneralizationClassifier(
+        base_clfs=[CountingLogisticRegression(), GaussianNB()],
+        meta_clf=LogisticRegression(),
+        cache_dir=cache_dir,
+        random_state=0
+    )
+    sgclf.hyper_parameters = {"breaks": (0, 0.3, 0.6, np.inf)}
+
+    return sgclf
+
+
+def test_refit_reads_the_cache(data, tmp_path):
+    X, y = data
+    CountingLogisticRegression.fits = 0
+    first = make_classifier(str(tmp_path)).fit(X, y)
+    # Once per inner fold, and once to all rows
+    assert CountingLogisticRegression.fits == 3
+
+    second = make_classifier(str(tmp_path)).fit(X, y)
+
+    assert CountingLogisticRegression.fits == 3
+    assert second.cache_keys_ == first.cache_keys_
+    np.testing.assert_array_equal(second.predict(X)[0], first.predict(X)[0])
+
+
+def test_other_data_misses_the_cache(data, tmp_path):
+    X, y = data
+    CountingLogisticRegression.fits = 0
+    first = make_classifier(str(tmp_path)).fit(X, y)
+
+    second = make_classifier(str(tmp_path)).fit(X.iloc[:150], y.iloc[:150])
+
+    assert CountingLogisticRegression.fits == 6
+    assert second.cache_keys_ != first.cache_keys_
+
+
+def test_predict_keys_on_the_fit(data, tmp_path):
+    X, y = data
+    sgclf = make_classifier(str(tmp_path)).fit(X, y)
+    y_prob = sgclf.predict_meta_features(X)
+    n_files = len(os.listdir(tmp_path))
+
+    np.testing.assert_array_equal(sgclf.predict_meta_features(X), y_prob)
+    assert len(os.listdir(tmp_path)) == n_files
+
+    # A refit to other data keys the predictions anew
+    sgclf.fit(X.iloc[:150], y.iloc[:150])
+    assert not np.array_equal(sgclf.predict_meta_features(X), y_prob)
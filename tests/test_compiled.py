@@ -0,0 +1,203 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from sklearn.compose import ColumnTransformer
+from sklearn.ensemble import (
+    RandomForestClassifier,
+    HistGradientBoostingClassifier
+)
+from sklearn.impute import SimpleImputer
+from sklearn.linear_model import LogisticRegression
+from sklearn.naive_bayes import GaussianNB
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+from sklearn.tree import DecisionTreeClassifier
+
+from src.models import compiled as compiled_module
+from src.models.classifiers import StackedGeneralizationClassifier
+from src.models.compiled import (
+    CompiledEstimator,
+    CompiledFallback,
+    CompiledTrees,
+    compile_estimator
+)
+
+
+BREAKS = (0, 0.2, 0.4, 0.6, np.inf)
+
+
+@pytest.fixture
+def data():
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(600, 4))
+    X[:, 3] = rng.integers(0, 3, 600)
+    y = (X[:, 0] + X[:, 1] * X[:, 3] + rng.normal(size=600) > 0).astype(int)
+    X = pd.DataFrame(X, columns=["a", "b", "c", "d"])
+
+    return X, pd.Series(y)
+
+
+def with_missing(X, seed=1):
+    """Copy of X with about a tenth of the values missing."""
+    X = X.copy()
+    rng = np.random.default_rng(seed)
+    X[rng.random(X.shape) < 0.1] = np.nan
+
+    return X
+
+
+def compiled_probas(compiled, X):
+    X = X.to_numpy()
+    if compiled.float32:
+        X = X.astype(np.float32).astype(float)
+
+    return np.array([compiled.proba(x) for x in X.tolist()])
+
+
+@pytest.mark.parametrize("cross_fit", [False, True])
+def test_compiled_classifier_matches_predict(data, cross_fit):
+    X, y = data
+    sgclf = StackedGeneralizationClassifier(
+        base_clfs=[
+            LogisticRegression(),
+            GaussianNB(),
+            RandomForestClassifier(n_estimators=10, max_depth=5),
+            HistGradientBoostingClassifier(max_iter=10)
+        ],
+        meta_clf=LogisticRegression(),
+        cross_fit=cross_fit,
+        random_state=0
+    )
+    sgclf.hyper_parameters = {"breaks": BREAKS}
+    sgclf.fit(X, y)
+
+    compiled = sgclf.compile()
+
+    y_prob, y_cut = sgclf.predict(X)
+    results = [compiled.predict(x) for x in X.to_numpy()]
+    np.testing.assert_allclose(
+        [p for p, _ in results], y_prob, rtol=0, atol=1e-12
+    )
+    np.testing.assert_array_equal([c for _, c in results], y_cut)
+    # Rows given as mappings of the feature names
+    assert compiled.predict_proba(X.iloc[0].to_dict()) == results[0][0]
+
+
+@pytest.mark.parametrize("clf", [
+    DecisionTreeClassifier(max_depth=6, random_state=0),
+    RandomForestClassifier(n_estimators=10, random_state=0),
+    HistGradientBoostingClassifier(max_iter=20)
+])
+def test_compiled_trees_route_missing_values(data, clf):
+    X, y = data
+    X = with_missing(X)
+    clf.fit(X, y)
+
+    compiled = compile_estimator(clf)
+
+    assert isinstance(compiled, CompiledTrees)
+    X_test = with_missing(X, seed=2)
+    expected = clf.predict_proba(X_test)
+    np.testing.assert_allclose(
+        compiled_probas(compiled, X_test), expected[:, 1],
+        rtol=0, atol=1e-12
+    )
+    np.testing.assert_allclose(
+        compiled.predict_proba(X_test), expected, rtol=0, atol=1e-12
+    )
+    np.testing.assert_array_equal(
+        compiled.predict(X_test), clf.predict(X_test)
+    )
+
+
+@pytest.mark.parametrize("params", [
+    {},
+    {"zero_as_missing": True},
+    {"boosting_type": "rf", "bagging_freq": 1, "bagging_fraction": 0.5}
+])
+def test_compiled_lightgbm_routes_missing_values(data, params):
+    lightgbm = pytest.importorskip("lightgbm")
+    X, y = data
+    X = with_missing(X)
+    X.iloc[:50, 3] = 0.0
+    clf = Pipeline([(
+        "lightgbmclassifier",
+        lightgbm.LGBMClassifier(n_estimators=20, verbose=-1, **params)
+    )])
+    clf.fit(X, y)
+
+    compiled = compile_estimator(clf)
+
+    X_test = with_missing(X, seed=2)
+    expected = clf.predict_proba(X_test)
+    np.testing.assert_allclose(
+        compiled_probas(compiled, X_test), expected[:, 1],
+        rtol=0, atol=1e-12
+    )
+    np.testing.assert_allclose(
+        compiled.predict_proba(X_test), expected, rtol=0, atol=1e-12
+    )
+
+
+def test_compile_estimator_falls_back(data):
+    X, y = data
+    clf = Pipeline([
+        ("preprocessor", ColumnTransformer([
+            ("num", SimpleImputer(), ["a", "b", "c", "d"])
+        ])),
+        ("logisticregression", LogisticRegression())
+    ])
+    clf.fit(X, y)
+
+    with pytest.raises(ValueError):
+        compile_estimator(clf)
+    compiled = compile_estimator(
+        clf, feature_names=list(X.columns), fallback=True
+    )
+
+    assert isinstance(compiled, CompiledFallback)
+    assert compiled.proba(X.iloc[0].tolist()) == clf.predict_proba(X[:1])[0, 1]
+
+
+def test_compile_estimator_passthrough_pipeline(data):
+    X, y = data
+    clf = Pipeline([("scaler", "passthrough"), ("lr", LogisticRegression())])
+    clf.fit(X, y)
+    scaled = Pipeline([("scaler", StandardScaler()),
+                       ("lr", LogisticRegression())]).fit(X, y)
+
+    compiled = compile_estimator(clf)
+
+    np.testing.assert_allclose(
+        compiled_probas(compiled, X), clf.predict_proba(X)[:, 1],
+        rtol=0, atol=1e-12
+    )
+    with pytest.raises(ValueError):
+        compile_estimator(scaled)
+
+
+def test_hist_gradient_boosting_of_other_versions_falls_back(
+        data, monkeypatch):
+    X, y = data
+    clf = HistGradientBoostingClassifier(max_iter=5).fit(X, y)
+    monkeypatch.setattr(
+        compiled_module, "HGB_SKLEARN_VERSIONS", ("0.1", "0.2")
+    )
+
+    with pytest.raises(ValueError, match="scikit-learn"):
+        compile_estimator(clf)
+    compiled = compile_estimator(
+        clf, feature_names=list(X.columns), fallback=True
+    )
+
+    assert isinstance(compiled, CompiledFallback)
+    assert compiled.proba(X.iloc[0].tolist()) == clf.predict_proba(X[:1])[0, 1]
+
+
+def test_compiled_estimators_need_proba():
+    class Incomplete(CompiledEstimator):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
@@ -0,0 +1,215 @@
+import os
+import sys
+import math
+import time
+import pickle
+import sqlite3
+import operator
+import subprocess
+
+import pytest
+
+from joblib import delayed
+
+from src.models.executors import (
+    Executor,
+    JoblibExecutor,
+    SQLiteQueueExecutor,
+    claim,
+    connect,
+    create_queue,
+    heartbeat,
+    run_one,
+    worker_name
+)
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def queue(tmp_path):
+    path = str(tmp_path / "queue.sqlite")
+    with connect(path) as db:
+        create_queue(db)
+
+    return path
+
+
+def add_jobs(db, jobs, run="run"):
+    db.executemany(
+        "INSERT INTO jobs (run, seq, payload) VALUES (?, ?, ?)",
+        [(run, seq, pickle.dumps(job)) for seq, job in enumerate(jobs)]
+    )
+
+
+def jobs_by_id(db):
+    return {
+        job_id: (status, worker, claimed_at)
+        for job_id, status, worker, claimed_at in db.execute(
+            "SELECT id, status, worker, claimed_at FROM jobs"
+        )
+    }
+
+
+def test_executors_need_call():
+    class Incomplete(Executor):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_claim_hands_out_each_job_once(queue):
+    with connect(queue) as db:
+        add_jobs(db, [delayed(abs)(-1), delayed(abs)(-2)])
+
+        first = claim(db, timeout=60)
+        second = claim(db, timeout=60)
+
+        assert (first[0], second[0]) == (1, 2)
+        assert pickle.loads(first[1]) == delayed(abs)(-1)
+        assert claim(db, timeout=60) is None
+        status, worker, _ = jobs_by_id(db)[1]
+        assert (status, worker) == ("running", worker_name())
+
+
+def test_claim_only_of_run(queue):
+    with connect(queue) as db:
+        add_jobs(db, [delayed(abs)(-1)], run="a")
+        add_jobs(db, [delayed(abs)(-2)], run="b")
+
+        job_id, _ = claim(db, timeout=60, run="b")
+
+        assert job_id == 2
+        assert claim(db, timeout=60, run="b") is None
+
+
+def test_claim_hands_out_stale_claims_again(queue):
+    with connect(queue) as db:
+        add_jobs(db, [delayed(abs)(-1)])
+        claim(db, timeout=60)
+        db.execute(
+            "UPDATE jobs SET worker = 'gone:1', claimed_at = ?",
+            (time.time() - 30, )
+        )
+
+        assert claim(db, timeout=60) is None
+        job_id, _ = claim(db, timeout=10)
+
+        assert job_id == 1
+        assert jobs_by_id(db)[1][1] == worker_name()
+
+
+def test_heartbeat_refreshes_own_claims(queue):
+    with connect(queue) as db:
+        add_jobs(db, [delayed(abs)(-1), delayed(abs)(-2)])
+        claim(db, timeout=60)
+        claim(db, timeout=60)
+        db.execute("UPDATE jobs SET claimed_at = 0")
+        db.execute("UPDATE jobs SET worker = 'other:1' WHERE id = 2")
+
+        with heartbeat(db, 1, interval=0.02), heartbeat(db, 2, 0.02):
+            time.sleep(0.2)
+
+        jobs = jobs_by_id(db)
+        assert jobs[1][2] > time.time() - 5
+        assert jobs[2][2] == 0
+        # Only the claim not refreshed is handed out again
+        assert claim(db, timeout=5)[0] == 2
+        assert claim(db, timeout=5) is None
+
+
+def test_run_one_saves_results_and_failures(queue):
+    with connect(queue) as db:
+        add_jobs(db, [delayed(operator.mul)(3, 4), delayed(math.sqrt)(-1)])
+
+        assert run_one(db, timeout=60)
+        assert run_one(db, timeout=60)
+        assert not run_one(db, timeout=60)
+
+        (status, result), (failed, error) = db.execute(
+            "SELECT status, COALESCE(result, error) FROM jobs ORDER BY id"
+        ).fetchall()
+        assert status == "done" and pickle.loads(result) == 12
+        assert failed == "failed" and "ValueError" in error
+
+
+def test_sqlite_executor_runs_jobs_in_order(queue):
+    executor = SQLiteQueueExecutor(queue, poll=0.01)
+
+    results = list(executor(delayed(pow)(i, 2) for i in range(5)))
+
+    assert results == [0, 1, 4, 9, 16]
+    assert list(JoblibExecutor()(delayed(pow)(i, 2) for i in range(5))) == (
+        results
+    )
+    with connect(queue) as db:
+        assert db.execute("SELECT COUNT(*) FROM jobs").fetchone()[0] == 0
+
+
+def test_sqlite_executor_raises_failures(queue):
+    executor = SQLiteQueueExecutor(queue, poll=0.01)
+
+    with pytest.raises(RuntimeError, match="math domain error"):
+        list(executor([delayed(abs)(-1), delayed(math.sqrt)(-1)]))
+
+
+def start_worker(path, timeout):
+    return subprocess.Popen(
+        [
+            sys.executable, "-m", "src.models.worker", path, "--poll",
+            "0.02", "--timeout", str(timeout), "--idle", "1"
+        ],
+        cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+
+def test_two_workers_share_a_queue(queue):
+    with connect(queue) as db:
+        add_jobs(db, [delayed(time.sleep)(0.5) for _ in range(8)])
+        # Claimed by a worker that stopped
+        db.execute(
+            "UPDATE jobs SET status = 'running', worker = 'gone:1', "
+            "claimed_at = ? WHERE id = 1", (time.time() - 2, )
+        )
+
+    workers = [start_worker(queue, timeout=1) for _ in range(2)]
+    try:
+        for worker in workers:
+            assert worker.wait(timeout=60) == 0
+    finally:
+        for worker in workers:
+            worker.kill()
+
+    with connect(queue) as db:
+        jobs = jobs_by_id(db)
+    assert all(status == "done" for status, _, _ in jobs.values())
+    assert jobs[1][1] != "gone:1"
+    assert len({worker for _, worker, _ in jobs.values()}) == 2
+    assert not {worker for _, worker, _ in jobs.values()} & {worker_name()}
+
+
+def test_worker_leaves_refreshed_claims(queue):
+    with connect(queue) as db:
+        add_jobs(db, [delayed(abs)(-1)])
+        claim(db, timeout=60)
+
+        with heartbeat(db, 1, interval=0.1):
+            worker = start_worker(queue, timeout=0.5)
+            assert worker.wait(timeout=60) == 0
+
+        status, claimed_by, _ = jobs_by_id(db)[1]
+    assert (status, claimed_by) == ("running", worker_name())
+
+
+def test_locked_queue_raises(queue):
+    with connect(queue) as db:
+        db.execute("BEGIN EXCLUSIVE")
+        other = sqlite3.connect(queue, timeout=0.05, isolation_level=None)
+        try:
+            with pytest.raises(sqlite3.OperationalError):
+                claim(other, timeout=60)
+        finally:
+            other.close()
+            db.execute("ROLLBACK")
@@ -0,0 +1,96 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+
+from src.models.classifiers import StackedGeneralizationClassifier, halve
+
+
+@pytest.fixture
+def data():
+    rng = np.random.default_rng(0)
+    X = pd.DataFrame(rng.normal(size=(300, 3)), columns=["a", "b", "c"])
+    y = pd.Series((X.a + X.b * X.c + rng.normal(size=300) > 0).astype(int))
+
+    return X, y
+
+
+# Pairs of hyper parameters share the model parameters, and one fit
+ALL_HYPER_PARAMETERS = [
+    {"breaks": breaks, "randomforestclassifier__max_depth": depth}
+    for depth in (1, 2, 3, 5)
+    for breaks in ((0, 0.3, 0.6, np.inf), (0, 0.45, 0.55, np.inf))
+]
+
+
+def search(data, **kwargs):
+    X, y = data
+    sgclf = StackedGeneralizationClassifier(
+        base_clfs=[
+            LogisticRegression(),
+            RandomForestClassifier(n_estimators=5)
+        ],
+        meta_clf=LogisticRegression(),
+        random_state=0
+    )
+    sgclf.cv_outer_loop(
+        ALL_HYPER_PARAMETERS, X, y, refit=False, inner_folds=2,
+        outer_folds=3, **kwargs
+    )
+
+    return sgclf
+
+
+def test_halving_prunes_each_fold(data):
+    sgclf = search(data, search="halving", halving_factor=2)
+
+    evaluated = sgclf.roc_aucs.notna()
+    assert evaluated.sum().tolist() == [8, 4, 2]
+    # Pruned hyper parameters do not come back
+    assert (evaluated[2] <= evaluated[1]).all()
+    assert (evaluated[3] <= evaluated[2]).all()
+    # The best on the folds so far go on
+    first = sgclf.roc_aucs[1]
+    assert first[evaluated[2]].min() >= first[~evaluated[2]].max()
+    two = sgclf.roc_aucs[[1, 2]][evaluated[2]].mean(axis=1)
+    assert two[evaluated[3]].min() >= two[~evaluated[3]].max()
+
+
+def test_halving_matches_exhaustive_on_kept_folds(data):
+    halving = search(data, search="halving", halving_factor=2)
+    exhaustive = search(data)
+
+    assert exhaustive.roc_aucs.notna().all(axis=None)
+    evaluated = halving.roc_aucs.notna()
+    np.testing.assert_array_equal(
+        halving.roc_aucs.where(evaluated),
+        exhaustive.roc_aucs.where(evaluated)
+    )
+
+
+def test_halving_picks_from_the_last_fold(data):
+    sgclf = search(data, search="halving", halving_factor=2)
+
+    survivors = sgclf.roc_aucs.index[sgclf.roc_aucs[3].notna()]
+    best = sgclf.roc_aucs.loc[survivors].mean(axis=1).idxmax()
+    assert sgclf.hyper_parameters == ALL_HYPER_PARAMETERS[best]
+
+
+def test_halving_factor_keeps_at_least_one(data):
+    sgclf = search(data, search="halving", halving_factor=100)
+
+    assert sgclf.roc_aucs.notna().sum().tolist() == [8, 1, 1]
+
+
+def test_halve():
+    roc_aucs = pd.DataFrame({1: [0.6, 0.9, 0.7, 0.9, 0.5], 2: np.nan})
+
+    assert halve(roc_aucs, [0, 1, 2, 3, 4], [0], 2) == [1, 3, 2]
+    assert halve(roc_aucs, [0, 2, 4], [0], 3) == [2]
+
+
+def test_unknown_search(data):
+    with pytest.raises(ValueError, match="search"):
+        search(data, search="random")
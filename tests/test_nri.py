@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.models.metrics import NRI_LABELS, calculate_nri, compute_nri_batch
+
+
+# Patients with triage categories by the old and the new classifier, and
+# the components of nribin(event, p.std, p.new, cut = c(2, 3, 4),
+# updown = "category") of R package nricens, derived from its definitions:
+# categories [-Inf, 2), [2, 3), [3, 4) and [4, Inf), closed to the left,
+# NRI+ = P(up | event) - P(down | event) and
+# NRI- = P(down | nonevent) - P(up | nonevent).
+EVENT = [1, 1, 1, 1, 1, 0, 0, 0, 0, 0]
+OLD = [1, 2, 3, 4, 0, 3, 2, 1, 4, 2.5]
+NEW = [2, 3, 3, 2, 1.9, 2, 1.99, 4, 5, 2]
+# Up: 1 -> 2 and 2 -> 3 are on the cuts. Down: 4 -> 2. Same: 0 -> 1.9
+# Down: 3 -> 2 and 2 -> 1.99. Up: 1 -> 4. Same: 4 -> 5 and 2.5 -> 2
+EXPECTED = pd.Series(
+    [0.4, 0.2, 0.2, 0.4, 0.2, 0.4, 0.2], index=NRI_LABELS
+)
+
+
+def test_calculate_nri_matches_nribin():
+    nri = calculate_nri(
+        y_true=np.array(EVENT), y_old=np.array(OLD), y_new=np.array(NEW),
+        cut=[2, 3, 4]
+    )
+
+    pd.testing.assert_series_equal(nri, EXPECTED)
+
+
+def test_calculate_nri_closes_categories_to_the_left():
+    # On the cut, up from [-Inf, 2) to [2, 3). Just below it, no change
+    nri = calculate_nri(
+        y_true=np.array([1, 1]), y_old=np.array([1.5, 1.5]),
+        y_new=np.array([2.0, np.nextafter(2.0, 0)]), cut=[2, 3, 4]
+    )
+
+    assert nri["pr_up_dead"] == 0.5
+    assert nri["pr_down_dead"] == 0.0
+
+
+def test_calculate_nri_sorts_cut():
+    nri = calculate_nri(
+        y_true=np.array(EVENT), y_old=np.array(OLD), y_new=np.array(NEW),
+        cut=[4, 2, 3]
+    )
+
+    pd.testing.assert_series_equal(nri, EXPECTED)
+
+
+def test_compute_nri_batch_matches_calculate_nri():
+    rng = np.random.default_rng(0)
+    y_true = rng.integers(0, 2, (5, 200))
+    y_old = rng.integers(0, 5, (5, 200))
+    y_new = np.clip(y_old + rng.integers(-1, 2, (5, 200)), 0, 4)
+
+    nri = compute_nri_batch(y_true, y_old, y_new, cut=[2, 3, 4])
+
+    assert nri.shape == (len(NRI_LABELS), 5)
+    for i in range(5):
+        np.testing.assert_array_equal(
+            nri[:, i],
+            calculate_nri(y_true[i], y_old[i], y_new[i], cut=[2, 3, 4])
+        )
+
+
+def test_compute_nri_batch_without_events_is_nan():
+    nri = compute_nri_batch(
+        y_true=np.zeros((1, 4)), y_old=np.array([[1, 2, 3, 4]]),
+        y_new=np.array([[2, 2, 3, 3]]), cut=[2, 3, 4]
+    )
+    nri = pd.Series(nri[:, 0], index=NRI_LABELS)
+
+    assert np.isnan(nri[["nri", "nri_plus", "pr_up_dead"]]).all()
+    assert nri["nri_minus"] == 0.0
+
+
+def test_calculate_nri_matches_r():
+    # Cross-checks with nribin itself, where R and nricens are installed
+    pytest.importorskip("rpy2")
+    rng = np.random.default_rng(1)
+    y_true = rng.integers(0, 2, 300)
+    y_old = rng.integers(0, 5, 300)
+    y_new = np.clip(y_old + rng.integers(-1, 2, 300), 0, 4)
+
+    pd.testing.assert_series_equal(
+        calculate_nri(y_true, y_old, y_new, cut=[2, 3, 4]),
+        calculate_nri(y_true, y_old, y_new, cut=[2, 3, 4], method="r")
+    )
@@ -0,0 +1,117 @@
+import itertools as it
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from sklearn.metrics import roc_auc_score
+
+from src.models.metrics import MAX_EXACT_CANDIDATES, find_optimal_breaks
+
+
+def mean_binned_roc_auc(y_probs, y_trues, breaks):
+    """Mean AUC of ROC over the folds, of the bins of pd.cut."""
+    return np.mean([
+        roc_auc_score(y_true, pd.cut(y_prob, breaks, labels=False))
+        for y_prob, y_true in zip(y_probs, y_trues)
+    ])
+
+
+def brute_force(y_probs, y_trues, n_bins):
+    """Greatest mean AUC over all breaks at the predicted values."""
+    candidates = np.unique(np.concatenate(y_probs))
+
+    return max(
+        mean_binned_roc_auc(y_probs, y_trues, (0, ) + cuts + (np.inf, ))
+        for cuts in it.combinations(candidates, n_bins - 1)
+    )
+
+
+def make_folds(n_folds, n, seed):
+    rng = np.random.default_rng(seed)
+    y_trues = [rng.integers(0, 2, n) for _ in range(n_folds)]
+    # Few distinct values, with ties within and between the folds
+    y_probs = [
+        np.clip(np.round(0.2 * y + rng.random(n) * 0.8, 1), 0.1, 1)
+        for y in y_trues
+    ]
+
+    return y_probs, y_trues
+
+
+@pytest.mark.parametrize("n_folds,n_bins,seed", [
+    (1, 4, 0), (1, 3, 1), (2, 4, 2), (3, 4, 3), (2, 2, 4)
+])
+def test_find_optimal_breaks_matches_brute_force(n_folds, n_bins, seed):
+    y_probs, y_trues = make_folds(n_folds, 60, seed)
+
+    breaks = find_optimal_breaks(y_probs, y_trues, n_bins=n_bins,
+                                 max_candidates=None)
+
+    assert len(breaks) == n_bins + 1
+    assert breaks[0] == 0 and breaks[-1] == np.inf
+    assert np.all(np.diff(breaks) > 0)
+    np.testing.assert_allclose(
+        mean_binned_roc_auc(y_probs, y_trues, breaks),
+        brute_force(y_probs, y_trues, n_bins),
+        rtol=0, atol=1e-12
+    )
+
+
+def test_find_optimal_breaks_compressed_candidates():
+    rng = np.random.default_rng(5)
+    y_true = rng.integers(0, 2, 2000)
+    y_prob = np.clip(0.2 * y_true + rng.random(2000) * 0.8, 0.001, 1)
+
+    breaks = find_optimal_breaks([y_prob], [y_true], max_candidates=20)
+
+    assert len(breaks) == 5
+    assert np.all(np.diff(breaks) > 0)
+    # The cuts are predicted probabilities
+    assert set(breaks[1:-1]) <= set(y_prob)
+
+
+def test_find_optimal_breaks_too_few_probabilities():
+    with pytest.raises(ValueError):
+        find_optimal_breaks([np.array([0.1, 0.2, 0.2])], [np.array([0, 1, 1])])
+
+
+@pytest.mark.parametrize("max_candidates", [10, 50])
+def test_find_optimal_breaks_compression_is_within_bound(max_candidates):
+    rng = np.random.default_rng(6)
+    y_true = (rng.random(1500) < 0.2).astype(int)
+    y_prob = np.clip(0.3 * y_true + rng.random(1500) * 0.7, 0.001, 1)
+    n_bins = 4
+
+    exact = find_optimal_breaks(
+        [y_prob], [y_true], n_bins=n_bins, max_candidates=None
+    )
+    compressed = find_optimal_breaks(
+        [y_prob], [y_true], n_bins=n_bins, max_candidates=max_candidates
+    )
+
+    # The greatest share of the 1s and 0s in one candidate group
+    q = np.linspace(0, 1, max_candidates + 1)[1:]
+    candidates = np.unique(np.quantile(y_prob, q, method="inverted_cdf"))
+    group = np.searchsorted(candidates, y_prob, side="left")
+    share = max(
+        (np.sum(y_true[group == g]) / y_true.sum() +
+         np.sum(1 - y_true[group == g]) / np.sum(1 - y_true)) / 2
+        for g in range(len(candidates))
+    )
+    loss = (
+        mean_binned_roc_auc([y_prob], [y_true], exact) -
+        mean_binned_roc_auc([y_prob], [y_true], compressed)
+    )
+    assert 0 <= loss <= (n_bins - 1) * share
+
+
+def test_find_optimal_breaks_bounds_exact_search():
+    y_prob = np.arange(1, MAX_EXACT_CANDIDATES + 2) / (
+        MAX_EXACT_CANDIDATES + 2
+    )
+    y_true = np.arange(len(y_prob)) % 2
+
+    with pytest.raises(ValueError, match="max_candidates"):
+        find_optimal_breaks([y_prob], [y_true], max_candidates=None)
+    assert len(find_optimal_breaks([y_prob], [y_true])) == 5
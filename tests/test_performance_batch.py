@@ -0,0 +1,112 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from sklearn.linear_model import LogisticRegression
+from sklearn.naive_bayes import GaussianNB
+
+from src.models.metrics import (
+    bootstrap,
+    compute_performance,
+    compute_performance_batch,
+    performance_to_dicts
+)
+
+
+KEYS = ["lr", "sgclf"]
+
+
+@pytest.fixture
+def samples():
+    rng = np.random.default_rng(0)
+    n_samples, n = 6, 80
+    y_true = rng.integers(0, 2, (n_samples, n))
+    # Rounded, so the scores have ties
+    y_probs = {
+        key: np.round(rng.random((n_samples, n)), 1) for key in KEYS
+    }
+    y_preds = {key: (y_prob > 0.5).astype(int)
+               for key, y_prob in y_probs.items()}
+    # A sample that predicts no 1s, where precision is undefined
+    y_preds["lr"][0] = 0
+    y_cut = np.digitize(y_probs["sgclf"], [0.25, 0.5, 0.75])
+    tc = rng.integers(0, 4, (n_samples, n)).astype(float)
+
+    return y_true, y_probs, y_preds, y_cut, tc
+
+
+def test_batch_matches_compute_performance(samples):
+    y_true, y_probs, y_preds, y_cut, tc = samples
+
+    performance = compute_performance_batch(
+        y_probs=y_probs, y_preds=y_preds, y_true=y_true,
+        y_pred_cuts={"sgclf": y_cut}, tc=tc
+    )
+
+    for r, batch in enumerate(performance_to_dicts(performance)):
+        assert list(batch) == KEYS
+        for key in KEYS:
+            expected = compute_performance(
+                y_prob=y_probs[key][r], y_pred=y_preds[key][r],
+                y_true=y_true[r],
+                y_pred_cut=y_cut[r] if key == "sgclf" else None,
+                tc=tc[r]
+            )
+            assert list(batch[key]) == list(expected)
+            np.testing.assert_allclose(
+                list(batch[key].values()), list(expected.values()),
+                rtol=0, atol=1e-12
+            )
+
+
+def test_batch_is_tidy(samples):
+    y_true, y_probs, y_preds, y_cut, tc = samples
+
+    performance = compute_performance_batch(
+        y_probs=y_probs, y_preds=y_preds, y_true=y_true[0],
+        y_pred_cuts={"sgclf": y_cut}, tc=tc[0]
+    )
+
+    assert list(performance.columns) == ["sample", "clf", "metric", "value"]
+    assert not performance.duplicated(["sample", "clf", "metric"]).any()
+    counts = performance.groupby(["sample", "clf"]).size().unstack()
+    assert (counts["lr"] == 3).all() and (counts["sgclf"] == 9).all()
+    assert list(performance["sample"].unique()) == list(range(6))
+
+
+def test_batch_gives_nan_for_one_class():
+    performance = compute_performance_batch(
+        y_probs={"lr": np.array([[0.2, 0.8]])},
+        y_preds={"lr": np.array([[0, 1]])},
+        y_true=np.array([[1, 1]])
+    )
+
+    values = performance.set_index("metric").value
+    assert np.isnan(values["roc_auc_con"])
+    assert values["rec"] == 0.25
+
+
+@pytest.mark.parametrize("mode", ["search", "refit", "predictions"])
+def test_bootstrap_modes_give_the_same_metrics(mode):
+    rng = np.random.default_rng(0)
+    X = pd.DataFrame(rng.normal(size=(150, 2)), columns=["a", "b"])
+    y = pd.Series((X.a + rng.normal(size=150) > 0).astype(int))
+    tc = pd.Series(rng.integers(0, 4, 150).astype(float))
+
+    stats = bootstrap(
+        X, y, tc, keys=["lr", "gnb", "sgclf"],
+        base_clfs=[LogisticRegression(), GaussianNB()],
+        meta_clf=LogisticRegression(),
+        all_hyper_parameters=[{"breaks": (0, 0.3, 0.6, 0.8, np.inf)}],
+        N=2, n_jobs=1, mode=mode, random_state=0
+    )
+
+    assert len(stats) == 2
+    for sample in stats:
+        assert list(sample) == ["lr", "gnb", "sgclf"]
+        assert list(sample["lr"]) == ["roc_auc_con", "prec", "rec"]
+        assert list(sample["sgclf"]) == [
+            "roc_auc_con", "prec", "rec", "roc_auc_cut",
+            "roc_auc_model_model", "roc_auc_model_tc", "nri", "nri_plus",
+            "nri_minus"
+        ]
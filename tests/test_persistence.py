@@ -0,0 +1,173 @@
+import os
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from sklearn.ensemble import (
+    RandomForestClassifier,
+    HistGradientBoostingClassifier
+)
+from sklearn.linear_model import LogisticRegression
+from sklearn.naive_bayes import GaussianNB
+
+from src.models.classifiers import StackedGeneralizationClassifier
+from src.models.compiled import CompiledTrees
+from src.models.persistence import (
+    FORMAT_VERSION,
+    METADATA_FILE,
+    read_metadata
+)
+
+
+BREAKS = (0, 0.2, 0.4, 0.6, np.inf)
+
+
+@pytest.fixture
+def data():
+    rng = np.random.default_rng(0)
+    X = pd.DataFrame(rng.normal(size=(400, 3)), columns=["a", "b", "c"])
+    y = pd.Series(
+        (X.a + X.b * X.c + rng.normal(size=400) > 0).astype(int)
+    )
+
+    return X, y
+
+
+def make_classifier(cross_fit=False):
+    sgclf = StackedGeneralizationClassifier(
+        base_clfs=[
+            LogisticRegression(),
+            GaussianNB(),
+            RandomForestClassifier(n_estimators=5, max_depth=4),
+            HistGradientBoostingClassifier(max_iter=5)
+        ],
+        meta_clf=LogisticRegression(),
+        cross_fit=cross_fit,
+        random_state=0
+    )
+    sgclf.hyper_parameters = {"breaks": BREAKS}
+
+    return sgclf
+
+
+@pytest.mark.parametrize("cross_fit", [False, True])
+@pytest.mark.parametrize("mmap_mode", ["r", None])
+def test_load_predicts_as_saved(data, tmp_path, cross_fit, mmap_mode):
+    X, y = data
+    sgclf = make_classifier(cross_fit).fit(X, y)
+    path = sgclf.save(str(tmp_path / "sgclf"))
+
+    loaded = StackedGeneralizationClassifier.load(path, mmap_mode=mmap_mode)
+
+    y_prob, y_cut = sgclf.predict(X)
+    y_prob_loaded, y_cut_loaded = loaded.predict(X)
+    np.testing.assert_allclose(y_prob_loaded, y_prob, rtol=0, atol=1e-12)
+    np.testing.assert_array_equal(y_cut_loaded, y_cut)
+    if not cross_fit:
+        assert isinstance(loaded.base_clfs_[2], CompiledTrees)
+        assert isinstance(loaded.base_clfs_[3], CompiledTrees)
+
+
+def test_read_metadata(data, tmp_path):
+    X, y = data
+    sgclf = make_classifier().fit(X, y)
+    path = sgclf.save(str(tmp_path / "sgclf"))
+
+    metadata = read_metadata(path)
+
+    assert metadata["format_version"] == FORMAT_VERSION
+    assert metadata["base_clfs"] == [
+        "LogisticRegression", "GaussianNB", "RandomForestClassifier",
+        "HistGradientBoostingClassifier"
+    ]
+    assert metadata["meta_clf"] == "LogisticRegression"
+    assert metadata["feature_names"] == ["a", "b", "c"]
+    assert metadata["hyper_parameters"]["breaks"][:4] == [0, 0.2, 0.4, 0.6]
+    assert not metadata["cross_fit"]
+
+
+def test_save_refuses_to_overwrite(data, tmp_path):
+    X, y = data
+    sgclf = make_classifier().fit(X, y)
+    path = sgclf.save(str(tmp_path / "sgclf"))
+
+    with pytest.raises(FileExistsError):
+        sgclf.save(path)
+    sgclf.save(path, overwrite=True)
+
+
+@pytest.mark.parametrize("version", [1, FORMAT_VERSION + 1])
+def test_load_rejects_other_formats(data, tmp_path, version):
+    X, y = data
+    path = make_classifier().fit(X, y).save(str(tmp_path / "sgclf"))
+    metadata_path = os.path.join(path, METADATA_FILE)
+    with open(metadata_path) as f:
+        metadata = json.load(f)
+    metadata["format_version"] = version
+    with open(metadata_path, "w") as f:
+        json.dump(metadata, f)
+
+    with pytest.raises(ValueError, match="format version"):
+        StackedGeneralizationClassifier.load(path)
+
+
+def test_loaded_classifier_refits(data, tmp_path):
+    X, y = data
+    sgclf = make_classifier().fit(X, y)
+    loaded = StackedGeneralizationClassifier.load(
+        sgclf.save(str(tmp_path / "sgclf"))
+    )
+
+    loaded.fit(X, y)
+
+    assert isinstance(loaded.base_clfs_[2], RandomForestClassifier)
+    np.testing.assert_allclose(
+        loaded.predict(X)[0], sgclf.predict(X)[0], rtol=0, atol=1e-12
+    )
+
+
+def test_failed_fit_keeps_fitted_classifiers(data, tmp_path):
+    X, y = data
+    loaded = StackedGeneralizationClassifier.load(
+        make_classifier().fit(X, y).save(str(tmp_path / "sgclf"))
+    )
+    y_prob, _ = loaded.predict(X)
+    base_clfs_ = loaded.base_clfs_
+
+    with pytest.raises(ValueError):
+        loaded.fit(X, y.iloc[:10])
+
+    assert loaded.base_clfs_ is base_clfs_
+    np.testing.assert_array_equal(loaded.predict(X)[0], y_prob)
+
+
+def test_loaded_classifier_runs_cv_outer_loop(data, tmp_path):
+    X, y = data
+    loaded = StackedGeneralizationClassifier.load(
+        make_classifier().fit(X, y).save(str(tmp_path / "sgclf"))
+    )
+
+    loaded.cv_outer_loop(
+        [{"breaks": BREAKS}], X, y, inner_folds=2, outer_folds=2
+    )
+
+    assert loaded.roc_aucs.notna().all(axis=None)
+
+
+def test_predict_to_file(data, tmp_path):
+    X, y = data
+    loaded = StackedGeneralizationClassifier.load(
+        make_classifier().fit(X, y).save(str(tmp_path / "sgclf"))
+    )
+    path = str(tmp_path / "predictions.csv")
+
+    n = loaded.predict_to_file(X, path, chunk_size=150)
+
+    predictions = pd.read_csv(path, index_col=0)
+    y_prob, y_cut = loaded.predict(X)
+    assert n == len(X)
+    np.testing.assert_array_equal(predictions.index, X.index)
+    np.testing.assert_allclose(predictions.y_prob_con, y_prob)
+    np.testing.assert_array_equal(predictions.y_prob_cut, y_cut)
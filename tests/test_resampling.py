@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from src.models.resampling import (
+    bootstrap_indices, out_of_bag_index, stratified_resample_index
+)
+
+
+@pytest.fixture
+def y():
+    # Classes of 50, 30 and 20 rows, in no particular order
+    return np.random.default_rng(0).permutation(
+        np.repeat(["a", "b", "c"], [50, 30, 20])
+    )
+
+
+def class_counts(y, index):
+    return dict(zip(*np.unique(y[index], return_counts=True)))
+
+
+def test_stratified_resample_keeps_proportions(y):
+    index = stratified_resample_index(y, 200, np.random.default_rng(0))
+
+    assert len(index) == 200
+    assert class_counts(y, index) == {"a": 100, "b": 60, "c": 40}
+
+
+def test_stratified_resample_gives_remainders_to_largest_fractions(y):
+    # Shares of 7 rows are 3.5, 2.1 and 1.4
+    index = stratified_resample_index(y, 7, np.random.default_rng(0))
+
+    assert class_counts(y, index) == {"a": 4, "b": 2, "c": 1}
+
+
+def test_stratified_resample_draws_within_each_class(y):
+    index = stratified_resample_index(y, 100, np.random.default_rng(1))
+
+    assert index.min() >= 0 and index.max() < len(y)
+    # Drawn with replacement, so some rows repeat
+    assert len(np.unique(index)) < len(index)
+
+
+def test_out_of_bag_is_complement():
+    train_index = np.array([3, 0, 3, 5, 0])
+
+    np.testing.assert_array_equal(
+        out_of_bag_index(train_index, 7), [1, 2, 4, 6]
+    )
+    assert len(out_of_bag_index(np.arange(4), 4)) == 0
+
+
+def test_bootstrap_indices_are_reproducible(y):
+    first = bootstrap_indices(y, len(y), 5, random_state=42)
+    second = bootstrap_indices(y, len(y), 5, random_state=42)
+
+    assert len(first) == 5
+    for (train, test), (train_again, test_again) in zip(first, second):
+        np.testing.assert_array_equal(train, train_again)
+        np.testing.assert_array_equal(test, test_again)
+
+
+def test_bootstrap_indices_differ_across_seeds_and_samples(y):
+    first = bootstrap_indices(y, len(y), 2, random_state=42)
+    other = bootstrap_indices(y, len(y), 2, random_state=43)
+
+    assert not np.array_equal(first[0][0], other[0][0])
+    assert not np.array_equal(first[0][0], first[1][0])
+
+
+def test_bootstrap_indices_are_stratified_and_disjoint(y):
+    for train, test in bootstrap_indices(y, len(y), 3, random_state=0):
+        assert class_counts(y, train) == {"a": 50, "b": 30, "c": 20}
+        assert not np.isin(test, train).any()
+        np.testing.assert_array_equal(
+            np.union1d(train, test), np.arange(len(y))
+        )
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from src.models.metrics import RunningQuantile, streaming_bootstrap_ci
+
+
+@pytest.mark.parametrize("q", [0.025, 0.5, 0.975])
+def test_running_quantile_exact_for_five_observations(q):
+    x = [3.0, 1.0, 4.0, 1.5, 9.0]
+    quantile = RunningQuantile(q)
+    for n in range(1, 6):
+        quantile.update(x[n - 1])
+
+        assert quantile.value() == np.quantile(x[:n], q)
+
+
+@pytest.mark.parametrize("q", [0.025, 0.5, 0.975])
+def test_running_quantile_estimates_quantile(q):
+    x = np.random.default_rng(0).normal(size=20000)
+    quantile = RunningQuantile(q)
+    for v in x:
+        quantile.update(v)
+
+    assert quantile.value() == pytest.approx(np.quantile(x, q), abs=0.05)
+
+
+def test_running_quantile_skips_nans():
+    x = [3.0, np.nan, 1.0, 4.0, np.nan, 1.5, 9.0, 2.0, 6.0]
+    quantile = RunningQuantile(0.5)
+    expected = RunningQuantile(0.5)
+    for v in x:
+        quantile.update(v)
+        if not np.isnan(v):
+            expected.update(v)
+
+    assert (quantile.n, quantile.n_nan) == (7, 2)
+    assert quantile.value() == expected.value()
+
+
+def test_running_quantile_of_nans_is_nan():
+    quantile = RunningQuantile(0.5)
+    quantile.update(np.nan)
+
+    assert np.isnan(quantile.value())
+
+
+def test_streaming_ci_with_nan_replicates():
+    rng = np.random.default_rng(0)
+    values = rng.normal(0.8, 0.02, 200)
+    values[::7] = np.nan
+    stats = [
+        {"sgclf": {"roc_auc_con": v, "roc_auc_tc": np.nan}} for v in values
+    ]
+
+    cis, n = streaming_bootstrap_ci(
+        iter(stats), {"sgclf": {"roc_auc_con": 0.8, "roc_auc_tc": 0.7}},
+        tol=0.01, patience=5, min_replicates=10
+    )
+
+    # Never stable, as one interval has no finite width
+    assert n == len(stats)
+    lb, ub = cis.loc[("sgclf", "roc_auc_con")]
+    finite = values[~np.isnan(values)]
+    assert lb == pytest.approx(1.6 - np.quantile(finite, 0.9), abs=0.01)
+    assert ub == pytest.approx(1.6 - np.quantile(finite, 0.1), abs=0.01)
+    assert cis.loc[("sgclf", "roc_auc_tc")].isna().all()
+
+
+def test_streaming_ci_stops_when_finite_widths_are_stable():
+    values = np.random.default_rng(0).normal(0.8, 0.02, 500)
+    values[::7] = np.nan
+    stats = [{"sgclf": {"roc_auc_con": v}} for v in values]
+
+    _, n = streaming_bootstrap_ci(
+        iter(stats), {"sgclf": {"roc_auc_con": 0.8}}, tol=0.01,
+        patience=5, min_replicates=10
+    )
+
+    assert 10 <= n < len(stats)
@@ -0,0 +1,152 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+from sklearn.naive_bayes import GaussianNB
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+
+from src.models.classifiers import StackedGeneralizationClassifier
+from src.models.metrics import bootstrap
+from src.models.resampling import (
+    BASE_CLASSIFIERS, BOOTSTRAP_SAMPLES, OUTER_FOLDS,
+    derive_seed, derive_seed_sequence, set_random_states
+)
+from src.models.train_model import stratified_folds
+
+
+@pytest.fixture
+def data():
+    rng = np.random.default_rng(0)
+    X = pd.DataFrame(rng.normal(size=(150, 2)), columns=["a", "b"])
+    y = pd.Series((X.a + X.a * X.b + rng.normal(size=150) > 0).astype(int))
+    tc = pd.Series(rng.integers(0, 4, 150).astype(float))
+
+    return X, y, tc
+
+
+def test_derive_seed_is_deterministic_and_independent_per_key():
+    seed = derive_seed(0, OUTER_FOLDS)
+
+    assert isinstance(seed, int) and 0 <= seed < 2 ** 32
+    assert derive_seed(0, OUTER_FOLDS) == seed
+    assert derive_seed(1, OUTER_FOLDS) != seed
+    assert derive_seed(0, BOOTSTRAP_SAMPLES) != seed
+    assert derive_seed(0, OUTER_FOLDS, 0) != derive_seed(0, OUTER_FOLDS, 1)
+
+
+def test_derive_seed_sequence_nests_keys():
+    assert derive_seed_sequence(None, OUTER_FOLDS) is None
+
+    nested = derive_seed_sequence(
+        derive_seed_sequence(0, BOOTSTRAP_SAMPLES), 3
+    )
+    flat = derive_seed_sequence(0, BOOTSTRAP_SAMPLES, 3)
+    np.testing.assert_array_equal(
+        nested.generate_state(4), flat.generate_state(4)
+    )
+    assert derive_seed(np.random.SeedSequence(0), 1) == derive_seed(0, 1)
+
+
+def test_set_random_states_seeds_nested_estimators():
+    pipeline = make_pipeline(
+        StandardScaler(), RandomForestClassifier(n_estimators=5)
+    )
+
+    set_random_states(pipeline, 0, BASE_CLASSIFIERS, 0)
+    seeds = pipeline.get_params()["randomforestclassifier__random_state"]
+    assert isinstance(seeds, int)
+    set_random_states(pipeline, 0, BASE_CLASSIFIERS, 1)
+    assert pipeline.get_params()[
+        "randomforestclassifier__random_state"
+    ] != seeds
+    # Estimators without a random_state are left as is
+    assert set_random_states(GaussianNB(), 0).get_params() == (
+        GaussianNB().get_params()
+    )
+
+
+def outer_loop(data, random_state=0, **kwargs):
+    X, y, _ = data
+    sgclf = StackedGeneralizationClassifier(
+        base_clfs=[
+            LogisticRegression(),
+            RandomForestClassifier(n_estimators=5)
+        ],
+        meta_clf=LogisticRegression(),
+        random_state=random_state,
+        **kwargs
+    )
+    sgclf.cv_outer_loop(
+        [{"breaks": (0, 0.3, 0.6, np.inf)},
+         {"breaks": (0, 0.45, 0.55, np.inf)}],
+        X, y, refit=False, inner_folds=2, outer_folds=3
+    )
+
+    return sgclf.roc_aucs
+
+
+def test_same_seed_gives_same_folds(data):
+    X, y, _ = data
+    sgclf = StackedGeneralizationClassifier(
+        base_clfs=[LogisticRegression()], meta_clf=LogisticRegression(),
+        random_state=0
+    )
+
+    splits = [
+        [test for _, test in sgclf._splitter(3, OUTER_FOLDS).split(X, y)]
+        for _ in range(2)
+    ]
+    for first, second in zip(*splits):
+        np.testing.assert_array_equal(first, second)
+    # Shuffled, unlike the folds without a seed
+    unseeded = stratified_folds(3, None, OUTER_FOLDS)
+    assert not np.array_equal(splits[0][0], next(unseeded.split(X, y))[1])
+
+
+def test_same_seed_gives_same_search_across_n_jobs(data):
+    roc_aucs = outer_loop(data)
+
+    pd.testing.assert_frame_equal(outer_loop(data), roc_aucs)
+    np.testing.assert_allclose(
+        outer_loop(data, n_jobs=2), roc_aucs, rtol=0, atol=1e-12
+    )
+    assert not np.allclose(outer_loop(data, random_state=1), roc_aucs)
+
+
+def run_bootstrap(data, n_jobs, random_state=0, mode="search"):
+    X, y, tc = data
+    stats = bootstrap(
+        X, y, tc, keys=["lr", "rf", "sgclf"],
+        base_clfs=[
+            LogisticRegression(),
+            RandomForestClassifier(n_estimators=5)
+        ],
+        meta_clf=LogisticRegression(),
+        all_hyper_parameters=[{"breaks": (0, 0.3, 0.6, 0.8, np.inf)}],
+        N=3, n_jobs=n_jobs, mode=mode, random_state=random_state
+    )
+
+    return np.array([
+        [value for key in sample for value in sample[key].values()]
+        for sample in stats
+    ])
+
+
+@pytest.mark.parametrize("mode", ["search", "predictions"])
+def test_same_seed_gives_same_bootstrap_across_n_jobs(data, mode):
+    stats = run_bootstrap(data, n_jobs=1, mode=mode)
+
+    np.testing.assert_array_equal(
+        run_bootstrap(data, n_jobs=1, mode=mode), stats
+    )
+    np.testing.assert_allclose(
+        run_bootstrap(data, n_jobs=2, mode=mode), stats,
+        rtol=0, atol=1e-12
+    )
+    assert not np.allclose(
+        run_bootstrap(data, n_jobs=1, random_state=1, mode=mode), stats,
+        equal_nan=True
+    )
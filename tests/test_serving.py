@@ -0,0 +1,200 @@
+import json
+import asyncio
+
+import numpy as np
+import pytest
+
+from src.models.serving import (
+    MicroBatcher,
+    PredictionService,
+    load_test,
+    parse_rows,
+    read_response
+)
+
+
+FEATURES = ["age", "sbp"]
+
+
+class Classifier():
+    """Predicts the age over 100, and NaN if the age is missing."""
+    feature_names_ = FEATURES
+
+    def predict(self, X):
+        y_prob = X["age"].to_numpy() / 100
+        y_prob_cut = np.where(np.isnan(y_prob), np.nan, y_prob > 0.5)
+        return y_prob, y_prob_cut
+
+
+def test_parse_rows():
+    rows, single = parse_rows(b'{"age": 40, "sbp": null}', FEATURES)
+
+    assert single
+    assert rows[0][0] == 40
+    assert np.isnan(rows[0][1])
+
+    rows, single = parse_rows(b'[{"sbp": 120.5}, {"age": 1}]', FEATURES)
+
+    assert not single
+    assert np.isnan(rows[0][0]) and rows[0][1] == 120.5
+    assert rows[1][0] == 1 and np.isnan(rows[1][1])
+
+
+@pytest.mark.parametrize("body", [
+    b'{"age": [1]}', b'{"age": {"a": 1}}', b'{"age": "40"}',
+    b'{"age": true}', b'{"age": NaN}', b'{"age": 1e999}', b'[1, 2]',
+    b'"age"', b'{"age": '
+])
+def test_parse_rows_rejects(body):
+    with pytest.raises(ValueError):
+        parse_rows(body, FEATURES)
+
+
+def test_micro_batcher_batches_concurrent_requests():
+    batches = []
+
+    def predict(rows):
+        batches.append(len(rows))
+        y_prob = np.array([row[0] for row in rows])
+        return y_prob, y_prob > 0.5
+
+    async def main():
+        batcher = MicroBatcher(predict, window=0.05, max_batch=100)
+        try:
+            return await asyncio.gather(*(
+                batcher.submit([[i / 10], [i / 10]]) for i in range(5)
+            ))
+        finally:
+            batcher.close()
+
+    predictions = asyncio.run(main())
+
+    assert batches == [10]
+    for i, prediction in enumerate(predictions):
+        assert [y_prob for y_prob, _ in prediction] == [i / 10] * 2
+        assert [y_cut for _, y_cut in prediction] == [i / 10 > 0.5] * 2
+
+
+def test_micro_batcher_flushes_full_batches():
+    batches = []
+
+    def predict(rows):
+        batches.append(len(rows))
+        return np.zeros(len(rows)), np.zeros(len(rows))
+
+    async def main():
+        batcher = MicroBatcher(predict, window=10, max_batch=4)
+        try:
+            await asyncio.wait_for(asyncio.gather(
+                batcher.submit([[0]] * 3), batcher.submit([[0]] * 2)
+            ), timeout=5)
+        finally:
+            batcher.close()
+
+    asyncio.run(main())
+
+    assert batches == [5]
+
+
+def test_micro_batcher_fails_only_bad_requests():
+    def predict(rows):
+        if any(row[0] < 0 for row in rows):
+            raise ValueError("negative")
+        return np.array([row[0] for row in rows]), np.zeros(len(rows))
+
+    async def main():
+        batcher = MicroBatcher(predict, window=0.05)
+        try:
+            return await asyncio.gather(
+                batcher.submit([[1]]), batcher.submit([[-1]]),
+                batcher.submit([[2]]), return_exceptions=True
+            )
+        finally:
+            batcher.close()
+
+    good, bad, other = asyncio.run(main())
+
+    assert isinstance(bad, ValueError)
+    assert good[0][0] == 1 and other[0][0] == 2
+
+
+async def request(port, method, path, body=b""):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(
+        "{m} {p} HTTP/1.1\r\nConnection: close\r\n"
+        "Content-Length: {n}\r\n\r\n".format(
+            m=method, p=path, n=len(body)
+        ).encode() + body
+    )
+    await writer.drain()
+    try:
+        return await read_response(reader)
+    finally:
+        writer.close()
+
+
+async def serving(func):
+    service = PredictionService(Classifier(), window=0.001)
+    server = await asyncio.start_server(service.handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    try:
+        async with server:
+            return await func(port)
+    finally:
+        service.batcher.close()
+
+
+def test_service_predicts():
+    async def main(port):
+        return await asyncio.gather(
+            request(port, "POST", "/predict", b'{"age": 80}'),
+            request(port, "POST", "/predict", b'[{"age": 20}, {"sbp": 1}]'),
+            request(port, "GET", "/health")
+        )
+
+    single, many, health = asyncio.run(serving(main))
+
+    assert single == (200, {"y_prob_con": 0.8, "y_prob_cut": 1})
+    assert many == (200, [
+        {"y_prob_con": 0.2, "y_prob_cut": 0},
+        {"y_prob_con": None, "y_prob_cut": None}
+    ])
+    assert health == (200, {"status": "ok"})
+
+
+@pytest.mark.parametrize("method,path,body,status", [
+    ("POST", "/predict", b'{"age": [1]}', 400),
+    ("POST", "/predict", b'{"age": "x"}', 400),
+    ("POST", "/predict", b'not json', 400),
+    ("GET", "/predict", b'', 405),
+    ("GET", "/nowhere", b'', 404)
+])
+def test_service_rejects(method, path, body, status):
+    async def main(port):
+        response = await request(port, method, path, body)
+        # The service keeps serving after a bad request
+        return response, await request(port, "GET", "/health")
+
+    (code, response), (health, _) = asyncio.run(serving(main))
+
+    assert code == status
+    assert "error" in response
+    assert health == 200
+
+
+def test_load_test():
+    async def main(port):
+        return await load_test(
+            [{"age": 10}, {"age": 90, "sbp": 100}], port=port, requests=40,
+            concurrency=4, batch=3
+        )
+
+    result = asyncio.run(serving(main))
+
+    assert result["requests"] == 40
+    assert result["rows"] == 120
+    assert result["errors"] == 0
+    assert result["service"]["requests"] == 40
+    assert result["service"]["rows"] == 120
+    assert result["latency_p50_ms"] <= result["latency_p99_ms"]
+    json.dumps(result, allow_nan=False)
@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from sklearn.compose import ColumnTransformer
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import OneHotEncoder, StandardScaler
+
+from src.models.classifiers import StackedGeneralizationClassifier
+from src.models.shared import SharedData
+
+
+@pytest.fixture
+def data():
+    rng = np.random.default_rng(0)
+    n = 300
+    X = pd.DataFrame({
+        "age": rng.integers(18, 90, n).astype(np.int16),
+        "sbp": rng.normal(120, 20, n),
+        "mechanism": rng.choice(["rta", "fall", "assault"], n)
+    }, index=np.arange(n) + 1000)
+    y = pd.Series(
+        ((X.mechanism == "rta") ^ (rng.random(n) < 0.2)).astype(int),
+        index=X.index, name="died"
+    )
+
+    return X, y
+
+
+@pytest.mark.parametrize("memmap", [False, True])
+def test_shared_data_keeps_strings(data, memmap):
+    X, y = data
+    rows = np.array([3, 1, 1, 7])
+
+    with SharedData(X, y, memmap=memmap) as shared:
+        X_taken, y_taken, tc = shared.take(rows)
+
+        assert not shared.memmap
+        assert len(shared) == len(X)
+
+    pd.testing.assert_frame_equal(
+        X_taken, X.iloc[rows].reset_index(drop=True)
+    )
+    np.testing.assert_array_equal(y_taken, y.iloc[rows])
+    assert tc is None
+
+
+def test_shared_data_memmaps_numbers(data):
+    X, y = data
+    X = X.drop(columns="mechanism")
+    rows = np.array([3, 1, 1, 7])
+
+    with SharedData(X, y, memmap=True) as shared:
+        X_taken, _, _ = shared.take(rows)
+
+        assert shared.memmap
+        np.testing.assert_array_equal(X_taken, X.iloc[rows])
+
+
+def test_shared_data_serial_keeps_dtypes(data):
+    X, y = data
+
+    with SharedData(X, y, memmap=False) as shared:
+        X_taken, _, _ = shared.take()
+
+    pd.testing.assert_series_equal(X_taken.dtypes, X.dtypes)
+
+
+@pytest.mark.parametrize("n_jobs", [None, 2])
+def test_fit_with_string_column(data, n_jobs):
+    X, y = data
+    preprocessor = ColumnTransformer([
+        ("num", StandardScaler(), ["age", "sbp"]),
+        ("cat", OneHotEncoder(), ["mechanism"])
+    ])
+    sgclf = StackedGeneralizationClassifier(
+        base_clfs=[Pipeline([
+            ("preprocessor", preprocessor),
+            ("logisticregression", LogisticRegression())
+        ])],
+        meta_clf=LogisticRegression(),
+        n_jobs=n_jobs,
+        random_state=0
+    )
+    sgclf.hyper_parameters = {"breaks": (0, 0.2, 0.5, 0.8, np.inf)}
+
+    sgclf.fit(X, y)
+    y_prob, _ = sgclf.predict(X)
+
+    assert y_prob.shape == (len(X), )
+    assert np.isfinite(y_prob).all()
@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+
+from src.models.train_model import (
+    cv_outer_loop,
+    predict_meta_features,
+    seed_classifiers,
+    stratified_folds
+)
+from src.models.resampling import OUTER_FOLDS
+
+
+BREAKS = [(0, 0.3, 0.6, np.inf), (0, 0.2, 0.5, np.inf)]
+
+
+@pytest.fixture
+def data():
+    rng = np.random.default_rng(0)
+    X = pd.DataFrame(rng.normal(size=(240, 3)), columns=["a", "b", "c"])
+    y = pd.Series((X.a + X.b * X.c + rng.normal(size=240) > 0).astype(int))
+
+    return X, y
+
+
+def run(data, **kwargs):
+    X, y = data
+    all_hyper_parameters = [
+        {"breaks": breaks, "randomforestclassifier__max_depth": depth}
+        for depth in (2, 4) for breaks in BREAKS
+    ]
+    base_clfs_, meta_clf_, best = cv_outer_loop(
+        [LogisticRegression(), RandomForestClassifier(n_estimators=5)],
+        LogisticRegression(), all_hyper_parameters, X, y, **kwargs
+    )
+    y_prob = meta_clf_.predict_proba(
+        predict_meta_features(base_clfs_, X)
+    )[:, 1]
+
+    return y_prob, best
+
+
+@pytest.mark.parametrize("n_jobs", [None, 2])
+def test_cv_outer_loop_is_reproducible(data, n_jobs):
+    y_prob, best = run(data, random_state=3, inner_folds=2, outer_folds=3)
+
+    y_prob_again, best_again = run(
+        data, random_state=3, inner_folds=2, outer_folds=3, n_jobs=n_jobs
+    )
+
+    # Workers fit to memory-mapped copies, which may differ in the last bit
+    np.testing.assert_allclose(y_prob_again, y_prob, rtol=0, atol=1e-12)
+    assert best_again == best
+
+
+def test_stratified_folds_are_seeded(data):
+    X, y = data
+
+    def val_indices(folds):
+        return [val_index.tolist() for _, val_index in folds.split(X, y)]
+
+    unshuffled = val_indices(stratified_folds(3))
+    seeded = val_indices(stratified_folds(3, 3, OUTER_FOLDS))
+
+    assert seeded == val_indices(stratified_folds(3, 3, OUTER_FOLDS))
+    assert seeded != unshuffled
+    assert seeded != val_indices(stratified_folds(3, 4, OUTER_FOLDS))
+    assert sorted(i for fold in seeded for i in fold) == list(range(len(y)))
+
+
+def test_seed_classifiers_copies(data):
+    rf = RandomForestClassifier()
+    base_clfs, meta_clf = seed_classifiers(
+        {"rf": rf, "lr": LogisticRegression()}, LogisticRegression(), 3
+    )
+
+    assert rf.random_state is None
+    assert base_clfs["rf"] is not rf
+    assert isinstance(base_clfs["rf"].random_state, int)
+    assert base_clfs["rf"].random_state != meta_clf.random_state
+
+    unseeded, _ = seed_classifiers([rf], LogisticRegression())
+    assert unseeded[0].random_state is None